@@ -0,0 +1,57 @@
+"""
+Compare the throughput of the hand-written parser and the lark grammar
+parser on large generated programs:
+
+    python -m benchmarks.parser_benchmark [size in KB ...]
+"""
+
+import sys
+import time
+
+from src.tea import Parser, lark_parser
+
+
+def generate(size):
+    """A program of about size bytes of nested definitions and calls."""
+    forms = []
+    total = 0
+    index = 0
+    while total < size:
+        form = (
+            f"[def fn{index} [x y] [begin [var z [+ x {index}]] "
+            f"[if [> z y] [* z 2.5] [- y -1]]]] /* {index} */ [fn{index} 1 2]"
+        )
+        forms.append(form)
+        total += len(form) + 1
+        index += 1
+    return "[begin\n" + "\n".join(forms) + "\n]"
+
+
+def measure(parse, code, repeat=3):
+    """Best time of a few runs of parse(code)."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        parse(code)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main(sizes):
+    parsers = [("builtin", Parser.parse)]
+    try:
+        parsers.append(("lark", lark_parser().parse))
+    except ImportError:
+        print("lark is not installed: only the builtin parser runs\n")
+
+    print(f"{'size':>10} {'parser':>8} {'seconds':>9} {'MB/s':>7}")
+    for size in sizes:
+        code = generate(size)
+        for name, parse in parsers:
+            seconds = measure(parse, code)
+            mb_per_second = len(code) / seconds / 1e6
+            print(f"{len(code):>10} {name:>8} {seconds:>9.3f} {mb_per_second:>7.2f}")
+
+
+if __name__ == "__main__":
+    main([int(arg) * 1000 for arg in sys.argv[1:]] or [100_000, 1_000_000])
@@ -0,0 +1,258 @@
+"""
+Time representative tea workloads, and catch regressions against a saved
+baseline:
+
+    python -m benchmarks.suite [--engine closure --engine vm ...]
+        [--only fib --only loops ...] [--repeat 5] [--scale 1.0]
+        [--save results.json] [--baseline baseline.json] [--threshold 0.1]
+
+Every workload reports its best ops/sec over the repeats (ops are the
+calls, iterations, objects... it makes, see WORKLOADS) and its peak
+Python memory. With --baseline, a workload whose ops/sec drop, or whose
+peak memory grows, by more than the threshold is a regression, and the
+exit status is 1.
+"""
+
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+
+from src.tea import BUILTINS, ENGINES, Environment, Parser, Tea
+
+from .parser_benchmark import generate
+
+# name -> (unit, function of (tea, scale) that returns (run, ops per run))
+WORKLOADS = {}
+
+
+def workload(name, unit):
+    def register(make):
+        WORKLOADS[name] = (unit, make)
+        return make
+
+    return register
+
+
+@workload("fib", "calls")
+def fib(tea, scale):
+    n = max(2, round(20 + 2 * (scale - 1)))
+    tea.cmp("[def fib [n] [if [< n 2] n [+ [fib [- n 1]] [fib [- n 2]]]]]")
+    # fib(n) makes 2 fib(n + 1) - 1 calls
+    calls = [1, 1]
+    for _ in range(n):
+        calls.append(calls[-1] + calls[-2] + 1)
+    return lambda: tea.cmp(f"[fib {n}]"), calls[n]
+
+
+@workload("loops", "iterations")
+def loops(tea, scale):
+    n = int(50_000 * scale)
+    code = f"""
+    [var total 0]
+    [for [var i 0] [< i {n}] [++ i]
+        [set total [+ total [% [* i 3] 7]]]]
+    [var j {n}]
+    [while [> j 0] [begin [-= j 1] [set total [- total 1]]]]
+    total"""
+    return lambda: tea.cmp(code), 2 * n
+
+
+@workload("closures", "closures")
+def closures(tea, scale):
+    n = int(20_000 * scale)
+    tea.cmp("[def adder [x] [lambda [y] [+ x y]]]")
+    code = f"""
+    [var sum 0]
+    [for [var i 0] [< i {n}] [++ i]
+        [set sum [[adder i] 1]]]
+    sum"""
+    return lambda: tea.cmp(code), n
+
+
+@workload("classes", "objects")
+def classes(tea, scale):
+    n = int(10_000 * scale)
+    tea.cmp(
+        """
+        [class Point null [begin
+            [def constructor [this x y] [begin
+                [set [prop this x] x]
+                [set [prop this y] y]]]
+            [def norm [this] [+ [* [prop this x] [prop this x]]
+                                [* [prop this y] [prop this y]]]]]]
+        [class Point3 Point [begin
+            [def constructor [this x y z] [begin
+                [[prop [super Point3] constructor] this x y]
+                [set [prop this z] z]]]
+            [def norm [this] [+ [[prop [super Point3] norm] this]
+                                [* [prop this z] [prop this z]]]]]]
+        """
+    )
+    code = f"""
+    [var total 0]
+    [for [var i 0] [< i {n}] [++ i]
+        [begin
+            [var p [new Point3 i 1 2]]
+            [set total [+ total [[prop p norm] p]]]]]
+    total"""
+    return lambda: tea.cmp(code), n
+
+
+@workload("switch", "dispatches")
+def switch(tea, scale):
+    n = int(20_000 * scale)
+    # switch evaluates the else of its last case as a condition
+    tea.cmp(
+        """
+        [var else true]
+        [def classify [n] [switch
+            [[= [% n 5] 0] 5]
+            [[= [% n 4] 0] 4]
+            [[= [% n 3] 0] 3]
+            [[= [% n 2] 0] 2]
+            [else 1]]]
+        """
+    )
+    code = f"""
+    [var total 0]
+    [for [var i 0] [< i {n}] [++ i]
+        [set total [+ total [classify i]]]]
+    total"""
+    return lambda: tea.cmp(code), n
+
+
+@workload("import", "imports")
+def import_(tea, scale):
+    n = max(1, int(50 * scale))
+    engine = tea.engine
+
+    def run():
+        # A module is only loaded once per global environment
+        for _ in range(n):
+            Tea(Environment(dict(BUILTINS)), engine=engine).cmp("[import math]")
+
+    return run, n
+
+
+@workload("parse", "KB")
+def parse(tea, scale):
+    code = generate(int(200_000 * scale))
+    return lambda: Parser.parse(code), len(code) / 1000
+
+
+def measure(name, engine, repeat=5, scale=1.0):
+    """The best ops/sec and the peak memory of a workload on an engine."""
+    unit, make = WORKLOADS[name]
+    tea = Tea(Environment(dict(BUILTINS)), engine=engine)
+    run, ops = make(tea, scale)
+    run()  # warm up: compile, fill the caches
+
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        best = min(best, time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        run()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "unit": unit,
+        "ops": ops,
+        "seconds": best,
+        "ops_per_second": ops / best,
+        "peak_bytes": peak,
+    }
+
+
+def run_suite(engines=("closure",), names=None, repeat=5, scale=1.0, report=print):
+    """Measure workloads on engines; return the results, by engine and name."""
+    results = {}
+    report(
+        f"{'engine':>8} {'workload':>10} {'ops/sec':>12} {'unit':>11} {'peak KB':>9}"
+    )
+    for engine in engines:
+        for name in names or WORKLOADS:
+            result = measure(name, engine, repeat, scale)
+            results.setdefault(engine, {})[name] = result
+            report(
+                f"{engine:>8} {name:>10} {result['ops_per_second']:>12,.0f} "
+                f"{result['unit']:>11} {result['peak_bytes'] / 1024:>9,.0f}"
+            )
+    return results
+
+
+def compare(results, baseline, threshold=0.1, report=print):
+    """
+    Compare results with baseline results; return the regressions, as
+    (engine, name, metric, change) with change as a fraction.
+    """
+    regressions = []
+    report(f"\n{'engine':>8} {'workload':>10} {'ops/sec':>9} {'peak':>9}")
+    for engine, workloads in results.items():
+        for name, result in workloads.items():
+            old = baseline.get(engine, {}).get(name)
+            if old is None:
+                continue
+            speed = result["ops_per_second"] / old["ops_per_second"] - 1
+            memory = result["peak_bytes"] / max(old["peak_bytes"], 1) - 1
+            flags = ""
+            if speed < -threshold:
+                regressions.append((engine, name, "ops_per_second", speed))
+                flags += " slower"
+            if memory > threshold:
+                regressions.append((engine, name, "peak_bytes", memory))
+                flags += " bigger"
+            report(f"{engine:>8} {name:>10} {speed:>+9.1%} {memory:>+9.1%}{flags}")
+    return regressions
+
+
+def save(path, results):
+    document = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "results": results,
+    }
+    with open(path, mode="w") as f:
+        json.dump(document, f, indent=2)
+
+
+def load(path):
+    with open(path) as f:
+        return json.load(f)["results"]
+
+
+def main(argv):
+    options = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    options.add_argument("--engine", action="append", choices=ENGINES)
+    options.add_argument("--only", action="append", choices=list(WORKLOADS))
+    options.add_argument("--repeat", type=int, default=5)
+    options.add_argument("--scale", type=float, default=1.0)
+    options.add_argument("--save", metavar="JSON")
+    options.add_argument("--baseline", metavar="JSON")
+    options.add_argument("--threshold", type=float, default=0.1)
+    args = options.parse_args(argv)
+
+    results = run_suite(
+        args.engine or ["closure"], args.only, args.repeat, args.scale
+    )
+    if args.save:
+        save(args.save, results)
+    if args.baseline:
+        regressions = compare(results, load(args.baseline), args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) over {args.threshold:.0%}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
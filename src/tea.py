@@ -1,195 +1,4826 @@
 #!/usr/bin/env python3
 
-import inspect
+import asyncio
+import bisect
+import collections
+import contextlib
+import functools
+import hashlib
+import itertools
+import math
+import mmap
 import operator
 import os
+import pickle
+import re
+import struct
 import sys
-import traceback
+import threading
+import time
+import weakref
+from array import array
+from concurrent.futures import ProcessPoolExecutor
 
 FILE_EXTENSION = "tea"
 VERSION_INFO = "tea version 0.0.2 2023-07-11"
 EOF = "EOF"
+UNSET = object()  # a slot whose variable is not declared yet
+ENGINES = ("closure", "tree", "stack", "vm")
+PARSERS = ("builtin", "lark")
 
 
 class Parser:
+    TOKEN = re.compile(
+        r"""
+        /\*.*?\*/                          # a comment
+      | (?P<string>"(?:[^"\\\n]|\\.)*")     # a string: each word is a symbol
+      | (?P<unclosed>/\*)                   # a comment that does not end (yet)
+      | (?P<token>[\[\]]|[^\s\[\]]+)        # a bracket, or a run of anything else
+        """,
+        re.DOTALL | re.VERBOSE,
+    )
+    WORD = re.compile(r"\S+")
+
+    @classmethod
+    def scan(cls, code, base=0):
+        """
+        Yield the (offset, token) pairs of code. Comments are skipped, and
+        brackets inside strings are part of their words. A comment that is
+        still open at the end of code yields (offset, None).
+        """
+        for match in cls.TOKEN.finditer(code):
+            kind = match.lastgroup
+            if kind == "token":
+                yield base + match.start(), match.group()
+            elif kind == "string":
+                start = base + match.start()
+                for word in cls.WORD.finditer(match.group()):
+                    yield start + word.start(), word.group()
+            elif kind == "unclosed":
+                yield base + match.start(), None
+
     @classmethod
     def tokenize(cls, code):
         """Transform code into a list object of tokens."""
-        return code.replace('[', ' [ ').replace(']', ' ] ').split()
+        return [token for _, token in cls.scan(code)]
+
+    @classmethod
+    def atomizer(cls, token):
+        """Numbers become numbers; every other token is a symbol."""
+        try:
+            return int(token)
+        except ValueError:
+            try:
+                return float(token)
+            except ValueError:
+                return str(token)
+
+    @classmethod
+    def to_list(cls, tokens):
+        """
+        Convert a list of tokens into a "list" data structure. The tokens of
+        the expression are consumed from the list.
+        """
+        expr, end = cls._build(enumerate(tokens))
+        del tokens[: end + 1]
+        return expr
+
+    @classmethod
+    def _build(cls, tokens, offsets=None):
+        """
+        Build the first expression of an iterable of (position, token) pairs
+        in a single pass. Return it with the position of its last token.
+        """
+        stack = []  # the lists still waiting for their "]"
+        atoms = {}  # symbols repeat a lot: atomize each token text once
+        for position, token in tokens:
+            if token == "[":
+                _list = []
+                if offsets is not None:
+                    offsets[id(_list)] = position
+                stack.append(_list)
+                continue
+
+            if token is None:
+                raise SyntaxError("Unterminated comment")
+            if token == "]":
+                if not stack:
+                    raise SyntaxError('Unexpected token "]"')
+                expr = stack.pop()
+            elif token in atoms:
+                expr = atoms[token]
+            else:
+                expr = atoms[token] = cls.atomizer(token)
+
+            if not stack:
+                return expr, position
+            stack[-1].append(expr)
+
+        raise SyntaxError("Unexpected EOF")
+
+    @classmethod
+    def parse(cls, code, offsets=None):
+        """
+        Parse a code expression. When an offsets dict is given, it maps the
+        id() of every parsed list to the source offset of its "[".
+        """
+        return cls._build(cls.scan(code), offsets)[0]
+
+
+class Reader:
+    """
+    Read the top-level forms of a file object (a file, a pipe, stdin) one
+    at a time: each form is parsed and yielded as soon as its brackets
+    balance, so evaluation can start before the input ends and memory
+    does not grow with the input.
+    """
+
+    def __init__(self, stream, offsets=None):
+        self.stream = stream
+        self.offsets = offsets  # filled like the offsets of `Parser.parse`
+        self.lines = [0]  # the offsets of the lines read since the form began
+        self.line = 1  # the number of the first of them
+
+    def __iter__(self):
+        tokens = self.tokens()
+        for first in tokens:
+            # The lines before the one the form starts on are done with
+            start = bisect.bisect_right(self.lines, first[0]) - 1
+            del self.lines[:start]
+            self.line += start
+            yield Parser._build(itertools.chain([first], tokens), self.offsets)[0]
+
+    def locate(self, offset):
+        """The line and column of an offset in the last form read."""
+        index = bisect.bisect_right(self.lines, offset) - 1
+        return self.line + index, offset - self.lines[index] + 1
+
+    def tokens(self):
+        """Yield the (offset, token) pairs of the stream, line by line."""
+        pending = ""  # the start of a comment that continues on a later line
+        offset = 0  # of pending in the stream
+
+        for line in iter(self.stream.readline, ""):
+            self.lines.append(self.lines[-1] + len(line))
+            text = pending + line
+            pending = ""
+            for position, token in Parser.scan(text, offset):
+                if token is None:
+                    pending = text[position - offset :]
+                    break
+                yield position, token
+            offset += len(text) - len(pending)
+
+        if pending:
+            yield offset, None  # unterminated comment
+
+
+class SourceMap:
+    """
+    Where the lists of parsed programs come from, in a side table: the
+    id() of a list maps to its source, line and column, so evaluation
+    neither carries nor checks positions. The table keeps the lists it
+    describes alive, since a dead list's id can be reused, until `release`
+    forgets them once their top-level form has run. Only function bodies
+    are kept past their form, for the functions made from them, and only
+    the last BODIES of them.
+    """
+
+    COLUMN_BITS = LINE_BITS = 24  # source << 48 | line << 24 | column
+    BODIES = 10_000
+    BODY_INDEXES = {"lambda": 2, "def": 3, "defmemo": 3}  # of the function forms
+
+    def __init__(self):
+        self.names = []  # of the sources
+        self.sources = {}  # name -> index in names
+        self.positions = {}  # id(list) -> position
+        self.lists = {}  # id(list) -> list
+        self.recent = []  # the ids added since the last release
+        self.bodies = collections.deque()  # the ids of each body, oldest first
+
+    def add(self, program, offsets, name, locate):
+        """
+        Record the positions of the lists of a program read from the source
+        called name, given their offsets and locate(offset) -> (line, column).
+        """
+        source = self.sources.get(name)
+        if source is None:
+            source = self.sources[name] = len(self.names)
+            self.names.append(name)
+        base = source << self.LINE_BITS
+        exprs = [program]
+        while exprs:
+            expr = exprs.pop()
+            if type(expr) is list:
+                offset = offsets.get(id(expr))
+                if offset is not None:
+                    line, column = locate(offset)
+                    self._add(expr, (base | line) << self.COLUMN_BITS | column)
+                exprs.extend(expr)
+        return program
+
+    def parse(self, code, name):
+        """Parse code as a [begin ...] body, and record its positions."""
+        offsets = {}
+        tokens = itertools.chain(
+            [(0, "["), (0, "begin")], Parser.scan(code), [(len(code), "]")]
+        )
+        body = Parser._build(tokens, offsets)[0]
+        lines = [0] + [match.end() for match in re.finditer("\n", code)]
+
+        def locate(offset):
+            line = bisect.bisect_right(lines, offset)
+            return line, offset - lines[line - 1] + 1
+
+        return self.add(body, offsets, name, locate)
+
+    def copy(self, old, new):
+        """Give new, a rewrite of old, the position of old, unless it has one."""
+        position = self.positions.get(id(old))
+        if position is not None and id(new) not in self.positions:
+            self._add(new, position)
+
+    def _add(self, expr, position):
+        key = id(expr)
+        self.positions[key] = position
+        self.lists[key] = expr
+        self.recent.append(key)
+
+    def release(self):
+        """Forget the lists added since the last release, but function bodies."""
+        recent, self.recent = self.recent, []
+        fresh = set(recent)
+        owned = set()  # by a function body
+        seen = set()
+        exprs = [self.lists[key] for key in recent]
+        while exprs:
+            expr = exprs.pop()
+            if type(expr) is not list or id(expr) in seen:
+                continue
+            seen.add(id(expr))
+            exprs.extend(expr)
+            head = expr[0] if expr else None
+            index = self.BODY_INDEXES.get(head) if isinstance(head, str) else None
+            if index is not None and len(expr) > index:
+                keys = self._claim(expr[index], fresh, owned)
+                if keys:
+                    self.bodies.append(keys)
+        for key in recent:
+            if key not in owned:
+                self._forget(key)
+        while len(self.bodies) > self.BODIES:
+            for key in self.bodies.popleft():
+                self._forget(key)
+
+    @staticmethod
+    def _claim(body, fresh, owned):
+        """The ids in fresh of the lists of a body that no other body owns."""
+        keys = []
+        exprs = [body]
+        while exprs:
+            expr = exprs.pop()
+            if type(expr) is list:
+                if id(expr) in fresh and id(expr) not in owned:
+                    owned.add(id(expr))
+                    keys.append(id(expr))
+                exprs.extend(expr)
+        return keys
+
+    def _forget(self, key):
+        del self.positions[key]
+        del self.lists[key]
+
+    def where(self, expr):
+        """The "name:line:column" of a list, or None if it has no position."""
+        position = self.positions.get(id(expr))
+        if position is None:
+            return None
+        column = position & ((1 << self.COLUMN_BITS) - 1)
+        position >>= self.COLUMN_BITS
+        line = position & ((1 << self.LINE_BITS) - 1)
+        return f"{self.names[position >> self.LINE_BITS]}:{line}:{column}"
+
+
+class Transformer:
+    @staticmethod
+    def transform_def_to_var_lambda(def_expr):
+        name = def_expr[1]
+        params = def_expr[2]
+        body = def_expr[3]
+        return ["var", name, ["lambda", params, body]]
+
+    @staticmethod
+    def transform_switch_to_if(switch_expr):
+        cases = switch_expr[1:]
+
+        if_expr = ["if", None, None, None]
+        current = if_expr
+
+        for index, case in enumerate(cases, start=1):
+            [_cond, _block] = cases[index - 1]  # else case
+            current[1] = _cond
+            current[2] = _block
+            [next_cond, next_block] = case
+
+            if next_cond == "else":
+                current[3] = next_block
+            else:
+                current[3] = ["if", None, None, None]
+
+            current = current[3]
+
+        return if_expr
+
+    @staticmethod
+    def transform_for_to_while(for_expr):
+        [_, init, cond, modifier, body] = for_expr
+        return ["begin", init, ["while", cond, ["begin", body, modifier]]]
+
+    @staticmethod  # [var name [memo [lambda params body] size ttl]]
+    def transform_defmemo_to_var_memo(defmemo_expr):
+        [_, name, params, body, *options] = defmemo_expr
+        return ["var", name, ["memo", ["lambda", params, body], *options]]
+
+    @staticmethod  # [set foo [+ foo 1]]
+    def transform_incr_to_set(inc_expr):
+        [_, expr] = inc_expr
+        return ["set", expr, ["+", expr, 1]]
+
+    @staticmethod  # [set foo [- foo 1]]
+    def transform_decr_to_set(dec_expr):
+        [_, expr] = dec_expr
+        return ["set", expr, ["-", expr, 1]]
+
+    @staticmethod  # [set foo [+ foo value]]
+    def transform_incr_val_to_set(inc_expr):
+        [_, expr, value] = inc_expr
+        return ["set", expr, ["+", expr, value]]
+
+    @staticmethod  # [set foo [- foo value]]
+    def transform_decr_val_to_set(dec_expr):
+        [_, expr, value] = dec_expr
+        return ["set", expr, ["-", expr, value]]
+
+
+# The names of the operators that compiled code runs directly, and the
+# number of times an environment bound one of them anew: that code checks
+# the count before it trusts the builtin
+OPERATOR_NAMES = frozenset(("+", "*", "-", "/", "//", "%", ">", "<", ">=", "<=", "="))
+operator_epoch = 0
+
+
+def rebind_operator():
+    global operator_epoch
+    operator_epoch += 1
+
+
+class Environment:
+    __slots__ = ("record", "parent", "__weakref__")
+
+    def __init__(
+        self,
+        record,
+        parent=None,
+    ):
+        if record is None:
+            record = {}
+        self.record = record
+        self.parent = parent
+
+    # Define a new variable
+    def define(self, name, value):
+        if name in OPERATOR_NAMES:
+            rebind_operator()
+        self.record[name] = value
+        return value
+
+    # Assign a new variable
+    def assign(self, name, value):
+        if name in OPERATOR_NAMES:
+            rebind_operator()
+        self.resolve(name).record[name] = value
+        return value
+
+    # Get the value of a variable
+    def lookup(self, name):
+        return self.resolve(name).record[name]
+
+    # Get the environment in which a variable is defined
+    def resolve(self, name):
+        env = self
+        while name not in env.record:
+            env = env.parent
+            if env is None:  # parent == None means we are in the global_env
+                raise Exception(f"Variable not defined: {name}")
+        return env
+
+
+class Frame(Environment):
+    """
+    An environment whose variables live in a fixed-size list of slots. The
+    compiler knows the slot of every name declared in a block or function
+    body, so compiled code reads and writes the slots directly. The names
+    map is shared by every frame of the same scope.
+    """
+
+    __slots__ = ("slots", "names")
+
+    def __init__(self, slots, names, parent=None):
+        self.slots = slots
+        self.names = names
+        self.parent = parent
+
+    @property
+    def record(self):
+        # Only the dynamic path (class bodies, modules, the tree engine)
+        # looks a frame up by name
+        return SlotRecord(self)
+
+
+class SlotRecord:
+    """Dict-like view of the variables of a frame that are already defined."""
+
+    __slots__ = ("frame",)
+
+    def __init__(self, frame):
+        self.frame = frame
+
+    def __contains__(self, name):
+        index = self.frame.names.get(name)
+        return index is not None and self.frame.slots[index] is not UNSET
+
+    def __getitem__(self, name):
+        if name not in self:
+            raise KeyError(name)
+        return self.frame.slots[self.frame.names[name]]
+
+    def __setitem__(self, name, value):
+        if name not in self.frame.names:
+            raise Exception(f"Cannot declare {name} in a compiled scope")
+        self.frame.slots[self.frame.names[name]] = value
+
+    def keys(self):
+        return [name for name in self.frame.names if name in self]
+
+
+class Shape:
+    """
+    The layout of instances: the index of each property in their values,
+    in the order their constructor set them. Adding a property moves an
+    instance to the next shape, and every instance that gets the same
+    properties in the same order shares the same shapes (hidden classes).
+    """
+
+    __slots__ = ("names", "transitions")
+
+    def __init__(self, names=None):
+        self.names = {} if names is None else names  # name -> index
+        self.transitions = {}  # name -> this shape with name added
+
+    def add(self, name):
+        shape = self.transitions.get(name)
+        if shape is None:
+            shape = Shape({**self.names, name: len(self.names)})
+            self.transitions[name] = shape
+        return shape
+
+
+class ClassRecord(dict):
+    """
+    The record of a class. Every change to it bumps its version, which
+    drops what the property caches found through this class before.
+    """
+
+    __slots__ = ("version",)
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.version = 0
+
+    def __setitem__(self, name, value):
+        self.version += 1
+        dict.__setitem__(self, name, value)
+
+
+class Activation(Environment):
+    """The environment of a function call, in the stack machine."""
+
+    __slots__ = ("fn", "call")
+
+    def __init__(self, record, fn, call=None):
+        self.record = record
+        self.parent = fn.env
+        self.fn = fn
+        self.call = call  # the form that called fn, for the stacks of errors
+
+
+class Class(Environment):
+    """A class environment; it also knows the shape its instances start with."""
+
+    __slots__ = ("shape",)
+
+    def __init__(self, record, parent=None):
+        super().__init__(ClassRecord(record), parent)
+        self.shape = None  # inferred on the first `new`
+
+    def instance_shape(self):
+        """The properties the constructor sets on `this`, in their order."""
+        if self.shape is None:
+            shape = Shape()
+            constructor = self.lookup("constructor")
+            if type(constructor) is Function and constructor.params:
+                this = constructor.params[0]
+                for name in self.properties_set(constructor.body, this):
+                    shape = shape.add(name)
+            self.shape = shape
+        return self.shape
+
+    @staticmethod
+    def properties_set(body, this):
+        names = []
+        exprs = [body]
+        while exprs:
+            expr = exprs.pop()
+            if not isinstance(expr, list) or not expr:
+                continue
+            head = expr[0]
+            if head in ("quote", "lambda", "def", "defmemo", "class"):
+                continue
+            ref = expr[1] if head == "set" else None
+            if isinstance(ref, list) and ref[:2] == ["prop", this]:
+                if ref[2] not in names:
+                    names.append(ref[2])
+            exprs.extend(reversed(expr))
+        return names
+
+
+class Instance(Environment):
+    """
+    An object made by `new`. Its class is its parent environment, and its
+    properties are a list of values laid out by a shape. Instances start
+    with all the properties of their class's constructor, unset.
+    """
+
+    __slots__ = ("shape", "values")
+
+    def __init__(self, class_env):
+        shape = class_env.instance_shape() if type(class_env) is Class else Shape()
+        self.shape = shape
+        self.values = [UNSET] * len(shape.names)
+        self.parent = class_env
+
+    @property
+    def record(self):
+        return ShapeRecord(self)
+
+    def lookup(self, name):
+        index = self.shape.names.get(name)
+        if index is None or self.values[index] is UNSET:
+            return self.parent.lookup(name)
+        return self.values[index]
+
+    def define(self, name, value):
+        index = self.shape.names.get(name)
+        if index is None:
+            self.shape = self.shape.add(name)
+            self.values.append(value)
+        else:
+            self.values[index] = value
+        return value
+
+
+class ShapeRecord:
+    """Dict-like view of the properties of an instance."""
+
+    __slots__ = ("instance",)
+
+    def __init__(self, instance):
+        self.instance = instance
+
+    def __contains__(self, name):
+        index = self.instance.shape.names.get(name)
+        return index is not None and self.instance.values[index] is not UNSET
+
+    def __getitem__(self, name):
+        if name not in self:
+            raise KeyError(name)
+        return self.instance.values[self.instance.shape.names[name]]
+
+    def __setitem__(self, name, value):
+        self.instance.define(name, value)
+
+    def keys(self):
+        return [name for name in self.instance.shape.names if name in self]
+
+
+class PropertyCache:
+    """
+    The inline cache of a `[prop receiver name]` site. The properties of an
+    instance are found through its shape. What is inherited is cached by
+    class environment: the value found in the class chain, and the version
+    of every class record on the way to it. An environment (a class, a
+    module) that holds name itself is cached as the holder, since names
+    are never removed.
+
+    A site caches SIZE environments: it is monomorphic with one, polymorphic
+    with more, and replaces the oldest after that, so that the copies of a
+    class in pool interpreters still get a place. Setting a property on an
+    instance never touches the cache, and a redefined class is a new
+    environment, so it misses by itself.
+    """
+
+    SIZE = 4
+    __slots__ = ("name", "entries")
+
+    def __init__(self, name):
+        self.name = name
+        # environment -> (value, ((record, version), ...)) or (holder, None)
+        self.entries = {}
+
+    def __repr__(self):
+        return f"<cache {self.name}>"
+
+    def lookup(self, receiver):
+        if type(receiver) is Instance:
+            index = receiver.shape.names.get(self.name)
+            if index is not None:
+                value = receiver.values[index]
+                if value is not UNSET:
+                    return value
+            entry = self.entries.get(receiver.parent)
+        else:
+            entry = self.entries.get(receiver)
+        if entry is not None:
+            if entry[1] is None:
+                return entry[0].record[self.name]
+            for record, version in entry[1]:
+                if record.version != version:
+                    break
+            else:
+                return entry[0]
+        return self.miss(receiver)
+
+    def miss(self, receiver):
+        """Find an inherited property the slow way, and remember it."""
+        name = self.name
+        env = receiver.parent if type(receiver) is Instance else receiver
+        key = holder = env
+        # Only class records have versions
+        chain = []
+        while name not in holder.record:
+            if chain is not None and type(holder) is Class:
+                chain.append((holder.record, holder.record.version))
+            else:
+                chain = None
+            holder = holder.parent or undefined(name)
+        value = holder.record[name]
+
+        entries = self.entries
+        if holder is key:
+            entry = (holder, None)
+        elif chain is not None and type(holder) is Class:
+            chain.append((holder.record, holder.record.version))
+            entry = (value, tuple(chain))
+        else:
+            return value
+        if key not in entries and len(entries) >= self.SIZE:
+            del entries[next(iter(entries))]
+        entries[key] = entry
+        return value
+
+
+def arithmetic(binary, unary=None):
+    """
+    The native of an arithmetic operator: [- a] (for operators with a unary
+    form), [- a b], and [- a b c] as [- [- a b] c].
+    """
+
+    def native(*args):
+        if len(args) == 2:
+            return binary(args[0], args[1])
+        if len(args) == 1 and unary is not None:
+            return unary(args[0])
+        return functools.reduce(binary, args)
+
+    return native
+
+
+def comparison(binary):
+    """The native of a comparison: [< a b c] is [< a b] and [< b c]."""
+
+    def native(*args):
+        if len(args) == 2:
+            return binary(args[0], args[1])
+        return all(itertools.starmap(binary, itertools.pairwise(args)))
+
+    return native
+
+
+class PersistentVector:
+    """
+    An immutable vector: a 32-way trie of leaves, plus the last leaf (the
+    tail) kept apart so conj is cheap. get, assoc and conj copy one path of
+    at most log32(n) nodes and share the rest with the old vector.
+
+    The leaf last read by get is remembered, so a loop over the indexes of a
+    vector walks the trie once per 32 elements.
+    """
+
+    BITS = 5
+    WIDTH = 1 << BITS
+    MASK = WIDTH - 1
+    __slots__ = ("count", "shift", "root", "tail", "leaf")
+
+    def __init__(self, count=0, shift=BITS, root=(), tail=()):
+        self.count = count
+        self.shift = shift  # of the root level
+        self.root = root
+        self.tail = tail
+        self.leaf = count - len(tail), tail  # the leaf last read, from index
+
+    @classmethod
+    def of(cls, values):
+        """Build a vector from an iterable, one level at a time."""
+        values = tuple(values)
+        count = len(values)
+        offset = (count - 1) & ~cls.MASK if count else 0
+        nodes = [values[i : i + cls.WIDTH] for i in range(0, offset, cls.WIDTH)]
+        shift = cls.BITS
+        while len(nodes) > cls.WIDTH:
+            nodes = [
+                tuple(nodes[i : i + cls.WIDTH])
+                for i in range(0, len(nodes), cls.WIDTH)
+            ]
+            shift += cls.BITS
+        return cls(count, shift, tuple(nodes), values[offset:])
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        for start in range(0, self.count - len(self.tail), self.WIDTH):
+            yield from self._leaf_for(start)
+        yield from self.tail
+
+    def __eq__(self, other):
+        if not isinstance(other, PersistentVector):
+            return NotImplemented
+        return self.count == other.count and all(map(operator.eq, self, other))
+
+    def __hash__(self):
+        return hash(tuple(self))
+
+    def __repr__(self):
+        return f"PersistentVector({list(self)!r})"
+
+    def _leaf_for(self, index):
+        node = self.root
+        for level in range(self.shift, 0, -self.BITS):
+            node = node[(index >> level) & self.MASK]
+        return node
+
+    def get(self, index, default=None):
+        start, leaf = self.leaf
+        if start <= index < start + len(leaf):
+            return leaf[index - start]
+        if not 0 <= index < self.count:
+            return default
+        start = self.count - len(self.tail)
+        if index >= start:
+            self.leaf = start, self.tail
+        else:
+            self.leaf = index & ~self.MASK, self._leaf_for(index)
+        return self.leaf[1][index & self.MASK]
+
+    def conj(self, value):
+        """The vector with value appended."""
+        count, shift, root, tail = self.count, self.shift, self.root, self.tail
+        if len(tail) < self.WIDTH:
+            return PersistentVector(count + 1, shift, root, tail + (value,))
+        # The tail is full: it becomes a leaf of the trie
+        if count >> self.BITS > 1 << shift:  # and the root is full too
+            root = (root, self._path(shift, tail))
+            shift += self.BITS
+        else:
+            root = self._push_tail(shift, root, tail)
+        return PersistentVector(count + 1, shift, root, (value,))
+
+    def _path(self, level, node):
+        while level:
+            node = (node,)
+            level -= self.BITS
+        return node
+
+    def _push_tail(self, level, parent, tail):
+        index = ((self.count - 1) >> level) & self.MASK
+        if level == self.BITS:
+            node = tail
+        elif index < len(parent):
+            node = self._push_tail(level - self.BITS, parent[index], tail)
+        else:
+            node = self._path(level - self.BITS, tail)
+        return parent[:index] + (node,) + parent[index + 1 :]
+
+    def assoc(self, index, value):
+        """The vector with value at index (or appended, at the end)."""
+        if index == self.count:
+            return self.conj(value)
+        if not 0 <= index < self.count:
+            raise Exception(f"Index {index} is out of range of {self.count}")
+        count, shift, root, tail = self.count, self.shift, self.root, self.tail
+        start = count - len(tail)
+        if index >= start:
+            i = index - start
+            return PersistentVector(
+                count, shift, root, tail[:i] + (value,) + tail[i + 1 :]
+            )
+        return PersistentVector(
+            count, shift, self._assoc(shift, root, index, value), tail
+        )
+
+    def _assoc(self, level, node, index, value):
+        i = (index >> level) & self.MASK
+        if level:
+            value = self._assoc(level - self.BITS, node[i], index, value)
+        return node[:i] + (value,) + node[i + 1 :]
+
+
+class MapNode:
+    """
+    A node of a hash array mapped trie. The bits of bitmap tell which of the
+    32 hash fragments of its level are present; entries has one item for
+    each, in order: a (key, value) pair or a node of the next level.
+    """
+
+    BITS = PersistentVector.BITS
+    MASK = PersistentVector.MASK
+    __slots__ = ("bitmap", "entries")
+
+    def __init__(self, bitmap=0, entries=()):
+        self.bitmap = bitmap
+        self.entries = entries
+
+    def get(self, shift, code, key, default):
+        bit = 1 << ((code >> shift) & self.MASK)
+        if not self.bitmap & bit:
+            return default
+        entry = self.entries[(self.bitmap & (bit - 1)).bit_count()]
+        if type(entry) is tuple:
+            return entry[1] if entry[0] == key else default
+        return entry.get(shift + self.BITS, code, key, default)
+
+    def assoc(self, shift, code, key, value):
+        """Return the node with key set to value, and whether key is new."""
+        bit = 1 << ((code >> shift) & self.MASK)
+        index = (self.bitmap & (bit - 1)).bit_count()
+        entries = self.entries
+        if not self.bitmap & bit:
+            entries = entries[:index] + ((key, value),) + entries[index:]
+            return MapNode(self.bitmap | bit, entries), True
+
+        entry = entries[index]
+        if type(entry) is not tuple:
+            entry, added = entry.assoc(shift + self.BITS, code, key, value)
+        elif entry[0] == key:
+            if entry[1] is value:
+                return self, False
+            entry, added = (key, value), False
+        elif hash(entry[0]) == code:
+            entry, added = CollisionNode(code, (entry, (key, value))), True
+        else:  # both keys share this fragment: split them one level down
+            shift += self.BITS
+            node = MapNode(1 << ((hash(entry[0]) >> shift) & self.MASK), (entry,))
+            entry, added = node.assoc(shift, code, key, value)
+        entries = entries[:index] + (entry,) + entries[index + 1 :]
+        return MapNode(self.bitmap, entries), added
+
+    def dissoc(self, shift, code, key):
+        """Return the node without key (None once empty)."""
+        bit = 1 << ((code >> shift) & self.MASK)
+        if not self.bitmap & bit:
+            return self
+        index = (self.bitmap & (bit - 1)).bit_count()
+        entry = self.entries[index]
+        if type(entry) is tuple:
+            if entry[0] != key:
+                return self
+            entry = None
+        else:
+            node = entry.dissoc(shift + self.BITS, code, key)
+            if node is entry:
+                return self
+            entry = node
+
+        if entry is not None:
+            entries = self.entries[:index] + (entry,) + self.entries[index + 1 :]
+            return MapNode(self.bitmap, entries)
+        if self.bitmap == bit:
+            return None
+        entries = self.entries[:index] + self.entries[index + 1 :]
+        return MapNode(self.bitmap ^ bit, entries)
+
+    def items(self):
+        for entry in self.entries:
+            if type(entry) is tuple:
+                yield entry
+            else:
+                yield from entry.items()
+
+
+class CollisionNode:
+    """The (key, value) pairs of a map whose keys have the same hash."""
+
+    __slots__ = ("code", "entries")
+
+    def __init__(self, code, entries):
+        self.code = code
+        self.entries = entries
+
+    def get(self, shift, code, key, default):
+        for entry in self.entries:
+            if entry[0] == key:
+                return entry[1]
+        return default
+
+    def assoc(self, shift, code, key, value):
+        if code != self.code:
+            bit = 1 << ((self.code >> shift) & MapNode.MASK)
+            return MapNode(bit, (self,)).assoc(shift, code, key, value)
+        for index, entry in enumerate(self.entries):
+            if entry[0] == key:
+                entries = self.entries[:index] + ((key, value),)
+                entries += self.entries[index + 1 :]
+                return CollisionNode(code, entries), False
+        return CollisionNode(code, self.entries + ((key, value),)), True
+
+    def dissoc(self, shift, code, key):
+        entries = tuple(entry for entry in self.entries if entry[0] != key)
+        if len(entries) == len(self.entries):
+            return self
+        return CollisionNode(code, entries) if entries else None
+
+    def items(self):
+        return iter(self.entries)
+
+
+class PersistentMap:
+    """
+    An immutable hash map, as a hash array mapped trie: get, assoc and dissoc
+    walk (and copy) one path of at most log32(n) nodes.
+    """
+
+    __slots__ = ("count", "root")
+
+    def __init__(self, count=0, root=None):
+        self.count = count
+        self.root = root
+
+    @classmethod
+    def of(cls, pairs):
+        result = cls()
+        for key, value in pairs:
+            result = result.assoc(key, value)
+        return result
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        return (key for key, _ in self.items())
+
+    def __contains__(self, key):
+        return self.get(key, UNSET) is not UNSET
+
+    def __eq__(self, other):
+        if not isinstance(other, PersistentMap):
+            return NotImplemented
+        return self.count == other.count and all(
+            other.get(key, UNSET) == value for key, value in self.items()
+        )
+
+    def __hash__(self):
+        return hash(frozenset(self.items()))
+
+    def __repr__(self):
+        return f"PersistentMap({dict(self.items())!r})"
+
+    def items(self):
+        return iter(()) if self.root is None else self.root.items()
+
+    def get(self, key, default=None):
+        if self.root is None:
+            return default
+        return self.root.get(0, hash(key), key, default)
+
+    def conj(self, entry):
+        """The map with a [key value] entry added."""
+        key, value = entry
+        return self.assoc(key, value)
+
+    def assoc(self, key, value):
+        root = self.root or MapNode()
+        root, added = root.assoc(0, hash(key), key, value)
+        if root is self.root:
+            return self
+        return PersistentMap(self.count + added, root)
+
+    def dissoc(self, key):
+        if self.root is None:
+            return self
+        root = self.root.dissoc(0, hash(key), key)
+        if root is self.root:
+            return self
+        return PersistentMap(self.count - 1, root)
+
+
+def conj(collection, *values):
+    for value in values:
+        collection = collection.conj(value)
+    return collection
+
+
+def dissoc(collection, *keys):
+    for key in keys:
+        collection = collection.dissoc(key)
+    return collection
+
+
+def hash_map(*args):
+    if len(args) % 2:
+        raise Exception(f"dict takes keys and values, got {len(args)} arguments")
+    return PersistentMap.of(zip(args[::2], args[1::2]))
+
+
+def keys(collection):
+    # The keys of a vector are its indexes, as get takes them
+    if isinstance(collection, PersistentVector):
+        return PersistentVector.of(range(len(collection)))
+    return PersistentVector.of(collection)
+
+
+def values(collection):
+    if isinstance(collection, PersistentVector):
+        return collection
+    return PersistentVector.of(value for _, value in collection.items())
+
+
+global_environment = Environment(
+    {
+        "null": None,
+        "true": True,
+        "false": False,
+        "VERSION": VERSION_INFO,
+        "+": arithmetic(operator.add, operator.pos),
+        "*": arithmetic(operator.mul),
+        "-": arithmetic(operator.sub, operator.neg),
+        "/": arithmetic(operator.truediv),
+        "//": arithmetic(operator.floordiv),
+        "%": arithmetic(operator.mod),
+        ">": comparison(operator.gt),
+        "<": comparison(operator.lt),
+        ">=": comparison(operator.ge),
+        "<=": comparison(operator.le),
+        "=": comparison(operator.eq),
+        "eof": lambda arg: arg is EOF,
+        "list": lambda *values: PersistentVector.of(values),
+        "dict": hash_map,
+        "get": lambda collection, key, default=None: collection.get(key, default),
+        "assoc": lambda collection, key, value: collection.assoc(key, value),
+        "conj": conj,
+        "dissoc": dissoc,
+        "count": len,
+        "memo-clear": lambda memo: memo.clear(),
+        "keys": keys,
+        "values": values,
+    }
+)
+
+
+# The builtin values, as the interpreter starts
+BUILTINS = dict(global_environment.record)
+
+
+class Optimizer:
+    """
+    Rewrite a parsed program once, ahead of evaluation: expand syntactic
+    sugar, fold arithmetic and comparisons on number literals, drop the dead
+    branch of an `if` whose condition is a literal, and inline lambdas that
+    are applied on the spot and have a trivial body.
+
+    An operator or constant is only folded outside of function bodies,
+    which run later, and while the environment still holds its builtin
+    value and the program never binds its name.
+    """
+
+    SUGAR = {
+        "def": Transformer.transform_def_to_var_lambda,
+        "defmemo": Transformer.transform_defmemo_to_var_memo,
+        "switch": Transformer.transform_switch_to_if,
+        "for": Transformer.transform_for_to_while,
+        "++": Transformer.transform_incr_to_set,
+        "--": Transformer.transform_decr_to_set,
+        "+=": Transformer.transform_incr_val_to_set,
+        "-=": Transformer.transform_decr_val_to_set,
+    }
+    OPERATORS = ("+", "*", "-", "/", "//", "%", ">", "<", ">=", "<=", "=")
+    CONSTANTS = ("null", "true", "false")
+    FORMS = ("quote", "begin", "var", "set", "if", "while", "lambda", "class")
+    FORMS += ("super", "new", "prop", "module", "import", "memo")
+    # The forms a trivial lambda body can use: none of them binds a name
+    TRIVIAL_FORMS = ("quote", "if", "prop")
+
+    def __init__(self, env, sources=None):
+        self.env = env
+        self.sources = sources  # a SourceMap to carry positions over to
+        self.builtins = {
+            name: value
+            for name, value in global_environment.record.items()
+            if name in self.OPERATORS + self.CONSTANTS
+        }
+
+    def optimize(self, expr, folds=None):
+        """
+        Return the optimized copy of expr; expr itself is not changed. When
+        expr is a part of a program, folds are the `unshadowed` builtins of
+        the whole program.
+        """
+        self.folds = self.unshadowed(expr) if folds is None else folds
+        return self._optimize(expr)
+
+    def unshadowed(self, expr):
+        """The builtin operators and constants that expr leaves alone, by name."""
+        bound = self.bound_names(expr)
+        return {
+            name: value
+            for name, value in self.builtins.items()
+            if name not in bound and self._builtin_in_env(name, value)
+        }
+
+    def _builtin_in_env(self, name, value):
+        env = self.env
+        while env is not None and name not in env.record:
+            env = env.parent
+        return env is not None and env.record[name] is value
+
+    @classmethod
+    def bound_names(cls, expr):
+        """Every name that expr can declare, assign or take as a parameter."""
+        names = set()
+        stack = [expr]
+        while stack:
+            expr = stack.pop()
+            if not isinstance(expr, list) or len(expr) == 0 or expr[0] == "quote":
+                continue
+            head = expr[0]
+            if head in ("var", "def", "defmemo", "class", "module", "set"):
+                if isinstance(expr[1], str):
+                    names.add(expr[1])
+            if head in ("++", "--", "+=", "-=") and isinstance(expr[1], str):
+                names.add(expr[1])
+            if head in ("def", "defmemo", "lambda"):
+                params = expr[1] if head == "lambda" else expr[2]
+                names.update(param for param in params if isinstance(param, str))
+            stack.extend(expr)
+        return names
+
+    def _optimize(self, expr):
+        optimized = self._rewrite(expr)
+        if self.sources is not None and type(optimized) is list:
+            self.sources.copy(expr, optimized)
+        return optimized
+
+    def _rewrite(self, expr):
+        if not isinstance(expr, list) or len(expr) == 0:
+            return expr
+
+        head = expr[0]
+        while isinstance(head, str) and head in self.SUGAR:
+            expr = self.SUGAR[head](expr)
+            head = expr[0]
+
+        if head == "quote" or head == "import":
+            return expr
+        if head in ("var", "class", "module"):  # the name is not an expression
+            return [head, expr[1], *map(self._optimize, expr[2:])]
+        if head == "lambda":
+            # The body runs later, when the builtins may have been rebound
+            [_, params, body] = expr
+            folds, self.folds = self.folds, {}
+            try:
+                return ["lambda", params, self._optimize(body)]
+            finally:
+                self.folds = folds
+        if head == "prop":
+            [_, instance, name] = expr
+            return ["prop", self._optimize(instance), name]
+        if head == "set":
+            [_, ref, value] = expr
+            return ["set", self._optimize(ref), self._optimize(value)]
+        if head == "if":
+            return self._optimize_if(expr)
+
+        expr = list(map(self._optimize, expr))
+        if head in ("begin", "while", "super", "new", "memo"):
+            return expr
+        return self._optimize_call(expr)
+
+    def _optimize_if(self, expr):
+        [_, condition, consequent, alternate] = expr
+        condition = self._optimize(condition)
+
+        # DEAD BRANCH
+        if isinstance(condition, str) and condition in self.CONSTANTS:
+            if condition in self.folds:
+                condition = self.folds[condition]
+                return self._optimize(consequent if condition else alternate)
+        elif isinstance(condition, int | float):
+            return self._optimize(consequent if condition else alternate)
+        return ["if", condition, self._optimize(consequent), self._optimize(alternate)]
+
+    def _optimize_call(self, expr):
+        [fn, *args] = expr
+
+        # CONSTANT FOLDING
+        if isinstance(fn, str) and fn in self.OPERATORS and fn in self.folds and args:
+            if all(isinstance(arg, int | float) for arg in args):
+                try:
+                    return self.folds[fn](*args)
+                except Exception:
+                    return expr  # fails at run time, as it should
+
+        # INLINE [[lambda [x] body] value]
+        if isinstance(fn, list) and fn[:1] == ["lambda"]:
+            [_, params, body] = fn
+            if (
+                len(params) == len(args)
+                and len(set(params)) == len(params)
+                and all(map(self._is_inlinable, params, args, [body] * len(args)))
+                and self._is_trivial(body)
+            ):
+                return self._optimize(self._substitute(body, dict(zip(params, args))))
+        return expr
+
+    @classmethod
+    def _is_inlinable(cls, param, arg, body):
+        """
+        Whether arg can be substituted for param: a literal, or a name the
+        body reads, so that its lookup is not dropped.
+        """
+        if isinstance(arg, int | float):
+            return True
+        return isinstance(arg, str) and param in cls._names_read(body)
+
+    @classmethod
+    def _names_read(cls, body):
+        if isinstance(body, str):
+            return {body}
+        if not isinstance(body, list) or body[:1] == ["quote"]:
+            return set()
+        if body[0] == "prop":
+            return cls._names_read(body[1])
+        return set().union(*map(cls._names_read, body))
+
+    @classmethod
+    def _is_trivial(cls, body):
+        if not isinstance(body, list):
+            return True
+        if len(body) == 0:
+            return False
+        head = body[0]
+        if isinstance(head, str) and head in cls.FORMS:
+            if head not in cls.TRIVIAL_FORMS:
+                return False
+            if head == "quote":
+                return True
+            if head == "prop":
+                return cls._is_trivial(body[1])
+        return all(map(cls._is_trivial, body))
+
+    @classmethod
+    def _substitute(cls, body, values):
+        if isinstance(body, str):
+            return values.get(body, body)
+        if not isinstance(body, list) or body[:1] == ["quote"]:
+            return body
+        if body[0] == "prop":
+            return ["prop", cls._substitute(body[1], values), body[2]]
+        return [cls._substitute(expr, values) for expr in body]
+
+
+class Scope:
+    """
+    Compile-time picture of an environment. A static scope knows the slot
+    of every name its frame will hold; a dynamic scope (the global
+    environment, class and module bodies) is only known at runtime.
+    """
+
+    def __init__(self, names=None, parent=None):
+        self.names = None if names is None else {
+            name: index for index, name in enumerate(dict.fromkeys(names))
+        }
+        self.parent = parent
+
+    @property
+    def size(self):
+        return len(self.names)
+
+    def address(self, name):
+        """
+        Return (depth, slot) of name, or (depth, None) when it must be
+        looked up dynamically starting `depth` environments up the chain.
+        """
+        depth = 0
+        scope = self
+        while scope is not None and scope.names is not None:
+            if name in scope.names:
+                return depth, scope.names[name]
+            depth += 1
+            scope = scope.parent
+        return depth, None
+
+
+DYNAMIC_SCOPE = Scope()
+
+
+def undefined(name):
+    raise Exception(f"Variable not defined: {name}")
+
+
+# How `Tea.call_stack` reads the frames of the functions that run tea code,
+# by code object. Evaluation notes nothing as it goes: a failed frame still
+# holds what it was running, and a reader takes its traceback entry and
+# returns its (expr, name) notes, from the innermost out, where a name
+# marks the call of that function, whose body is expr
+FRAME_READERS = {}
+
+
+def reads_frames(reader):
+    """Have call stacks read the frames of the decorated function with reader."""
+
+    def register(function):
+        FRAME_READERS[function.__code__] = reader
+        return function
+
+    return register
+
+
+def expr_notes(tb):
+    """The expression a frame was evaluating, if it is a list."""
+    expr = tb.tb_frame.f_locals.get("expr")
+    return [(expr, None)] if isinstance(expr, list) else []
+
+
+def call_notes(tb):
+    """The function a frame was running."""
+    fn = tb.tb_frame.f_locals["fn"]
+    return [(fn.body, fn.name)]
+
+
+def up(env, depth):
+    for _ in range(depth):
+        env = env.parent
+    return env
+
+
+class Function:
+    """
+    A user-defined function: a lambda and the environment it closes over.
+    Each engine keeps its compiled code on it, made on the first call.
+    """
+
+    __slots__ = ("params", "body", "env", "name", "code", "scope", "bytecode")
+
+    def __init__(
+        self, params, body, env, name="lambda", code=None, scope=None, bytecode=None
+    ):
+        self.params = params
+        self.body = body
+        self.env = env  # Add this for Closure
+        self.name = name
+        self.code = code
+        self.scope = scope
+        self.bytecode = bytecode
+
+    def __repr__(self):
+        return f"<function {self.name}>"
+
+
+class Memo:
+    """
+    A tea function that remembers its results by the values of its
+    arguments, for the size calls used last (or all, when size is None),
+    and for at most ttl seconds each (or for ever). A call that hits the
+    cache returns at once: no environment, no evaluation. A miss runs the
+    function with `Tea._apply`. hits and misses count the calls.
+    """
+
+    SIZE = 1024
+    __slots__ = ("fn", "tea", "size", "ttl", "cache", "hits", "misses", "clock")
+
+    def __init__(self, fn, tea, size=SIZE, ttl=None, clock=time.monotonic):
+        if type(fn) is not Function:
+            raise Exception(f"memo takes a tea function, not {fn}")
+        if size is not None and size < 1:
+            raise Exception(f"The size of a memo must be positive, not {size}")
+        self.fn = fn
+        self.tea = tea
+        self.size = size
+        self.ttl = ttl
+        self.cache = collections.OrderedDict()  # args -> (value, expiry)
+        self.hits = self.misses = 0
+        self.clock = clock
+
+    def __repr__(self):
+        return f"<memo {self.fn.name}>"
+
+    def __call__(self, *args):
+        try:
+            value, expiry = self.cache[args]
+        except KeyError:
+            pass
+        except TypeError:  # arguments that cannot be keys: just call
+            self.misses += 1
+            return self.tea._apply(self.fn, args)
+        else:
+            if expiry is None or self.clock() < expiry:
+                self.hits += 1
+                self.cache.move_to_end(args)
+                return value
+            del self.cache[args]
+
+        self.misses += 1
+        value = self.tea._apply(self.fn, args)
+        expiry = None if self.ttl is None else self.clock() + self.ttl
+        self.cache[args] = value, expiry
+        if self.size is not None and len(self.cache) > self.size:
+            self.cache.popitem(last=False)
+        return value
+
+    def clear(self):
+        """Forget every result, and the statistics."""
+        self.cache.clear()
+        self.hits = self.misses = 0
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self.cache),
+            "max_size": self.size,
+        }
+
+
+class TailCall:
+    """A user-defined function call left for the caller's loop to run."""
+
+    __slots__ = ("fn", "args")
+
+    def __init__(self, fn, args):
+        self.fn = fn
+        self.args = args
+
+
+class Compiler:
+    """
+    Turn a parsed expression into a tree of Python closures. Each closure
+    takes an environment and returns the value of its expression, so the
+    special form dispatch happens once at compile time instead of on every
+    evaluation.
+
+    Variables declared in blocks and function bodies get a (depth, slot)
+    address from a static scope analysis, and their environments are
+    `Frame`s. Everything else keeps the dynamic, by-name lookup.
+
+    The builtin operators a program never rebinds are compiled to the
+    Python operation itself: no lookup and no call, as long as no
+    environment rebinds them later (see `operator_epoch`).
+    """
+
+    # Code for the builtin operators on one or two operands, as long as
+    # operator_epoch says that no environment rebound an operator since
+    # they were compiled; call runs the expression as a call
+    UNARY_CODE = {
+        "+": lambda a, call, epoch: lambda env: (
+            +a(env) if operator_epoch == epoch else call(env)
+        ),
+        "-": lambda a, call, epoch: lambda env: (
+            -a(env) if operator_epoch == epoch else call(env)
+        ),
+    }
+    BINARY_CODE = {
+        "+": lambda a, b, call, epoch: lambda env: (
+            a(env) + b(env) if operator_epoch == epoch else call(env)
+        ),
+        "-": lambda a, b, call, epoch: lambda env: (
+            a(env) - b(env) if operator_epoch == epoch else call(env)
+        ),
+        "*": lambda a, b, call, epoch: lambda env: (
+            a(env) * b(env) if operator_epoch == epoch else call(env)
+        ),
+        "/": lambda a, b, call, epoch: lambda env: (
+            a(env) / b(env) if operator_epoch == epoch else call(env)
+        ),
+        "//": lambda a, b, call, epoch: lambda env: (
+            a(env) // b(env) if operator_epoch == epoch else call(env)
+        ),
+        "%": lambda a, b, call, epoch: lambda env: (
+            a(env) % b(env) if operator_epoch == epoch else call(env)
+        ),
+        ">": lambda a, b, call, epoch: lambda env: (
+            a(env) > b(env) if operator_epoch == epoch else call(env)
+        ),
+        "<": lambda a, b, call, epoch: lambda env: (
+            a(env) < b(env) if operator_epoch == epoch else call(env)
+        ),
+        ">=": lambda a, b, call, epoch: lambda env: (
+            a(env) >= b(env) if operator_epoch == epoch else call(env)
+        ),
+        "<=": lambda a, b, call, epoch: lambda env: (
+            a(env) <= b(env) if operator_epoch == epoch else call(env)
+        ),
+        "=": lambda a, b, call, epoch: lambda env: (
+            a(env) == b(env) if operator_epoch == epoch else call(env)
+        ),
+    }
+    ARITHMETIC = ("+", "-", "*", "/", "//", "%")
+
+    def __init__(self, tea):
+        self.tea = tea
+        self.transformer = tea.transformer
+        self.operators = {}  # builtin operators of the program being compiled
+        self.special_forms = {
+            "quote": self._compile_quote,
+            "begin": self._compile_begin,
+            "var": self._compile_var,
+            "set": self._compile_set,
+            "if": self._compile_if,
+            "while": self._compile_while,
+            "def": self._compile_def,
+            "defmemo": self._compile_defmemo,
+            "switch": self._compile_switch,
+            "for": self._compile_for,
+            "++": self._compile_incr,
+            "--": self._compile_decr,
+            "+=": self._compile_incr_val,
+            "-=": self._compile_decr_val,
+            "lambda": self._compile_lambda,
+            "class": self._compile_class,
+            "super": self._compile_super,
+            "new": self._compile_new,
+            "prop": self._compile_prop,
+            "module": self._compile_module,
+            "import": self._compile_import,
+            "memo": self._compile_memo,
+        }
+        # Numeric loops run as generated Python, see `Specializer`
+        self.specializer = None
+        if tea.specialize and tea.profiler is None:
+            self.specializer = Specializer(self)
+
+    def compile(self, expr, scope=DYNAMIC_SCOPE, tail=False):
+        # VAR LOOKUP
+        if isinstance(expr, str):
+            return self._compile_lookup(expr, scope)
+
+        if isinstance(expr, int | float):
+            return lambda env: expr
+
+        if isinstance(expr, list):
+            head = expr[0]
+            if isinstance(head, str) and head in self.special_forms:
+                code = self.special_forms[head](expr, scope, tail)
+                if self.tea.profiler is not None:
+                    code = self.tea.profiler.wrap(f"form:{head}", code)
+                return code
+            return self._compile_call(expr, scope, tail)
+
+        raise Exception(f"Unimplemented: {expr}")
+
+    def compile_program(self, body):
+        """Compile a program or a module: a body for the global environment."""
+        operators = self.operators
+        self.operators = self.tea._native_operators(body)
+        try:
+            return self.compile_body(body)
+        finally:
+            self.operators = operators
+
+    def compile_body(self, body, scope=DYNAMIC_SCOPE, tail=False):
+        """A function, class or module body: a block shares the given env."""
+        if isinstance(body, list) and body and body[0] == "begin":
+            return self._compile_sequence(body[1:], scope, tail)
+        return self.compile(body, scope, tail)
+
+    def compile_function(self, params, body, scope=DYNAMIC_SCOPE):
+        """Compile a function body; return its code and its frame scope."""
+        if len(set(params)) != len(params):
+            raise Exception(f"Duplicate parameter name in {params}")
+
+        exprs = body[1:] if isinstance(body, list) and body[:1] == ["begin"] else [body]
+        fn_scope = Scope([*params, *self.declared_names(exprs)], scope)
+        # Slots of the activation frame that follow the arguments
+        fn_scope.locals = [UNSET] * (fn_scope.size - len(params))
+        code = self.compile_body(body, fn_scope, tail=True)
+        if self.specializer is not None:
+            code = self.specializer.function(params, body, fn_scope, code)
+        return code, fn_scope
+
+    @classmethod
+    def declared_names(cls, exprs):
+        """Names that evaluating exprs can define in the current environment."""
+        names = []
+        for expr in exprs:
+            if not isinstance(expr, list) or len(expr) == 0:
+                continue
+            head = expr[0]
+            if head in ("var", "def", "defmemo", "class", "module"):
+                names.append(expr[1])
+            if head == "var":
+                names.extend(cls.declared_names(expr[2:]))
+            elif head == "class":
+                names.extend(cls.declared_names(expr[2:3]))
+            elif head == "defmemo":
+                names.extend(cls.declared_names(expr[4:]))
+            elif head not in ("def", "module", "lambda", "quote", "begin", "for"):
+                # every other form evaluates its operands in this environment
+                names.extend(cls.declared_names(expr[1:]))
+        return names
+
+    # VARIABLES
+    def _compile_lookup(self, name, scope):
+        depth, slot = scope.address(name)
+
+        if slot is None:
+            # Skip the frames known not to hold name, then walk the parent
+            # chain inline: no method call per scope
+            if depth == 0:
+
+                def lookup(env):
+                    while name not in env.record:
+                        env = env.parent or undefined(name)
+                    return env.record[name]
+
+            elif depth == 1:
+
+                def lookup(env):
+                    env = env.parent
+                    while name not in env.record:
+                        env = env.parent or undefined(name)
+                    return env.record[name]
+
+            else:
+
+                def lookup(env):
+                    env = up(env, depth)
+                    while name not in env.record:
+                        env = env.parent or undefined(name)
+                    return env.record[name]
+
+            return lookup
+
+        # A declared variable whose `var` has not run yet is still visible
+        # from the enclosing environments
+        if depth == 0:
+
+            def lookup(env):
+                value = env.slots[slot]
+                if value is UNSET:
+                    return env.parent.lookup(name)
+                return value
+
+        elif depth == 1:
+
+            def lookup(env):
+                env = env.parent
+                value = env.slots[slot]
+                if value is UNSET:
+                    return env.parent.lookup(name)
+                return value
+
+        else:
+
+            def lookup(env):
+                env = up(env, depth)
+                value = env.slots[slot]
+                if value is UNSET:
+                    return env.parent.lookup(name)
+                return value
+
+        return lookup
+
+    def _compile_assign(self, name, scope, value_code):
+        depth, slot = scope.address(name)
+
+        if slot is None and name in OPERATOR_NAMES:
+            return lambda env: up(env, depth).assign(name, value_code(env))
+        if slot is None:
+
+            def assign(env):
+                value = value_code(env)
+                env = up(env, depth)
+                while name not in env.record:
+                    env = env.parent or undefined(name)
+                env.record[name] = value
+                return value
+
+            return assign
+
+        def assign(env):
+            value = value_code(env)
+            env = up(env, depth)
+            if env.slots[slot] is UNSET:
+                return env.parent.assign(name, value)
+            env.slots[slot] = value
+            return value
+
+        return assign
+
+    def _compile_store(self, name, scope):
+        """Return a function assigning a value to an existing variable."""
+        depth, slot = scope.address(name)
+
+        if slot is None and name in OPERATOR_NAMES:
+            return lambda env, value: up(env, depth).assign(name, value)
+        if slot is None:
+
+            def store(env, value):
+                env = up(env, depth)
+                while name not in env.record:
+                    env = env.parent or undefined(name)
+                env.record[name] = value
+
+            return store
+
+        def store(env, value):
+            env = up(env, depth)
+            if env.slots[slot] is UNSET:
+                env.parent.assign(name, value)
+            else:
+                env.slots[slot] = value
+
+        return store
+
+    def _compile_define(self, name, scope):
+        """Return a function storing a new variable in the current env."""
+        if scope.names is None:
+            return lambda env, value: env.define(name, value)
+
+        slot = scope.names[name]
+
+        def define(env, value):
+            env.slots[slot] = value
+            return value
+
+        return define
+
+    def _compile_sequence(self, expressions, scope, tail=False):
+        codes = [self.compile(expr, scope) for expr in expressions[:-1]]
+        codes += [self.compile(expr, scope, tail) for expr in expressions[-1:]]
+
+        if len(codes) == 0:
+            return lambda env: None
+        if len(codes) == 1:
+            return codes[0]
+        if len(codes) == 2:
+            [first, second] = codes
+
+            def sequence(env):
+                first(env)
+                return second(env)
+
+            return sequence
+
+        def sequence(env):
+            result = None
+            for code in codes:
+                result = code(env)
+            return result
+
+        return sequence
+
+    # Quoted text
+    def _compile_quote(self, expr, scope, tail):
+        [_, string] = expr
+        return lambda env: string
+
+    # BLOCKS
+    def _compile_begin(self, expr, scope, tail):
+        names = self.declared_names(expr[1:])
+
+        # A block that declares nothing would only ever hold an empty frame
+        if not names:
+            return self._compile_sequence(expr[1:], scope, tail)
+
+        block_scope = Scope(names, scope)
+        sequence = self._compile_sequence(expr[1:], block_scope, tail)
+        block_names = block_scope.names
+        empty_slots = [UNSET] * block_scope.size
+
+        return lambda env: sequence(Frame(empty_slots[:], block_names, env))
+
+    # VAR DECLARATIONS
+    def _compile_var(self, expr, scope, tail):
+        [_, name, value] = expr
+        if isinstance(value, list) and value[:1] == ["lambda"]:
+            value_code = self._compile_lambda(value, scope, False, name)
+        else:
+            value_code = self.compile(value, scope)
+        define = self._compile_define(name, scope)
+        return lambda env: define(env, value_code(env))
+
+    # VAR UPDATE
+    def _compile_set(self, expr, scope, tail):
+        [_, ref, value] = expr
+        value_code = self.compile(value, scope)
+
+        # Set a property
+        if isinstance(ref, list) and ref[0] == "prop":
+            [_, instance, prop_name] = ref
+            instance_code = self.compile(instance, scope)
+            return lambda env: instance_code(env).define(prop_name, value_code(env))
+
+        # Set a var
+        return self._compile_assign(ref, scope, value_code)
+
+    # IF EXPRESSION
+    def _compile_if(self, expr, scope, tail):
+        [_, condition, consequent, alternate] = expr
+        condition_code = self.compile(condition, scope)
+        consequent_code = self.compile(consequent, scope, tail)
+        alternate_code = self.compile(alternate, scope, tail)
+
+        def if_(env):
+            if condition_code(env):
+                return consequent_code(env)
+            return alternate_code(env)
+
+        return if_
+
+    # WHILE LOOP
+    def _compile_while(self, expr, scope, tail):
+        [_, condition, block] = expr
+        condition_code = self.compile(condition, scope)
+        block_code = self.compile(block, scope)
+
+        def while_(env):
+            meter = running.meter
+            result = None
+            while condition_code(env):
+                result = block_code(env)
+                countdown = meter.countdown - 1
+                meter.countdown = countdown
+                if countdown < 0:
+                    meter.check()
+            return result
+
+        if self.specializer is not None:
+            return self.specializer.loop(expr, scope, while_)
+        return while_
+
+    # Syntactic sugar is transformed once, at compile time
+    def _compile_def(self, expr, scope, tail):
+        return self.compile(self.transformer.transform_def_to_var_lambda(expr), scope)
+
+    def _compile_defmemo(self, expr, scope, tail):
+        return self.compile(self.transformer.transform_defmemo_to_var_memo(expr), scope)
+
+    def _compile_switch(self, expr, scope, tail):
+        if_expr = self.transformer.transform_switch_to_if(expr)
+        return self.compile(if_expr, scope, tail)
+
+    def _compile_for(self, expr, scope, tail):
+        return self.compile(self.transformer.transform_for_to_while(expr), scope)
+
+    def _compile_incr(self, expr, scope, tail):
+        return self.compile(self.transformer.transform_incr_to_set(expr), scope)
+
+    def _compile_decr(self, expr, scope, tail):
+        return self.compile(self.transformer.transform_decr_to_set(expr), scope)
+
+    def _compile_incr_val(self, expr, scope, tail):
+        return self.compile(self.transformer.transform_incr_val_to_set(expr), scope)
+
+    def _compile_decr_val(self, expr, scope, tail):
+        return self.compile(self.transformer.transform_decr_val_to_set(expr), scope)
+
+    # lambda function
+    def _compile_lambda(self, expr, scope, tail, name="lambda"):
+        [_, params, body] = expr
+        code, fn_scope = self.compile_function(params, body, scope)
+        return lambda env: Function(params, body, env, name, code, fn_scope)
+
+    # OOP CLASS
+    def _compile_class(self, expr, scope, tail):
+        [_, name, parent, body] = expr
+        parent_code = self.compile(parent, scope)
+        body_code = self.compile_body(body)
+        define = self._compile_define(name, scope)
+
+        def class_(env):
+            parent_env = parent_code(env) or env
+            class_env = Class({}, parent_env)
+            body_code(class_env)
+            return define(env, class_env)
+
+        return class_
+
+    def _compile_super(self, expr, scope, tail):
+        [_, class_name] = expr
+        class_code = self.compile(class_name, scope)
+        return lambda env: class_code(env).parent
+
+    def _compile_new(self, expr, scope, tail):  # [new <class name> <args> ...]
+        class_code = self.compile(expr[1], scope)
+        arg_codes = [self.compile(arg, scope) for arg in expr[2:]]
+        current = self.tea.current
+
+        def new(env):
+            class_env = class_code(env)
+            instance_env = Instance(class_env)
+            args = [arg_code(env) for arg_code in arg_codes]
+            current()._apply(class_env.lookup("constructor"), [instance_env, *args])
+            return instance_env
+
+        return new
+
+    # Access to a property
+    def _compile_prop(self, expr, scope, tail):
+        [_, instance, name] = expr
+        instance_code = self.compile(instance, scope)
+        cache = PropertyCache(name)
+        entries, miss = cache.entries, cache.miss
+
+        # `PropertyCache.lookup`, inlined
+        def prop(env):
+            receiver = instance_code(env)
+            if type(receiver) is Instance:
+                index = receiver.shape.names.get(name)
+                if index is not None:
+                    value = receiver.values[index]
+                    if value is not UNSET:
+                        return value
+                entry = entries.get(receiver.parent)
+            else:
+                entry = entries.get(receiver)
+            if entry is not None:
+                if entry[1] is None:
+                    return entry[0].record[name]
+                for record, version in entry[1]:
+                    if record.version != version:
+                        break
+                else:
+                    return entry[0]
+            return miss(receiver)
+
+        return prop
+
+    # Module declaration
+    def _compile_module(self, expr, scope, tail):
+        [_, name, body] = expr
+        body_code = self.compile_body(body)
+        define = self._compile_define(name, scope)
+
+        def module(env):
+            module_env = Environment({}, env)
+            body_code(module_env)
+            return define(env, module_env)
+
+        return module
+
+    # Import module
+    def _compile_import(self, expr, scope, tail):
+        [_, module_name] = expr
+        current = self.tea.current
+
+        def import_(env):
+            tea = current()
+            module_env = tea._imported(module_name)
+            if module_env is None:
+                module_expr = ["module", module_name, tea._read_module(module_name)]
+                module_env = tea.compiler.compile_program(module_expr)(tea.global_env)
+                tea.modules[module_name] = module_env
+            return module_env
+
+        return import_
+
+    # Memoized function: [memo fn size ttl]
+    def _compile_memo(self, expr, scope, tail):
+        codes = [self.compile(arg, scope) for arg in expr[1:]]
+        current = self.tea.current
+        return lambda env: current().memoize(*[code(env) for code in codes])
+
+    # Function call
+    def _compile_call(self, expr, scope, tail):
+        head = expr[0]
+        if isinstance(head, str) and head in self.operators:
+            if scope.address(head)[1] is None:  # not a local variable
+                return self._compile_operator(expr, scope, tail)
+
+        fn_code = self.compile(expr[0], scope)
+        arg_codes = [self.compile(arg, scope) for arg in expr[1:]]
+        return self._compile_invoke(expr, fn_code, arg_codes, tail)
+
+    def _compile_invoke(self, expr, fn_code, arg_codes, tail):
+        """Call the value of fn_code with the values of arg_codes."""
+        # A call in tail position hands the function back to `Tea._apply`
+        # instead of growing the Python stack
+        invoke = TailCall if tail else self.tea._apply
+
+        if self.tea.profiler is not None:
+            return self._compile_profiled_call(expr, fn_code, arg_codes, invoke)
+
+        # Specialize the common arities to avoid building an args list. expr
+        # is a default so that the frame of a failed call shows it
+        if len(arg_codes) == 0:
+
+            @reads_frames(expr_notes)
+            def call(env, expr=expr):
+                fn = fn_code(env)
+                if type(fn) is Function:
+                    return invoke(fn, ())
+                return fn()
+
+        elif len(arg_codes) == 1:
+            [a] = arg_codes
+
+            @reads_frames(expr_notes)
+            def call(env, expr=expr):
+                fn = fn_code(env)
+                if type(fn) is Function:
+                    return invoke(fn, (a(env),))
+                return fn(a(env))
+
+        elif len(arg_codes) == 2:
+            [a, b] = arg_codes
+
+            @reads_frames(expr_notes)
+            def call(env, expr=expr):
+                fn = fn_code(env)
+                if type(fn) is Function:
+                    return invoke(fn, (a(env), b(env)))
+                return fn(a(env), b(env))
+
+        else:
+
+            @reads_frames(expr_notes)
+            def call(env, expr=expr):
+                fn = fn_code(env)
+                args = [arg_code(env) for arg_code in arg_codes]
+                if type(fn) is Function:
+                    return invoke(fn, args)
+                return fn(*args)
+
+        return call
+
+    def _compile_operator(self, expr, scope, tail):
+        [name, *operands] = expr
+        codes = [self.compile(operand, scope) for operand in operands]
+        # Once the operator is rebound anywhere, it is looked up and called
+        fn_code = self._compile_lookup(name, scope)
+        call = self._compile_invoke(expr, fn_code, codes, tail)
+        epoch = operator_epoch
+
+        if len(codes) == 1 and name in self.UNARY_CODE:
+            return self.UNARY_CODE[name](codes[0], call, epoch)
+        if len(codes) == 2 or len(codes) > 2 and name in self.ARITHMETIC:
+            # [- a b c] is [- [- a b] c]
+            code = codes[0]
+            for operand_code in codes[1:]:
+                code = self.BINARY_CODE[name](code, operand_code, call, epoch)
+            return code
+
+        native = self.operators[name]
+
+        def operate(env):
+            if operator_epoch != epoch:
+                return call(env)
+            return native(*[code(env) for code in codes])
+
+        return operate
+
+    def _compile_profiled_call(self, expr, fn_code, arg_codes, invoke):
+        """A call that times natives; `Tea._apply` times user functions."""
+        profile = self.tea.profiler.call
+        head = expr[0]
+
+        @reads_frames(expr_notes)
+        def call(env, expr=expr):
+            fn = fn_code(env)
+            args = [arg_code(env) for arg_code in arg_codes]
+            if type(fn) is Function:
+                return invoke(fn, args)
+            name = head if isinstance(head, str) else getattr(fn, "__name__", "?")
+            return profile(f"native:{name}", fn, args)
+
+        return call
+
+
+class Untranslatable(Exception):
+    """Code that the specializer leaves to the generic closures."""
+
+
+class Translation:
+    """
+    The Python source of one kernel: a loop or a function body whose
+    variables only ever hold numbers. Tea variables become Python locals,
+    numbered in order, and the variables it uses from outside become
+    arguments after the parameters.
+    """
+
+    # The builtin operators, by the Python operator they run
+    OPERATORS = {
+        "+": "+",
+        "-": "-",
+        "*": "*",
+        "/": "/",
+        "//": "//",
+        "%": "%",
+        ">": ">",
+        "<": "<",
+        ">=": ">=",
+        "<=": "<=",
+        "=": "==",
+    }
+    COMPARISONS = (">", "<", ">=", "<=", "=")
+
+    def __init__(self, compiler, scope, params=()):
+        self.compiler = compiler
+        self.scope = scope
+        self.blocks = [{}]  # tea name -> Python name, innermost last
+        self.free = {}  # of the variables from outside
+        self.assigned = {}  # the variables from outside that it sets
+        self.lines = []
+        self.indent = 2
+        self.count = 0
+        self.params = [self._declare(param) for param in params]
+        self.sugar = {
+            "++": compiler.transformer.transform_incr_to_set,
+            "--": compiler.transformer.transform_decr_to_set,
+            "+=": compiler.transformer.transform_incr_val_to_set,
+            "-=": compiler.transformer.transform_decr_val_to_set,
+            "for": compiler.transformer.transform_for_to_while,
+            "switch": compiler.transformer.transform_switch_to_if,
+        }
+
+    def source(self, expr):
+        """The source of `kernel(env, meter, *params, *free)`, which runs expr."""
+        self._statement(expr, "result")
+        arguments = ", ".join(["env", "meter", *self.params, *self.free.values()])
+        lines = [
+            f"def kernel({arguments}):",
+            "    countdown = meter.countdown",
+            "    try:",
+            *self.lines,
+            "        return result",
+            "    finally:",
+            "        meter.countdown = countdown",
+        ]
+        if self.assigned:
+            lines.append(f"        store(env, {', '.join(self.assigned.values())})")
+        return "\n".join(lines) + "\n"
+
+    def _emit(self, line):
+        self.lines.append("    " * self.indent + line)
+
+    def _declare(self, name):
+        block = self.blocks[-1]
+        if name not in block:
+            block[name] = f"v{self.count}"
+            self.count += 1
+        return block[name]
+
+    def _resolve(self, name):
+        for block in reversed(self.blocks):
+            if name in block:
+                return block[name]
+        if name not in self.free:
+            self.free[name] = f"v{self.count}"
+            self.count += 1
+        return self.free[name]
+
+    def _assign(self, name, value):
+        if not isinstance(name, str):  # a property
+            raise Untranslatable(name)
+        if value[1] != "number":
+            raise Untranslatable(value)
+        target = self._resolve(name)
+        if name in self.free and target == self.free[name]:
+            self.assigned[name] = target
+        return target
+
+    def _is_operator(self, head):
+        return (
+            head in self.OPERATORS
+            and head in self.compiler.operators
+            and self.scope.address(head)[1] is None  # not a local variable
+            and not any(head in block for block in self.blocks)
+        )
+
+    def _expression(self, expr):
+        """Return the Python source of expr, and whether it is a number or a bool."""
+        if type(expr) is bool:  # a folded comparison
+            return repr(expr), "bool"
+        if type(expr) is int or type(expr) is float and math.isfinite(expr):
+            return f"({expr!r})", "number"
+        if isinstance(expr, str):
+            return self._resolve(expr), "number"
+        if not isinstance(expr, list) or not expr or not isinstance(expr[0], str):
+            raise Untranslatable(expr)
+
+        head = expr[0]
+        if head in self.sugar:
+            return self._expression(self.sugar[head](expr))
+        if head == "begin" and len(expr) == 2:
+            return self._expression(expr[1])
+        if head == "set" and len(expr) == 3:
+            value = self._expression(expr[2])
+            return f"({self._assign(expr[1], value)} := {value[0]})", "number"
+        if head == "if" and len(expr) == 4:
+            condition = self._expression(expr[1])[0]
+            [consequent, kind] = self._expression(expr[2])
+            alternate = self._expression(expr[3])
+            if alternate[1] != kind:
+                raise Untranslatable(expr)
+            return f"({consequent} if {condition} else {alternate[0]})", kind
+        if not self._is_operator(head) or len(expr) == 1:
+            raise Untranslatable(expr)
+
+        operands = [self._expression(operand) for operand in expr[1:]]
+        if any(kind != "number" for _, kind in operands):
+            raise Untranslatable(expr)
+        symbol = self.OPERATORS[head]
+        if len(operands) == 1 and head in ("+", "-"):
+            return f"({symbol}{operands[0][0]})", "number"
+        if head in self.COMPARISONS:
+            if len(operands) != 2:
+                raise Untranslatable(expr)
+            return f"({operands[0][0]} {symbol} {operands[1][0]})", "bool"
+        if len(operands) < 2:
+            raise Untranslatable(expr)
+        # [- a b c] is [- [- a b] c]
+        source = operands[0][0]
+        for operand, _ in operands[1:]:
+            source = f"({source} {symbol} {operand})"
+        return source, "number"
+
+    def _statement(self, expr, target=None, in_block=False):
+        """Emit the lines that run expr, and store its value in target."""
+        head = expr[0] if isinstance(expr, list) and expr else None
+        if not isinstance(head, str):
+            head = None
+        if head in self.sugar:
+            return self._statement(self.sugar[head](expr), target, in_block)
+
+        if head == "begin":
+            self.blocks.append({})
+            for index, statement in enumerate(expr[1:], start=2):
+                self._statement(statement, target if index == len(expr) else None, True)
+            self.blocks.pop()
+            if len(expr) == 1 and target is not None:
+                self._emit(f"{target} = None")
+        elif head == "var" and len(expr) == 3 and isinstance(expr[1], str):
+            # Only a block can declare: elsewhere the variable would only
+            # exist on some paths
+            if not in_block:
+                raise Untranslatable(expr)
+            value = self._expression(expr[2])
+            if value[1] != "number":
+                raise Untranslatable(expr)
+            name = self._declare(expr[1])
+            self._emit(f"{name} = {value[0]}")
+            if target is not None:
+                self._emit(f"{target} = {name}")
+        elif head == "set" and len(expr) == 3:
+            value = self._expression(expr[2])
+            name = self._assign(expr[1], value)
+            self._emit(f"{name} = {value[0]}")
+            if target is not None:
+                self._emit(f"{target} = {name}")
+        elif head == "if" and len(expr) == 4:
+            self._emit(f"if {self._expression(expr[1])[0]}:")
+            self._nested(expr[2], target)
+            self._emit("else:")
+            self._nested(expr[3], target)
+        elif head == "while" and len(expr) == 3:
+            if target is not None:
+                self._emit(f"{target} = None")
+            self._emit(f"while {self._expression(expr[1])[0]}:")
+            self._nested(expr[2], target)
+            # Count the iteration like the closures of `while` do
+            self.indent += 1
+            self._emit("countdown -= 1")
+            self._emit("if countdown < 0:")
+            self._emit("    meter.countdown = countdown")
+            self._emit("    meter.check()")
+            self._emit("    countdown = meter.countdown")
+            self.indent -= 1
+        elif target is not None:
+            self._emit(f"{target} = {self._expression(expr)[0]}")
+        else:
+            self._emit(self._expression(expr)[0])
+
+    def _nested(self, expr, target):
+        self.indent += 1
+        self._statement(expr, target)
+        self.indent -= 1
+
+
+class Specializer:
+    """
+    Run numeric loops as generated Python. A `while` loop, or a function
+    body with a loop, is translated when its variables can only hold
+    numbers, provided those it reads from outside hold an int or a float
+    when it starts: `Translation` makes the source, which is compiled on
+    its first run. Each run checks the types of the outside values, and
+    runs the generic closures when one is anything else. The kernel
+    counts its steps like the closures, and writes back the outside
+    variables it sets when it returns or fails.
+    """
+
+    def __init__(self, compiler):
+        self.compiler = compiler
+        self.translated = 0  # loops and function bodies with a kernel
+        self.fallbacks = 0  # runs that failed the type guard
+
+    def loop(self, expr, scope, generic):
+        """Return the code of the while loop expr, specialized if it can be."""
+        translation = self._translate(expr, scope)
+        if translation is None:
+            return generic
+        return self._guard(expr, scope, *translation, generic)
+
+    def function(self, params, body, fn_scope, generic):
+        """Return the code of a function body, specialized if it can be."""
+        if not self._loops(body):
+            return generic
+        translation = self._translate(body, fn_scope, params)
+        if translation is None:
+            return generic
+        return self._guard(body, fn_scope, *translation, generic)
+
+    def _translate(self, expr, scope, params=()):
+        translation = Translation(self.compiler, scope, params)
+        try:
+            source = translation.source(expr)
+        except (Untranslatable, RecursionError):
+            return None
+        self.translated += 1
+        return translation, source
+
+    def _compile(self, source, store, generic):
+        namespace = {"store": store}
+        try:
+            exec(compile(source, "<tea kernel>", "exec"), namespace)
+        except (SyntaxError, RecursionError, MemoryError):  # nested too deep
+            return lambda env, meter, *values: generic(env)
+        return namespace["kernel"]
+
+    @classmethod
+    def _loops(cls, expr):
+        if not isinstance(expr, list) or not expr:
+            return False
+        if expr[0] in ("while", "for"):
+            return True
+        if expr[0] in ("quote", "lambda"):
+            return False
+        return any(cls._loops(operand) for operand in expr[1:])
+
+    def _guard(self, expr, scope, translation, source, generic):
+        compiler = self.compiler
+        # The parameters are the first slots of the frame
+        loads = [
+            lambda env, slot=slot: env.slots[slot]
+            for slot in range(len(translation.params))
+        ]
+        loads += [compiler._compile_lookup(name, scope) for name in translation.free]
+        stores = [compiler._compile_store(name, scope) for name in translation.assigned]
+        epoch = operator_epoch
+        kernel = None
+
+        def store(env, *values):
+            for store_code, value in zip(stores, values):
+                store_code(env, value)
+
+        @reads_frames(expr_notes)
+        def specialized(env, expr=expr):
+            nonlocal kernel
+            if operator_epoch != epoch:  # the kernel runs the builtins
+                return generic(env)
+            try:
+                values = [load(env) for load in loads]
+            except Exception:
+                values = [None]  # the generic code fails as it does
+            for value in values:
+                if type(value) is not int and type(value) is not float:
+                    self.fallbacks += 1
+                    return generic(env)
+
+            if kernel is None:
+                kernel = self._compile(source, store, generic)
+            return kernel(env, running.meter, *values)
+
+        return specialized
+
+
+class Limits:
+    """
+    The resources an evaluation may use: steps (loop iterations and
+    function calls), allocations and seconds of wall time. None is no
+    limit.
+
+    Allocations are counted for the whole process, not per evaluation:
+    they are the Python objects alive beyond those at the start, so what
+    other threads allocate meanwhile counts too. It is a guard against a
+    runaway script, not a measure of what one uses.
+    """
+
+    __slots__ = ("steps", "allocations", "seconds")
+
+    def __init__(self, steps=None, allocations=None, seconds=None):
+        for name, value in (("steps", steps), ("allocations", allocations)):
+            if value is not None and value < 0:
+                raise ValueError(f"{name} cannot be negative: {value}")
+        if seconds is not None and seconds < 0:
+            raise ValueError(f"seconds cannot be negative: {seconds}")
+        self.steps = steps
+        self.allocations = allocations
+        self.seconds = seconds
+
+    def __repr__(self):
+        return (
+            f"Limits(steps={self.steps}, allocations={self.allocations}, "
+            f"seconds={self.seconds})"
+        )
+
+
+class LimitExceeded(Exception):
+    """An evaluation went over its limit of "steps", "allocations" or "seconds"."""
+
+    def __init__(self, limit, message):
+        super().__init__(message)
+        self.limit = limit
+
+
+class Meter:
+    """
+    Enforce the limits of an evaluation. Every loop iteration and function
+    call takes one from countdown, and only when it runs out are the limits
+    checked, every INTERVAL steps at most, so a step costs a subtraction.
+    Without limits countdown never runs out.
+    """
+
+    INTERVAL = 1000
+    __slots__ = ("countdown", "period", "steps", "limits", "deadline", "blocks")
+
+    def __init__(self):
+        self.start(None)
+
+    def start(self, limits):
+        self.limits = limits
+        self.steps = 0
+        self.deadline = self.blocks = None
+        if limits is None:
+            self.period = self.countdown = sys.maxsize
+            return
+        if limits.seconds is not None:
+            self.deadline = time.monotonic() + limits.seconds
+        if limits.allocations is not None:
+            self.blocks = sys.getallocatedblocks() + limits.allocations
+        self.reset()
+
+    def save(self):
+        """The state of an evaluation, for one that runs inside it."""
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def restore(self, state):
+        for name, value in zip(self.__slots__, state):
+            setattr(self, name, value)
+
+    def reset(self):
+        period = self.INTERVAL
+        if self.limits.steps is not None:
+            period = min(period, self.limits.steps - self.steps)
+        self.period = self.countdown = period
+
+    def check(self):
+        """Called on the step that takes countdown below zero."""
+        limits = self.limits
+        if limits is None:
+            self.period = self.countdown = sys.maxsize
+            return
+        self.steps += self.period + 1
+        if limits.steps is not None and self.steps > limits.steps:
+            raise LimitExceeded(
+                "steps", f"The evaluation took more than {limits.steps} steps"
+            )
+        if self.deadline is not None and time.monotonic() > self.deadline:
+            raise LimitExceeded(
+                "seconds", f"The evaluation took more than {limits.seconds} seconds"
+            )
+        if self.blocks is not None and sys.getallocatedblocks() > self.blocks:
+            raise LimitExceeded(
+                "allocations",
+                f"The evaluation allocated more than {limits.allocations} objects",
+            )
+        self.reset()
+
+
+class Running(threading.local):
+    """
+    The interpreter and meter of the evaluation that runs in each thread.
+    Compiled code reads them when it runs, not when it is compiled, so code
+    that another interpreter compiled (a pool shares the code of the base
+    interpreter) imports, instantiates and memoizes in the caller, and
+    counts against its limits.
+    """
+
+    def __init__(self):
+        self.meter = Meter()
+        self.tea = None  # outside an evaluation
+
+
+running = Running()
+
+
+class Profiler:
+    """
+    Time what a tea program runs. Every entry has a "kind:name" key
+    (def:fib, form:while, native:+) and gets its number of calls, its
+    cumulative time, counted once across recursion, and its self time.
+    The self time of every call stack is kept too, for flame graphs.
+    """
+
+    def __init__(self, clock=time.perf_counter):
+        self.clock = clock
+        self.stats = {}  # key -> [calls, cumulative, self]
+        self.running = []  # [key, stack, start, time spent in children]
+        self.active = {}  # key -> its calls that are running
+        # Call stacks are numbered; stack 0 is the root
+        self.stacks = {}  # (parent stack, key) -> stack
+        self.stack_keys = [None]  # stack -> (parent stack, key)
+        self.stack_times = [0.0]  # stack -> self time
+
+    def enter(self, key):
+        parent = self.running[-1][1] if self.running else 0
+        stack = self.stacks.get((parent, key))
+        if stack is None:
+            stack = self.stacks[parent, key] = len(self.stack_keys)
+            self.stack_keys.append((parent, key))
+            self.stack_times.append(0.0)
+        self.active[key] = self.active.get(key, 0) + 1
+        self.running.append([key, stack, self.clock(), 0.0])
+
+    def leave(self):
+        [key, stack, start, children] = self.running.pop()
+        elapsed = self.clock() - start
+        stats = self.stats.get(key)
+        if stats is None:
+            stats = self.stats[key] = [0, 0.0, 0.0]
+        stats[0] += 1
+        stats[2] += elapsed - children
+        self.stack_times[stack] += elapsed - children
+        self.active[key] -= 1
+        if self.active[key] == 0:  # the outermost call of a recursion
+            stats[1] += elapsed
+        if self.running:
+            self.running[-1][3] += elapsed
+
+    def call(self, key, fn, args):
+        """Call a native with args, and time it."""
+        self.enter(key)
+        try:
+            return fn(*args)
+        finally:
+            self.leave()
+
+    def wrap(self, key, code):
+        """Time every run of compiled closure code."""
+        enter, leave = self.enter, self.leave
+
+        def profiled(env):
+            enter(key)
+            try:
+                return code(env)
+            finally:
+                leave()
+
+        return profiled
+
+    def report(self, limit=None):
+        """A table of the entries, the most self time first."""
+        rows = sorted(self.stats.items(), key=lambda item: item[1][2], reverse=True)
+        lines = [f"{'calls':>10} {'cumulative ms':>14} {'self ms':>10}  name"]
+        for key, [calls, cumulative, self_time] in rows[:limit]:
+            cumulative, self_time = cumulative * 1000, self_time * 1000
+            lines.append(f"{calls:>10} {cumulative:>14.3f} {self_time:>10.3f}  {key}")
+        return "\n".join(lines)
+
+    def collapsed(self):
+        """
+        The call stacks in the collapsed format of flame graph tools: one
+        "outer;inner self-microseconds" line per stack.
+        """
+        lines = []
+        for stack in range(1, len(self.stack_keys)):
+            microseconds = round(self.stack_times[stack] * 1_000_000)
+            if microseconds == 0:
+                continue
+            keys = []
+            while stack:
+                stack, key = self.stack_keys[stack]
+                keys.append(key)
+            lines.append(f"{';'.join(reversed(keys))} {microseconds}")
+        return "\n".join(lines)
+
+
+class Tail:
+    """The value of a task is the value of expr in env: evaluate it in place."""
+
+    __slots__ = ("expr", "env")
+
+    def __init__(self, expr, env):
+        self.expr = expr
+        self.env = env
+
+
+class StackMachine:
+    """
+    Evaluate expressions with an explicit continuation stack instead of
+    Python recursion, so recursion depth is only bounded by memory.
+
+    Every special form is a generator ("task"). A task yields an
+    (expr, env) pair when it needs the value of a sub-expression, or
+    another task to run, and the machine sends the value back. A task
+    that ends by returning `Tail(expr, env)` is replaced by that
+    evaluation, which gives proper tail calls in `if`, `begin` and
+    function bodies.
+    """
+
+    def __init__(self, tea):
+        self.tea = tea
+        self.meter = tea.meter
+        self.transformer = tea.transformer
+        self.special_forms = {
+            "quote": self._quote,
+            "begin": self._begin,
+            "var": self._var,
+            "set": self._set,
+            "if": self._if,
+            "while": self._while,
+            "lambda": self._lambda,
+            "class": self._class,
+            "super": self._super,
+            "new": self._new,
+            "prop": self._prop,
+            "module": self._module,
+            "import": self._import,
+            "memo": self._memo,
+        }
+        self.sugar = {
+            "def": self.transformer.transform_def_to_var_lambda,
+            "defmemo": self.transformer.transform_defmemo_to_var_memo,
+            "switch": self.transformer.transform_switch_to_if,
+            "for": self.transformer.transform_for_to_while,
+            "++": self.transformer.transform_incr_to_set,
+            "--": self.transformer.transform_decr_to_set,
+            "+=": self.transformer.transform_incr_val_to_set,
+            "-=": self.transformer.transform_decr_val_to_set,
+        }
+
+    @staticmethod
+    def _notes(tb):
+        """
+        The expressions the tasks of a failed run were evaluating, from the
+        innermost out, and the functions they were running in. A function
+        body runs in place of the task of its call when it is done with its
+        arguments, so the call form comes from the activation.
+        """
+        run = tb.tb_frame
+        frames = []
+        for task in run.f_locals["stack"]:
+            while task is not None:  # a task, and the one it yields from
+                frames.append(task.gi_frame)
+                task = task.gi_yieldfrom
+        machine = run.f_locals["self"]
+        tb = tb.tb_next  # the frames of the failing task, up to another run
+        while tb is not None and tb.tb_frame.f_locals.get("self") is machine:
+            if tb.tb_frame.f_code in FRAME_READERS:
+                break
+            frames.append(tb.tb_frame)
+            tb = tb.tb_next
+
+        notes = []
+        activation = None
+        for frame in reversed(frames):
+            f_locals = frame.f_locals
+            env = f_locals.get("env")
+            while env is not None and type(env) is not Activation:
+                env = env.parent
+            if env is not activation:
+                if activation is not None:
+                    notes.append((activation.fn.body, activation.fn.name))
+                    notes.append((activation.call, None))
+                activation = env
+            expr = f_locals.get("expr")
+            if isinstance(expr, list):
+                notes.append((expr, None))
+        if activation is not None:
+            notes.append((activation.fn.body, activation.fn.name))
+            notes.append((activation.call, None))
+        return notes
+
+    @reads_frames(_notes)
+    def run(self, task):
+        """Drive a task, and every task it starts, to its final value."""
+        stack = []  # tasks waiting for the value of the running one
+        value = None
+
+        while True:
+            if task is None:  # value is ready: resume the task waiting for it
+                if not stack:
+                    return value
+                task = stack.pop()
+
+            try:
+                request = task.send(value)
+            except StopIteration as stop:
+                task, value = None, stop.value
+                if type(value) is Tail:
+                    task, value = self._evaluate(value.expr, value.env)
+                continue
+
+            stack.append(task)
+            if type(request) is tuple:
+                task, value = self._evaluate(*request)
+            else:
+                task, value = request, None
+
+    def _evaluate(self, expr, env):
+        """Return (task, None) for a form, or (None, value) for an atom."""
+        # VAR LOOKUP
+        if isinstance(expr, str):
+            return None, env.lookup(expr)
+
+        if isinstance(expr, int | float):
+            return None, expr
+
+        if isinstance(expr, list):
+            head = expr[0]
+            if isinstance(head, str):
+                if head in self.special_forms:
+                    return self.special_forms[head](expr, env), None
+                if head in self.sugar:
+                    return self._evaluate(self.sugar[head](expr), env)
+            return self._call(expr, env), None
+
+        raise Exception(f"Unimplemented: {expr}")
+
+    def body(self, body, env):
+        """A function, class or module body: a block shares the given env."""
+        if isinstance(body, list) and body and body[0] == "begin":
+            return self._sequence(body[1:], env)
+        return self._sequence([body], env)
+
+    def _sequence(self, expressions, env):
+        for expr in expressions[:-1]:
+            yield expr, env
+        if expressions:
+            return Tail(expressions[-1], env)
+
+    # Quoted text
+    def _quote(self, expr, env):
+        [_, string] = expr
+        return string
+        yield  # still a task, even if it never waits
+
+    # BLOCKS
+    def _begin(self, expr, env):
+        return (yield from self._sequence(expr[1:], Environment({}, env)))
+
+    # VAR DECLARATIONS
+    def _var(self, expr, env):
+        [_, name, value] = expr
+        if isinstance(value, list) and value[:1] == ["lambda"]:
+            fn = yield value, env
+            fn.name = name  # for the error stack
+            return env.define(name, fn)
+        return env.define(name, (yield value, env))
+
+    # VAR UPDATE
+    def _set(self, expr, env):
+        [_, ref, value] = expr
+        # Set a property
+        if isinstance(ref, list) and ref[0] == "prop":
+            [_, instance, prop_name] = ref
+            instance_env = yield instance, env
+            return instance_env.define(prop_name, (yield value, env))
+        # Set a var
+        return env.assign(ref, (yield value, env))
+
+    # IF EXPRESSION
+    def _if(self, expr, env):
+        [_, condition, consequent, alternate] = expr
+        if (yield condition, env):
+            return Tail(consequent, env)
+        return Tail(alternate, env)
+
+    # WHILE LOOP
+    def _while(self, expr, env):
+        [_, condition, block] = expr
+        result = None
+        meter = self.meter
+        while (yield condition, env):
+            result = yield block, env
+            countdown = meter.countdown - 1
+            meter.countdown = countdown
+            if countdown < 0:
+                meter.check()
+        return result
+
+    # lambda function
+    def _lambda(self, expr, env):
+        [_, params, body] = expr
+        return Function(params, body, env)
+        yield  # still a task, even if it never waits
+
+    # OOP CLASS
+    def _class(self, expr, env):
+        [_, name, parent, body] = expr
+        parent_env = (yield parent, env) or env
+        class_env = Class({}, parent_env)
+        yield self.body(body, class_env)
+        return env.define(name, class_env)
+
+    def _super(self, expr, env):
+        [_, class_name] = expr
+        return (yield class_name, env).parent
+
+    def _new(self, expr, env):  # [new <class name> <args> ...]
+        class_env = yield expr[1], env
+        instance_env = Instance(class_env)
+        args = []
+        for arg in expr[2:]:
+            args.append((yield arg, env))
+        constructor = class_env.lookup("constructor")
+        yield self._enter(constructor, [instance_env, *args], expr)
+        return instance_env
+
+    # Access to a property
+    def _prop(self, expr, env):
+        [_, instance, name] = expr
+        return (yield instance, env).lookup(name)
+
+    # Module declaration
+    def _module(self, expr, env):
+        [_, name, body] = expr
+        module_env = Environment({}, env)
+        yield self.body(body, module_env)
+        return env.define(name, module_env)
+
+    # Import module
+    def _import(self, expr, env):
+        [_, module_name] = expr
+        module_env = self.tea._imported(module_name)
+        if module_env is None:
+            module_body = self.tea._read_module(module_name)
+            module_expr = ["module", module_name, module_body]
+            module_env = yield module_expr, self.tea.global_env
+            self.tea.modules[module_name] = module_env
+        return module_env
+
+    # Memoized function: [memo fn size ttl]
+    def _memo(self, expr, env):
+        args = []
+        for arg in expr[1:]:
+            args.append((yield arg, env))
+        return self.tea.memoize(*args)
+
+    # Function call
+    def _call(self, expr, env):
+        fn = yield expr[0], env
+        args = []
+        for arg in expr[1:]:
+            args.append((yield arg, env))
+
+        # Native Function
+        if type(fn) is not Function:
+            return fn(*args)
+
+        # User-defined function: its body runs in place of this task
+        return (yield from self._enter(fn, args, expr))
+
+    def _enter(self, fn, args, call):
+        meter = self.meter
+        countdown = meter.countdown - 1
+        meter.countdown = countdown
+        if countdown < 0:
+            meter.check()
+        params = fn.params
+        if len(args) < len(params):
+            raise Exception(f"Expected {len(params)} arguments, got {len(args)}")
+
+        activation_env = Activation(dict(zip(params, args)), fn, call)
+        return (yield from self.body(fn.body, activation_env))
+
+
+class Await:
+    """A task waiting for an awaitable, in the async machine."""
+
+    __slots__ = ("awaitable",)
+
+    def __init__(self, awaitable):
+        self.awaitable = awaitable
+
+
+class AsyncMachine(StackMachine):
+    """
+    The stack machine, run as a coroutine on an asyncio event loop. A native
+    that returns a coroutine suspends the evaluation until the coroutine is
+    done, and its result is the value of the call. Three more forms run tea
+    code concurrently: [spawn expr] starts evaluating expr in an asyncio
+    task and returns the task, [await task] waits for its value, and
+    [gather task ...] waits for all of them, and gives a vector of values.
+    """
+
+    def __init__(self, tea):
+        super().__init__(tea)
+        self.special_forms.update(
+            {"spawn": self._spawn, "await": self._await, "gather": self._gather}
+        )
+        self.tasks = set()  # spawned and still running
+
+    @reads_frames(StackMachine._notes)
+    async def run(self, task):
+        """Drive a task like StackMachine.run, awaiting what it waits for."""
+        stack = []
+        value = None
+
+        while True:
+            if task is None:
+                if not stack:
+                    return value
+                task = stack.pop()
+
+            try:
+                request = task.send(value)
+            except StopIteration as stop:
+                task, value = None, stop.value
+                if type(value) is Tail:
+                    task, value = self._evaluate(value.expr, value.env)
+                continue
+
+            if type(request) is Await:  # the task goes on with the result
+                value = await request.awaitable
+                continue
+
+            stack.append(task)
+            if type(request) is tuple:
+                task, value = self._evaluate(*request)
+            else:
+                task, value = request, None
+
+    def _spawn(self, expr, env):
+        [_, body] = expr
+        task = asyncio.ensure_future(self.run(self._sequence([body], env)))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+        yield  # still a task, even if it never waits
+
+    def _await(self, expr, env):
+        [_, awaitable] = expr
+        return (yield Await((yield awaitable, env)))
+
+    def _gather(self, expr, env):
+        awaitables = []
+        for arg in expr[1:]:
+            awaitables.append((yield arg, env))
+        return PersistentVector.of((yield Await(asyncio.gather(*awaitables))))
+
+    # Function call
+    def _call(self, expr, env):
+        fn = yield expr[0], env
+        args = []
+        for arg in expr[1:]:
+            args.append((yield arg, env))
+
+        # Native Function, maybe a coroutine function
+        if type(fn) is not Function:
+            value = fn(*args)
+            if asyncio.iscoroutine(value):
+                value = yield Await(value)
+            return value
+
+        return (yield from self._enter(fn, args, expr))
+
+
+# BYTECODE
+# Every instruction is an (opcode, argument) pair of ints
+OPCODES = (
+    "LOAD_CONST",  # push consts[arg]
+    "LOAD_LOCAL",  # push slot arg of the current frame
+    "LOAD_SLOT",  # push the variable at addresses[arg] = (depth, slot, name)
+    "LOAD_NAME",  # push the variable named by addresses[arg] = (depth, None, name)
+    "STORE_SLOT",  # assign TOS to a slot variable
+    "STORE_NAME",  # assign TOS to a dynamic variable
+    "DEFINE_SLOT",  # declare TOS in slot arg of the current frame
+    "DEFINE_NAME",  # declare TOS as consts[arg] in the current environment
+    "POP",
+    "JUMP",  # go to arg
+    "JUMP_IF_FALSE",  # pop and go to arg if false
+    "ENTER_BLOCK",  # open a frame for the block scope consts[arg]
+    "LEAVE_BLOCK",
+    "MAKE_FUNCTION",  # push a closure over the function template consts[arg]
+    "CALL",  # call with arg arguments
+    "TAIL_CALL",  # call with arg arguments, replacing the current frame
+    "RETURN",
+    "GET_PROP",  # replace TOS with its property consts[arg]
+    "SET_PROP",  # set property consts[arg] of the object below TOS to TOS
+    "MAKE_CLASS",  # replace the parent class (or null) on TOS with a class env
+    "MAKE_MODULE",  # push a module environment
+    "RUN_IN",  # run the code consts[arg] in the environment on TOS
+    "SUPER",
+    "NEW",  # instantiate the class below arg arguments
+    "IMPORT",  # load and run the module consts[arg]
+    "REGISTER_MODULE",  # remember TOS as the loaded module consts[arg]
+    "BINARY_OP",  # replace the two top values with consts[arg](below TOS, TOS)
+    "UNARY_OP",  # replace TOS with consts[arg](TOS)
+    "LOOP",  # go back to arg, at the end of a loop iteration
+)
+(
+    LOAD_CONST,
+    LOAD_LOCAL,
+    LOAD_SLOT,
+    LOAD_NAME,
+    STORE_SLOT,
+    STORE_NAME,
+    DEFINE_SLOT,
+    DEFINE_NAME,
+    POP,
+    JUMP,
+    JUMP_IF_FALSE,
+    ENTER_BLOCK,
+    LEAVE_BLOCK,
+    MAKE_FUNCTION,
+    CALL,
+    TAIL_CALL,
+    RETURN,
+    GET_PROP,
+    SET_PROP,
+    MAKE_CLASS,
+    MAKE_MODULE,
+    RUN_IN,
+    SUPER,
+    NEW,
+    IMPORT,
+    REGISTER_MODULE,
+    BINARY_OP,
+    UNARY_OP,
+    LOOP,
+) = range(len(OPCODES))
+
+
+def slot_name(frame, slot):
+    for name, index in frame.names.items():
+        if index == slot:
+            return name
+
+
+class CodeObject:
+    """Compiled bytecode: an int array of instructions plus its tables."""
+
+    def __init__(self, ops, consts, addresses, scope=None, name=None, positions=()):
+        self.ops = ops
+        self.consts = consts
+        self.addresses = addresses
+        self.scope = scope  # the frame layout of a function body
+        self.name = name  # of the function, for a function body
+        self.positions = positions  # (start, end, expr), the innermost first
+        self.epoch = operator_epoch  # of the builtin operators it runs
+
+    def expr_at(self, pc):
+        """The innermost list expression whose code holds pc, if any."""
+        for start, end, expr in self.positions:
+            if start <= pc < end:
+                return expr
+        return None
+
+    def disassemble(self):
+        lines = []
+        for pc in range(0, len(self.ops), 2):
+            op, arg = self.ops[pc], self.ops[pc + 1]
+            if op in (LOAD_SLOT, LOAD_NAME, STORE_SLOT, STORE_NAME):
+                detail = self.addresses[arg]
+            elif op in (LOAD_CONST, DEFINE_NAME, GET_PROP, SET_PROP, IMPORT):
+                detail = self.consts[arg]
+            elif op in (BINARY_OP, UNARY_OP):
+                detail = self.consts[arg].__name__
+            else:
+                detail = ""
+            lines.append(f"{pc:5} {OPCODES[op]:<14} {arg:<4} {detail}")
+        return "\n".join(lines)
+
+
+class FunctionTemplate:
+    """What MAKE_FUNCTION needs to build a closure."""
+
+    def __init__(self, params, body, code):
+        self.params = params
+        self.body = body
+        self.code = code
+
+
+class CodeBuilder:
+    def __init__(self):
+        self.ops = []
+        self.consts = []
+        self.addresses = []
+        self.positions = []
+        self.const_indexes = {}  # (type, value) -> index in consts
+        self.address_indexes = {}
+
+    def emit(self, op, arg=0):
+        self.ops += [op, arg]
+        return len(self.ops) - 1  # where to patch the argument
+
+    def label(self):
+        return len(self.ops)
+
+    def patch(self, position, target):
+        self.ops[position] = target
+
+    def const(self, value):
+        # Keyed by type too, so that 1, 1.0 and True stay apart
+        key = (type(value), value)
+        try:
+            index = self.const_indexes.get(key)
+        except TypeError:  # unhashable: the same object only
+            key = (type(value), id(value))
+            index = self.const_indexes.get(key)
+        if index is None:
+            index = self.const_indexes[key] = len(self.consts)
+            self.consts.append(value)
+        return index
+
+    def address(self, address):
+        index = self.address_indexes.get(address)
+        if index is None:
+            index = self.address_indexes[address] = len(self.addresses)
+            self.addresses.append(address)
+        return index
+
+    def build(self, scope=None, name=None):
+        return CodeObject(
+            array("i", self.ops),
+            self.consts,
+            self.addresses,
+            scope,
+            name,
+            self.positions,
+        )
+
+
+class BytecodeCompiler:
+    """
+    Compile a parsed expression into a `CodeObject` for the `VM`. It uses
+    the same scope analysis as `Compiler`, so frames have the same layout
+    in both engines.
+    """
+
+    UNARY_FUNCTIONS = {"+": operator.pos, "-": operator.neg}
+    BINARY_FUNCTIONS = {
+        "+": operator.add,
+        "-": operator.sub,
+        "*": operator.mul,
+        "/": operator.truediv,
+        "//": operator.floordiv,
+        "%": operator.mod,
+        ">": operator.gt,
+        "<": operator.lt,
+        ">=": operator.ge,
+        "<=": operator.le,
+        "=": operator.eq,
+    }
+    # By function, for the VM to look up an operator that was rebound
+    OPERATOR_NAMES = {
+        function: name
+        for functions in (UNARY_FUNCTIONS, BINARY_FUNCTIONS)
+        for name, function in functions.items()
+    }
+
+    def __init__(self, tea):
+        self.tea = tea
+        self.transformer = tea.transformer
+        self.operators = {}  # builtin operators of the program being compiled
+        self.special_forms = {
+            "quote": self._emit_quote,
+            "begin": self._emit_begin,
+            "var": self._emit_var,
+            "set": self._emit_set,
+            "if": self._emit_if,
+            "while": self._emit_while,
+            "lambda": self._emit_lambda,
+            "class": self._emit_class,
+            "super": self._emit_super,
+            "new": self._emit_new,
+            "prop": self._emit_prop,
+            "module": self._emit_module,
+            "import": self._emit_import,
+            "memo": self._emit_memo,
+        }
+        self.sugar = {
+            "def": self.transformer.transform_def_to_var_lambda,
+            "defmemo": self.transformer.transform_defmemo_to_var_memo,
+            "switch": self.transformer.transform_switch_to_if,
+            "for": self.transformer.transform_for_to_while,
+            "++": self.transformer.transform_incr_to_set,
+            "--": self.transformer.transform_decr_to_set,
+            "+=": self.transformer.transform_incr_val_to_set,
+            "-=": self.transformer.transform_decr_val_to_set,
+        }
+
+    def compile_program(self, body):
+        """Compile a program: a body for the global environment."""
+        operators = self.operators
+        self.operators = self.tea._native_operators(body)
+        try:
+            return self.compile_body(body)
+        finally:
+            self.operators = operators
+
+    def compile_body(self, body, scope=DYNAMIC_SCOPE):
+        """Compile a body that runs in the environment it is given."""
+        out = CodeBuilder()
+        self._emit_body(body, scope, False, out)
+        out.emit(RETURN)
+        return out.build()
+
+    def compile_import(self, module_name, module_body):
+        """Code that runs a module in the global environment and registers it."""
+        operators = self.operators
+        self.operators = self.tea._native_operators(module_body)
+        try:
+            out = CodeBuilder()
+            self._emit(["module", module_name, module_body], DYNAMIC_SCOPE, False, out)
+            out.emit(REGISTER_MODULE, out.const(module_name))
+            out.emit(RETURN)
+            return out.build()
+        finally:
+            self.operators = operators
+
+    def compile_function(self, params, body, scope=DYNAMIC_SCOPE, name="lambda"):
+        if len(set(params)) != len(params):
+            raise Exception(f"Duplicate parameter name in {params}")
+
+        exprs = body[1:] if isinstance(body, list) and body[:1] == ["begin"] else [body]
+        fn_scope = Scope([*params, *Compiler.declared_names(exprs)], scope)
+        fn_scope.locals = [UNSET] * (fn_scope.size - len(params))
+
+        out = CodeBuilder()
+        self._emit_body(body, fn_scope, True, out)
+        out.emit(RETURN)
+        return out.build(fn_scope, name)
+
+    def _emit(self, expr, scope, tail, out):
+        # VAR LOOKUP
+        if isinstance(expr, str):
+            depth, slot = scope.address(expr)
+            if slot is None:
+                out.emit(LOAD_NAME, out.address((depth, slot, expr)))
+            elif depth == 0:
+                out.emit(LOAD_LOCAL, slot)
+            else:
+                out.emit(LOAD_SLOT, out.address((depth, slot, expr)))
+
+        elif isinstance(expr, int | float):
+            out.emit(LOAD_CONST, out.const(expr))
+
+        elif isinstance(expr, list):
+            start = out.label()
+            head = expr[0]
+            if isinstance(head, str) and head in self.special_forms:
+                self.special_forms[head](expr, scope, tail, out)
+            elif isinstance(head, str) and head in self.sugar:
+                self._emit(self.sugar[head](expr), scope, tail, out)
+            else:
+                self._emit_call(expr, scope, tail, out)
+            out.positions.append((start, out.label(), expr))
+
+        else:
+            raise Exception(f"Unimplemented: {expr}")
+
+    def _emit_body(self, body, scope, tail, out):
+        if isinstance(body, list) and body and body[0] == "begin":
+            self._emit_sequence(body[1:], scope, tail, out)
+        else:
+            self._emit(body, scope, tail, out)
+
+    def _emit_sequence(self, expressions, scope, tail, out):
+        if not expressions:
+            out.emit(LOAD_CONST, out.const(None))
+        for index, expr in enumerate(expressions):
+            if index > 0:
+                out.emit(POP)
+            self._emit(expr, scope, tail and index == len(expressions) - 1, out)
+
+    def _emit_define(self, name, scope, out):
+        if scope.names is None:
+            out.emit(DEFINE_NAME, out.const(name))
+        else:
+            out.emit(DEFINE_SLOT, scope.names[name])
+
+    # Quoted text
+    def _emit_quote(self, expr, scope, tail, out):
+        [_, string] = expr
+        out.emit(LOAD_CONST, out.const(string))
+
+    # BLOCKS
+    def _emit_begin(self, expr, scope, tail, out):
+        names = Compiler.declared_names(expr[1:])
+        if not names:
+            return self._emit_sequence(expr[1:], scope, tail, out)
+
+        block_scope = Scope(names, scope)
+        out.emit(ENTER_BLOCK, out.const(block_scope))
+        self._emit_sequence(expr[1:], block_scope, tail, out)
+        out.emit(LEAVE_BLOCK)
+
+    # VAR DECLARATIONS
+    def _emit_var(self, expr, scope, tail, out):
+        [_, name, value] = expr
+        if isinstance(value, list) and value[:1] == ["lambda"]:
+            self._emit_lambda(value, scope, False, out, name)
+        else:
+            self._emit(value, scope, False, out)
+        self._emit_define(name, scope, out)
+
+    # VAR UPDATE
+    def _emit_set(self, expr, scope, tail, out):
+        [_, ref, value] = expr
+
+        # Set a property
+        if isinstance(ref, list) and ref[0] == "prop":
+            [_, instance, prop_name] = ref
+            self._emit(instance, scope, False, out)
+            self._emit(value, scope, False, out)
+            out.emit(SET_PROP, out.const(prop_name))
+            return
+
+        # Set a var
+        self._emit(value, scope, False, out)
+        depth, slot = scope.address(ref)
+        op = STORE_NAME if slot is None else STORE_SLOT
+        out.emit(op, out.address((depth, slot, ref)))
+
+    # IF EXPRESSION
+    def _emit_if(self, expr, scope, tail, out):
+        [_, condition, consequent, alternate] = expr
+        self._emit(condition, scope, False, out)
+        to_alternate = out.emit(JUMP_IF_FALSE)
+        self._emit(consequent, scope, tail, out)
+        to_end = out.emit(JUMP)
+        out.patch(to_alternate, out.label())
+        self._emit(alternate, scope, tail, out)
+        out.patch(to_end, out.label())
+
+    # WHILE LOOP
+    def _emit_while(self, expr, scope, tail, out):
+        [_, condition, block] = expr
+        out.emit(LOAD_CONST, out.const(None))  # the result without iterations
+        loop = out.label()
+        self._emit(condition, scope, False, out)
+        to_end = out.emit(JUMP_IF_FALSE)
+        out.emit(POP)
+        self._emit(block, scope, False, out)
+        out.emit(LOOP, loop)
+        out.patch(to_end, out.label())
+
+    # lambda function
+    def _emit_lambda(self, expr, scope, tail, out, name="lambda"):
+        [_, params, body] = expr
+        code = self.compile_function(params, body, scope, name)
+        out.emit(MAKE_FUNCTION, out.const(FunctionTemplate(params, body, code)))
+
+    # OOP CLASS
+    def _emit_class(self, expr, scope, tail, out):
+        [_, name, parent, body] = expr
+        self._emit(parent, scope, False, out)
+        out.emit(MAKE_CLASS)
+        out.emit(RUN_IN, out.const(self.compile_body(body)))
+        self._emit_define(name, scope, out)
+
+    def _emit_super(self, expr, scope, tail, out):
+        [_, class_name] = expr
+        self._emit(class_name, scope, False, out)
+        out.emit(SUPER)
+
+    def _emit_new(self, expr, scope, tail, out):  # [new <class name> <args> ...]
+        for sub_expr in expr[1:]:
+            self._emit(sub_expr, scope, False, out)
+        out.emit(NEW, len(expr) - 2)
+
+    # Access to a property
+    def _emit_prop(self, expr, scope, tail, out):
+        [_, instance, name] = expr
+        self._emit(instance, scope, False, out)
+        out.emit(GET_PROP, out.const(PropertyCache(name)))
+
+    # Module declaration
+    def _emit_module(self, expr, scope, tail, out):
+        [_, name, body] = expr
+        out.emit(MAKE_MODULE)
+        out.emit(RUN_IN, out.const(self.compile_body(body)))
+        self._emit_define(name, scope, out)
+
+    # Import module
+    def _emit_import(self, expr, scope, tail, out):
+        [_, module_name] = expr
+        out.emit(IMPORT, out.const(module_name))
+
+    def _memoize(self, *args):
+        return self.tea.current().memoize(*args)
+
+    # Memoized function: [memo fn size ttl] is a call of Tea.memoize, in the
+    # interpreter that runs it
+    def _emit_memo(self, expr, scope, tail, out):
+        out.emit(LOAD_CONST, out.const(self._memoize))
+        for arg in expr[1:]:
+            self._emit(arg, scope, False, out)
+        out.emit(CALL, len(expr) - 1)
+
+    # Function call
+    def _emit_call(self, expr, scope, tail, out):
+        head = expr[0]
+        if isinstance(head, str) and head in self.operators:
+            if scope.address(head)[1] is None:  # not a local variable
+                return self._emit_operator(expr, scope, out)
+
+        for sub_expr in expr:
+            self._emit(sub_expr, scope, False, out)
+        out.emit(TAIL_CALL if tail else CALL, len(expr) - 1)
+
+    def _emit_operator(self, expr, scope, out):
+        [name, *operands] = expr
+        if len(operands) == 1 and name in self.UNARY_FUNCTIONS:
+            self._emit(operands[0], scope, False, out)
+            out.emit(UNARY_OP, out.const(self.UNARY_FUNCTIONS[name]))
+        elif len(operands) == 2 or len(operands) > 2 and name in Compiler.ARITHMETIC:
+            # [- a b c] is [- [- a b] c]
+            self._emit(operands[0], scope, False, out)
+            for operand in operands[1:]:
+                self._emit(operand, scope, False, out)
+                out.emit(BINARY_OP, out.const(self.BINARY_FUNCTIONS[name]))
+        else:
+            for sub_expr in expr:
+                self._emit(sub_expr, scope, False, out)
+            out.emit(CALL, len(operands))
+
+
+class VM:
+    """
+    Run `CodeObject`s in a single dispatch loop. Calls push a heap frame
+    instead of recursing in Python, so tea recursion is only bounded by
+    memory, and tail calls replace the running frame.
+    """
+
+    def __init__(self, tea):
+        self.tea = tea
+        self.meter = tea.meter
+        self.compiler = BytecodeCompiler(tea)
+
+    def _function_code(self, fn):
+        """The bytecode of a user-defined function, compiled on first use."""
+        if fn.bytecode is None:  # created by another engine
+            fn.bytecode = self.compiler.compile_function(
+                fn.params, fn.body, name=fn.name
+            )
+        return fn.bytecode
+
+    def _enter(self, fn, args):
+        meter = self.meter
+        countdown = meter.countdown - 1
+        meter.countdown = countdown
+        if countdown < 0:
+            meter.check()
+        params = fn.params
+        if len(args) < len(params):
+            raise Exception(f"Expected {len(params)} arguments, got {len(args)}")
+
+        code = self._function_code(fn)
+        slots = [*args[: len(params)], *code.scope.locals]
+        return code, Frame(slots, code.scope.names, fn.env)
+
+    def _operate(self, function, env, *operands):
+        """Call the operator of function, rebound since its code was compiled."""
+        fn = env.lookup(BytecodeCompiler.OPERATOR_NAMES[function])
+        if type(fn) is Function:
+            return self.run(*self._enter(fn, operands))
+        return fn(*operands)
+
+    @staticmethod
+    def _notes(tb):
+        """The expressions and functions of the frames of a failed run."""
+        f_locals = tb.tb_frame.f_locals
+        code, pc = f_locals["code"], f_locals["pc"]
+        calls = [frame[:2] for frame in reversed(f_locals["frames"])]
+        if calls[:1] != [(code, pc)]:  # else the call failed to enter
+            calls.insert(0, (code, pc))
+        notes = []
+        for code, pc in calls:
+            expr = code.expr_at(pc - 2)  # pc is past the instruction
+            if expr is not None:
+                notes.append((expr, None))
+            if code.name is not None:
+                notes.append((None, code.name))
+        return notes
+
+    @reads_frames(_notes)
+    def run(self, code, env):
+        stack = []  # operands of every active frame
+        frames = []  # suspended callers: (code, pc, env, keep)
+        keep = True  # push the result of this frame when it returns?
+        ops, consts, addresses = code.ops, code.consts, code.addresses
+        pc = 0
+        meter = self.meter
+
+        while True:
+            op = ops[pc]
+            arg = ops[pc + 1]
+            pc += 2
+
+            if op == LOAD_LOCAL:
+                value = env.slots[arg]
+                if value is UNSET:  # its var has not run yet
+                    value = env.parent.lookup(slot_name(env, arg))
+                stack.append(value)
+
+            elif op == LOAD_SLOT:
+                depth, slot, name = addresses[arg]
+                scope = env
+                for _ in range(depth):
+                    scope = scope.parent
+                value = scope.slots[slot]
+                if value is UNSET:  # its var has not run yet
+                    value = scope.parent.lookup(name)
+                stack.append(value)
+
+            elif op == LOAD_CONST:
+                stack.append(consts[arg])
+
+            elif op == BINARY_OP:
+                value = stack.pop()
+                if code.epoch == operator_epoch:
+                    stack[-1] = consts[arg](stack[-1], value)
+                else:
+                    stack[-1] = self._operate(consts[arg], env, stack[-1], value)
+
+            elif op == LOAD_NAME:
+                depth, _, name = addresses[arg]
+                scope = env
+                for _ in range(depth):
+                    scope = scope.parent
+                while name not in scope.record:
+                    scope = scope.parent or undefined(name)
+                stack.append(scope.record[name])
+
+            elif op == CALL or op == TAIL_CALL:
+                args = stack[len(stack) - arg :]
+                del stack[len(stack) - arg :]
+                fn = stack.pop()
+
+                # Native Function
+                if type(fn) is not Function:
+                    stack.append(fn(*args))
+                    continue
+
+                # User-defined function
+                if op == CALL:
+                    frames.append((code, pc, env, keep))
+                    keep = True
+                code, env = self._enter(fn, args)
+                ops, consts, addresses = code.ops, code.consts, code.addresses
+                pc = 0
+
+            elif op == JUMP_IF_FALSE:
+                if not stack.pop():
+                    pc = arg
+
+            elif op == JUMP:
+                pc = arg
+
+            elif op == LOOP:
+                pc = arg
+                countdown = meter.countdown - 1
+                meter.countdown = countdown
+                if countdown < 0:
+                    meter.check()
+
+            elif op == POP:
+                stack.pop()
+
+            elif op == STORE_SLOT:
+                depth, slot, name = addresses[arg]
+                scope = env
+                for _ in range(depth):
+                    scope = scope.parent
+                if scope.slots[slot] is UNSET:
+                    scope.parent.assign(name, stack[-1])
+                else:
+                    scope.slots[slot] = stack[-1]
+
+            elif op == STORE_NAME:
+                depth, _, name = addresses[arg]
+                scope = env
+                for _ in range(depth):
+                    scope = scope.parent
+                while name not in scope.record:
+                    scope = scope.parent or undefined(name)
+                scope.record[name] = stack[-1]
+                if name in OPERATOR_NAMES:
+                    rebind_operator()
+
+            elif op == DEFINE_SLOT:
+                env.slots[arg] = stack[-1]
+
+            elif op == DEFINE_NAME:
+                env.define(consts[arg], stack[-1])
+
+            elif op == RETURN:
+                if not frames:
+                    return stack.pop()
+                value = stack.pop()
+                code, pc, env, keep_value = frames.pop()
+                if keep:
+                    stack.append(value)
+                keep = keep_value
+                ops, consts, addresses = code.ops, code.consts, code.addresses
+
+            elif op == ENTER_BLOCK:
+                block_scope = consts[arg]
+                env = Frame([UNSET] * block_scope.size, block_scope.names, env)
+
+            elif op == LEAVE_BLOCK:
+                env = env.parent
+
+            elif op == MAKE_FUNCTION:
+                template = consts[arg]
+                code_name = template.code.name
+                fn = Function(template.params, template.body, env, code_name)
+                fn.bytecode = template.code
+                stack.append(fn)
+
+            elif op == GET_PROP:
+                stack.append(consts[arg].lookup(stack.pop()))
+
+            elif op == SET_PROP:
+                value = stack.pop()
+                stack.append(stack.pop().define(consts[arg], value))
+
+            elif op == MAKE_CLASS:
+                stack.append(Class({}, stack.pop() or env))
+
+            elif op == MAKE_MODULE:
+                stack.append(Environment({}, env))
+
+            elif op == RUN_IN:  # the environment stays on the stack
+                frames.append((code, pc, env, keep))
+                keep = False
+                code, env = consts[arg], stack[-1]
+                ops, consts, addresses = code.ops, code.consts, code.addresses
+                pc = 0
+
+            elif op == SUPER:
+                stack.append(stack.pop().parent)
+
+            elif op == NEW:
+                args = stack[len(stack) - arg :]
+                del stack[len(stack) - arg :]
+                class_env = stack.pop()
+                instance_env = Instance(class_env)
+                stack.append(instance_env)
+
+                # The constructor's result is dropped: the instance stays
+                frames.append((code, pc, env, keep))
+                keep = False
+                constructor = class_env.lookup("constructor")
+                code, env = self._enter(constructor, [instance_env, *args])
+                ops, consts, addresses = code.ops, code.consts, code.addresses
+                pc = 0
+
+            elif op == IMPORT:
+                module_name = consts[arg]
+                module_env = self.tea._imported(module_name)
+                if module_env is not None:
+                    stack.append(module_env)
+                    continue
+
+                module_body = self.tea._read_module(module_name)
+                frames.append((code, pc, env, keep))
+                keep = True
+                code = self.compiler.compile_import(module_name, module_body)
+                env = self.tea.global_env
+                ops, consts, addresses = code.ops, code.consts, code.addresses
+                pc = 0
+
+            elif op == REGISTER_MODULE:
+                self.tea.modules[consts[arg]] = stack[-1]
+
+            elif op == UNARY_OP:
+                if code.epoch == operator_epoch:
+                    stack[-1] = consts[arg](stack[-1])
+                else:
+                    stack[-1] = self._operate(consts[arg], env, stack[-1])
+
+            else:
+                raise Exception(f"Unknown opcode: {op}")
+
+
+class ModuleCache:
+    """
+    On-disk cache of parsed modules, like __pycache__: `modules/x.tea` is
+    stored as `modules/__teacache__/x.teac`. A cache file starts with the
+    size, mtime and SHA-256 of its source and is rebuilt when they change.
+
+    The parsed lists are stored in a small tagged binary format: a table
+    of the distinct symbols followed by the tree, with varint lengths.
+    """
+
+    MAGIC = b"TEAC"
+    VERSION = 1
+    HEADER = struct.Struct("<4sBqq32s")  # magic, version, mtime, size, hash
+    DIRECTORY = "__teacache__"
+    LIST, SYMBOL, INTEGER, NEGATIVE, FLOAT = range(5)
+
+    @classmethod
+    def path_for(cls, source_path, flavor=None):
+        directory, file = os.path.split(source_path)
+        name = os.path.splitext(file)[0]
+        if flavor is not None:  # parsed by another parser backend
+            name = f"{name}.{flavor}"
+        return os.path.join(directory, cls.DIRECTORY, f"{name}.teac")
+
+    @classmethod
+    def load(cls, source_path, parse, flavor=None):
+        """Return the parsed code of source_path, from the cache if it is valid."""
+        stat = os.stat(source_path)
+        cache_path = cls.path_for(source_path, flavor)
+
+        try:
+            with open(cache_path, mode="rb") as f:
+                data = f.read()
+            magic, version, mtime, size, digest = cls.HEADER.unpack_from(data)
+        except (OSError, struct.error):
+            data = None
+        else:
+            if magic != cls.MAGIC or version != cls.VERSION:
+                data = None
+            elif mtime == stat.st_mtime_ns and size == stat.st_size:
+                return cls.decode(data, cls.HEADER.size)
+
+        with open(source_path, mode="rb") as f:
+            source = f.read()
+        source_digest = hashlib.sha256(source).digest()
+
+        # Touched but unchanged: keep the tree, refresh the header
+        if data is not None and digest == source_digest:
+            expr = cls.decode(data, cls.HEADER.size)
+        else:
+            expr = parse(source.decode("utf-8"))
+
+        header = cls.HEADER.pack(
+            cls.MAGIC, cls.VERSION, stat.st_mtime_ns, stat.st_size, source_digest
+        )
+        cls._write(cache_path, header + cls.encode(expr))
+        return expr
+
+    @staticmethod
+    def _write(cache_path, data):
+        try:
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            temp_path = f"{cache_path}.{os.getpid()}.tmp"
+            with open(temp_path, mode="wb") as f:
+                f.write(data)
+            os.replace(temp_path, cache_path)
+        except OSError:
+            pass  # a read-only modules folder just runs uncached
+
+    @classmethod
+    def encode(cls, expr):
+        symbols = {}
+        tree = bytearray()
+
+        def write(expr):
+            if isinstance(expr, list):
+                tree.append(cls.LIST)
+                cls._write_varint(tree, len(expr))
+                for item in expr:
+                    write(item)
+            elif isinstance(expr, str):
+                tree.append(cls.SYMBOL)
+                cls._write_varint(tree, symbols.setdefault(expr, len(symbols)))
+            elif isinstance(expr, int):
+                tree.append(cls.INTEGER if expr >= 0 else cls.NEGATIVE)
+                cls._write_varint(tree, abs(expr))
+            elif isinstance(expr, float):
+                tree.append(cls.FLOAT)
+                tree.extend(struct.pack("<d", expr))
+            else:
+                raise TypeError(f"Cannot cache {expr!r}")
+
+        write(expr)
+
+        table = bytearray()
+        cls._write_varint(table, len(symbols))
+        for symbol in symbols:
+            encoded = symbol.encode("utf-8")
+            cls._write_varint(table, len(encoded))
+            table += encoded
+        return bytes(table + tree)
+
+    @classmethod
+    def decode(cls, data, offset=0):
+        count, offset = cls._read_varint(data, offset)
+        symbols = []
+        for _ in range(count):
+            length, offset = cls._read_varint(data, offset)
+            symbols.append(data[offset : offset + length].decode("utf-8"))
+            offset += length
+
+        def read(offset):
+            tag = data[offset]
+            offset += 1
+            if tag == cls.FLOAT:
+                return struct.unpack_from("<d", data, offset)[0], offset + 8
+            value, offset = cls._read_varint(data, offset)
+            if tag == cls.SYMBOL:
+                return symbols[value], offset
+            if tag == cls.INTEGER:
+                return value, offset
+            if tag == cls.NEGATIVE:
+                return -value, offset
+            items = []
+            for _ in range(value):
+                item, offset = read(offset)
+                items.append(item)
+            return items, offset
+
+        return read(offset)[0]
+
+    @staticmethod
+    def _write_varint(buffer, value):
+        while value > 0x7F:
+            buffer.append(value & 0x7F | 0x80)
+            value >>= 7
+        buffer.append(value)
+
+    @staticmethod
+    def _read_varint(data, offset):
+        value = shift = 0
+        while True:
+            byte = data[offset]
+            offset += 1
+            value |= (byte & 0x7F) << shift
+            if byte < 0x80:
+                return value, offset
+            shift += 7
+
+
+def lark_parser():
+    """The parser of the lark grammar in utils (needs the lark package)."""
+    if __package__:
+        from .utils import parser
+    else:  # tea.py runs as a script
+        from utils import parser
+    return parser
+
+
+def vector_module(tea):
+    """
+    The natives of `[import vector]`: vectors are NumPy arrays (needs the
+    numpy package). The builtin operators work on them elementwise, with
+    broadcasting, so `[* v 2]` or `[+ v w]` is a single NumPy operation.
+    """
+    try:
+        import numpy
+    except ImportError:
+        raise Exception("The vector module needs NumPy: pip install numpy")
+
+    def scalar(value):
+        """Give tea plain Python numbers instead of NumPy scalars."""
+        return value.item() if numpy.ndim(value) == 0 else value
+
+    def at(vector, *indexes):
+        return scalar(vector[indexes])
 
-    @classmethod
-    def atomizer(cls, token):
-        """Numbers become numbers; every other token is a symbol."""
+    def slice_(vector, start, stop=None, step=None):
+        return vector[start:stop:step]
+
+    def numeric(fn):
+        """
+        Whether a tea function is pure arithmetic, as the specializer sees
+        it: its body translates to a kernel that sets nothing outside, and
+        the operators it runs are still the builtins where it was made.
+        """
+        translation = Translation(tea.compiler, fn.scope or DYNAMIC_SCOPE, fn.params)
         try:
-            return int(token)
-        except ValueError:
+            translation.source(fn.body)
+        except (Untranslatable, RecursionError):
+            return False
+        if translation.assigned:
+            return False
+        operators = tea.compiler.operators
+        exprs = [fn.body]
+        while exprs:
+            expr = exprs.pop()
+            if isinstance(expr, list) and expr:
+                head = expr[0]
+                if isinstance(head, str) and head in Translation.OPERATORS:
+                    if fn.env.lookup(head) is not operators[head]:
+                        return False
+                exprs.extend(expr[1:])
+        return True
+
+    def map_(fn, vector):
+        """
+        Apply fn to every element of vector. A tea function that is pure
+        arithmetic runs once, on the whole vector (arithmetic broadcasts),
+        unless its body cannot (it branches on its argument); any other
+        runs once per element, so its effects happen once per element.
+        """
+        if type(fn) is not Function:
+            return numpy.asarray(fn(vector))
+        if numeric(fn):
             try:
-                return float(token)
-            except ValueError:
-                return str(token)
+                result = tea._apply(fn, [vector])
+                if numpy.shape(result) == numpy.shape(vector):
+                    return numpy.asarray(result)
+            except (ValueError, TypeError):  # e.g. the truth of a vector
+                pass
+        return numpy.array([tea._apply(fn, [value]) for value in vector.tolist()])
 
-    @classmethod
-    def to_list(cls, tokens):
-        """Convert a list of tokens into a "list" data structure"""
+    return {
+        # Constructors
+        "of": lambda *values: numpy.array(values),
+        "array": numpy.array,
+        "zeros": numpy.zeros,
+        "ones": numpy.ones,
+        "range": numpy.arange,
+        "linspace": numpy.linspace,
+        # Access
+        "length": len,
+        "at": at,
+        "slice": slice_,
+        # Reductions
+        "sum": lambda vector: scalar(numpy.sum(vector)),
+        "min": lambda vector: scalar(numpy.min(vector)),
+        "max": lambda vector: scalar(numpy.max(vector)),
+        "dot": lambda a, b: scalar(numpy.dot(a, b)),
+        # Elementwise functions
+        "map": map_,
+        "square": numpy.square,
+        "abs": numpy.abs,
+        "sqrt": numpy.sqrt,
+        "exp": numpy.exp,
+        "log": numpy.log,
+        "sin": numpy.sin,
+        "cos": numpy.cos,
+    }
 
-        if len(tokens) == 0:
-            raise SyntaxError("Unexpected EOF")
 
-        token = tokens.pop(0)
-        if '[' == token:
-            _list = []
-            while tokens[0] != ']':
-                # Recursive deep down
-                _list.append(cls.to_list(tokens))
-            tokens.pop(0)  # pop off ']'
-            return _list
-        elif ']' == token:
-            raise SyntaxError('Unexpected token "]"')
+def free_names(params, body):
+    """
+    The names a lambda body reads from the environment it closes over, and
+    those it assigns there. A name the body declares only counts as its own
+    from the declaration on: before that, it is the outer one.
+    """
+    reads, assigns = set(), set()
 
-        return cls.atomizer(token)
+    def walk(expr, bound):
+        if isinstance(expr, str):
+            if expr not in bound:
+                reads.add(expr)
+            return
+        if not isinstance(expr, list) or not expr or expr[0] == "quote":
+            return
+        head, args = expr[0], expr[1:] or [None]
+        if head == "prop":  # the name of a property is not a variable
+            args = args[:1]
+        elif head in ("lambda", "def", "defmemo"):
+            if head != "lambda" and isinstance(args[0], str):
+                bound.add(args[0])  # so the function can call itself
+            start = SourceMap.BODY_INDEXES[head]
+            inner = bound | {param for param in expr[start - 1] if type(param) is str}
+            for statement in expr[start:]:
+                walk(statement, inner)
+            return
+        elif head in ("var", "class", "module") and isinstance(args[0], str):
+            for arg in args[1:]:
+                walk(arg, bound)
+            bound.add(args[0])
+            return
+        elif head in ("set", "++", "--", "+=", "-=") and isinstance(args[0], str):
+            if args[0] not in bound:
+                assigns.add(args[0])
+        elif head == "begin":
+            bound = set(bound)  # the declarations of a block end with it
+        walk(head, bound)
+        for arg in args:
+            walk(arg, bound)
 
-    @classmethod
-    def parse(cls, code):
-        """Parse a code expression."""
-        return cls.to_list(cls.tokenize(code))
+    walk(body, set(params))
+    return reads | assigns, assigns
 
 
-class Transformer:
-    @staticmethod
-    def transform_def_to_var_lambda(def_expr):
-        name = def_expr[1]
-        params = def_expr[2]
-        body = def_expr[3]
-        return ["var", name, ["lambda", params, body]]
+class Reference:
+    """A function or module captured by a shipped function."""
 
-    @staticmethod
-    def transform_switch_to_if(switch_expr):
-        cases = switch_expr[1:]
+    __slots__ = ("kind", "key")
 
-        if_expr = ["if", None, None, None]
-        current = if_expr
+    def __init__(self, kind, key):
+        self.kind = kind  # "function" (key is its index) or "module" (its name)
+        self.key = key
 
-        for index, case in enumerate(cases, start=1):
-            [_cond, _block] = cases[index - 1]  # else case
-            current[1] = _cond
-            current[2] = _block
-            [next_cond, next_block] = case
 
-            if next_cond == "else":
-                current[3] = next_block
+def ship(fn):
+    """
+    Pickle a tea function for another process: the params and body of every
+    function it reaches, with the values they capture. Builtins are left
+    out, since every interpreter has them, and modules go by name.
+    """
+    records = []  # (name, params, body, captures) of each function
+    indexes = {}  # id(function) -> its index in records
+    modules = {
+        id(module_env): name
+        for modules in loaded_modules.values()
+        for name, module_env in modules.items()
+    }
+
+    def reference(fn):
+        if id(fn) not in indexes:
+            indexes[id(fn)] = len(records)
+            records.append(None)
+            captures = {}
+            record = (fn.name, fn.params, fn.body, captures)
+            records[indexes[id(fn)]] = record
+            names, assigns = free_names(fn.params, fn.body)
+            for name in names:
+                env = fn.env
+                while env is not None and name not in env.record:
+                    env = env.parent
+                if env is None:  # a local of the body
+                    continue
+                if name in assigns:
+                    raise Exception(
+                        f"Cannot send {fn.name} to another process: "
+                        f"it assigns {name}, a variable it captures"
+                    )
+                value = env.record[name]
+                if BUILTINS.get(name, UNSET) is not value:
+                    captures[name] = encode(fn, name, value)
+        return Reference("function", indexes[id(fn)])
+
+    def encode(fn, name, value):
+        if type(value) is Function:
+            return reference(value)
+        if id(value) in modules:
+            return Reference("module", modules[id(value)])
+        if type(value) in (int, float, str, bool, type(None)):
+            return value
+        if isinstance(value, Environment):
+            kind = {Instance: "a class instance", Class: "a class"}
+            what = kind.get(type(value), "an environment")
+        else:
+            try:
+                pickle.dumps(value)
+                return value
+            except Exception:
+                what = f"a {type(value).__name__} that cannot be pickled"
+        raise Exception(
+            f"Cannot send {fn.name} to another process: it captures {name}, {what}"
+        )
+
+    reference(fn)
+    return pickle.dumps(records)
+
+
+def unship(data, tea):
+    """Rebuild a shipped function in the global environment of tea."""
+    records = pickle.loads(data)
+    functions = [
+        Function(params, body, None, name) for name, params, body, _ in records
+    ]
+    for fn, (_, _, _, captures) in zip(functions, records):
+        for name, value in captures.items():
+            if type(value) is not Reference:
+                continue
+            if value.kind == "function":
+                captures[name] = functions[value.key]
             else:
-                current[3] = ["if", None, None, None]
+                captures[name] = tea.eval(["import", value.key])
+        fn.env = Environment(captures, tea.global_env)
+    return functions[0]
 
-            current = current[3]
 
-        return if_expr
+# The interpreter of a worker process, and the function it last received
+worker = None
+worker_function = (None, None)
 
-    @staticmethod
-    def transform_for_to_while(for_expr):
-        [_, init, cond, modifier, body] = for_expr
-        return ["begin", init, ["while", cond, ["begin", body, modifier]]]
 
-    @staticmethod  # [set foo [+ foo 1]]
-    def transform_incr_to_set(inc_expr):
-        [_, expr] = inc_expr
-        return ["set", expr, ["+", expr, 1]]
+def start_worker(engine, optimize, modules, path=None):
+    """Start the interpreter of a worker process, with modules imported."""
+    global worker
+    worker = Tea(engine=engine, optimize=optimize, path=path)
+    for name in modules:
+        worker.eval(["import", name])
 
-    @staticmethod  # [set foo [- foo 1]]
-    def transform_decr_to_set(dec_expr):
-        [_, expr] = dec_expr
-        return ["set", expr, ["-", expr, 1]]
 
-    @staticmethod  # [set foo [+ foo value]]
-    def transform_incr_val_to_set(inc_expr):
-        [_, expr, value] = inc_expr
-        return ["set", expr, ["+", expr, value]]
+def run_chunk(data, chunk):
+    """Apply a shipped function to a chunk of inputs, in a worker process."""
+    global worker_function
+    if worker_function[0] != data:
+        worker_function = data, unship(data, worker)
+    fn = worker_function[1]
+    return [worker._apply(fn, [value]) for value in chunk]
 
-    @staticmethod  # [set foo [- foo value]]
-    def transform_decr_val_to_set(dec_expr):
-        [_, expr, value] = dec_expr
-        return ["set", expr, ["-", expr, value]]
 
+def parallel_module(tea):
+    """
+    [[prop parallel map] fn inputs] and [[prop parallel for] start end fn]
+    apply a tea function in worker processes (see Tea.pmap). Both take an
+    optional chunk size last.
+    """
+    return {
+        "map": tea.pmap,
+        "for": lambda start, end, fn, chunk=None: tea.pmap(
+            fn, range(start, end), chunk
+        ),
+        "workers": tea.workers,
+    }
 
-class Environment:
-    def __init__(
-        self,
-        record,
-        parent=None,
-    ):
-        if record is None:
-            record = {}
-        self.record = record
-        self.parent = parent
 
-    # Define a new variable
-    def define(self, name, value):
-        self.record[name] = value
-        return value
+# Modules written in Python, by name: each makes the natives of the module
+NATIVE_MODULES = {"vector": vector_module, "parallel": parallel_module}
 
-    # Assign a new variable
-    def assign(self, name, value):
-        self.resolve(name).record[name] = value
+
+# Modules already imported, per global environment
+loaded_modules = weakref.WeakKeyDictionary()
+
+
+def module_path():
+    """
+    The directories to search for modules: those listed in the TEA_PATH
+    environment variable, then the modules folder of tea.
+    """
+    directories = os.environ.get("TEA_PATH", "").split(os.pathsep)
+    modules = os.path.join(os.path.dirname(os.path.abspath(__file__)), "modules")
+    return [*filter(None, directories), modules]
+
+
+class ModuleRegistry:
+    """
+    The modules of the process, shared by every interpreter: the file each
+    module name was found in, and its parsed code, so a module is read and
+    parsed once however many global environments import it. The code is
+    read again when its file changes.
+
+    [import a.b] finds a/b.tea, or the package directory a/b/ with an
+    __init__.tea, in the first directory of the search path that has one.
+    """
+
+    PACKAGE = f"__init__.{FILE_EXTENSION}"
+
+    def __init__(self):
+        self.files = {}  # (name, search path) -> file
+        self.bodies = {}  # (file, parser flavor) -> (mtime, size, parsed code)
+
+    def find(self, name, path):
+        key = (name, tuple(path))
+        file = self.files.get(key)
+        if file is not None and os.path.isfile(file):
+            return file
+        relative = os.path.join(*name.split("."))
+        for directory in path:
+            for candidate in (
+                f"{relative}.{FILE_EXTENSION}",
+                os.path.join(relative, self.PACKAGE),
+            ):
+                file = os.path.join(directory, candidate)
+                if os.path.isfile(file):
+                    self.files[key] = file
+                    return file
+        raise Exception(f"Module not found: {name} (in {os.pathsep.join(path)})")
+
+    def load(self, name, path, parser, flavor=None):
+        """The parsed code of module name, found on path."""
+        file = self.find(name, path)
+        stat = os.stat(file)
+        entry = self.bodies.get((file, flavor))
+        if entry is not None and entry[:2] == (stat.st_mtime_ns, stat.st_size):
+            return entry[2]
+        body = ModuleCache.load(
+            file, lambda source: parser.parse(f"[begin {source}]"), flavor
+        )
+        self.bodies[(file, flavor)] = (stat.st_mtime_ns, stat.st_size, body)
+        return body
+
+    def clear(self):
+        self.files.clear()
+        self.bodies.clear()
+
+
+module_registry = ModuleRegistry()
+
+
+class Pending:
+    """A top-level function of a lazy module, not made yet."""
+
+    __slots__ = ("params", "body")
+
+    def __init__(self, params, body):
+        self.params = params
+        self.body = body
+
+
+class LazyRecord(dict):
+    """
+    The record of a lazy module. Its functions are Pending until they are
+    first read (through prop, or by the module's own code), which optimizes
+    their body and makes them; the body is compiled on their first call,
+    like any function made by another engine. Once all are made, the
+    module environment gets a plain dict back.
+    """
+
+    __slots__ = ("env", "optimize", "pending")
+
+    def __init__(self, env, optimize):
+        self.env = env
+        self.optimize = optimize  # of a lambda expression, if optimizing
+        self.pending = set()  # the names of the functions not made yet
+
+    def __getitem__(self, name):
+        value = dict.__getitem__(self, name)
+        if type(value) is Pending:
+            params, body = value.params, value.body
+            if self.optimize is not None:
+                [_, params, body] = self.optimize(["lambda", params, body])
+            value = Function(params, body, self.env, name)
+            dict.__setitem__(self, name, value)
+            self.pending.discard(name)
+            if not self.pending:
+                self.env.record = dict(self)
         return value
 
-    # Get the value of a variable
-    def lookup(self, name):
-        return self.resolve(name).record[name]
 
-    # Get the environment in which a variable is defined
-    def resolve(self, name):
-        if name in self.record.keys():
-            return self
-        if self.parent is None:  # parent == None means we are in the global_env
-            raise Exception(f"Variable not defined: {name}")
-        return self.parent.resolve(name)
+class Snapshot:
+    """
+    A file with the state of a global environment, to start an interpreter
+    warm: what programs defined (functions with the environments they
+    capture, classes, instances, modules), and the modules imported.
+    Builtins and the natives of native modules are stored by name, and
+    found by name again. Other Python values are pickled. Memos start with
+    an empty cache, and functions are compiled again on their first call.
 
+    The file is a header, a table of the distinct symbols, the definitions
+    of the global environment, the objects, and the offset of each object
+    at fixed width at the end. Values refer to objects (environments,
+    functions, code) by index, so the file is read in place with mmap, and
+    each object can be found without reading the ones before it.
+    """
 
-global_environment = Environment(
-    {
-        "null": None,
-        "true": True,
-        "false": False,
-        "VERSION": VERSION_INFO,
-        "+": lambda *args: operator.pos(args[0])
-        if len(args) == 1
-        else operator.add(args[0], args[1]),
-        "*": operator.mul,
-        "-": lambda *args: operator.neg(args[0])
-        if len(args) == 1
-        else operator.sub(args[0], args[1]),
-        "/": operator.truediv,
-        "//": operator.floordiv,
-        "%": operator.mod,
-        ">": operator.gt,
-        "<": operator.lt,
-        ">=": operator.ge,
-        "<=": operator.le,
-        "=": operator.eq,
-        "eof": lambda arg: arg is EOF,
+    MAGIC = b"TEAS"
+    VERSION = 1
+    HEADER = struct.Struct("<4sBQQ")  # magic, version, objects, offsets
+    # Values
+    NULL, TRUE, FALSE, INTEGER, NEGATIVE, FLOAT, SYMBOL, LIST = range(8)
+    VECTOR, MAP, EMPTY, GLOBAL, BUILTIN, MODULE, NATIVE, OBJECT, PICKLED = range(8, 17)
+    # Objects
+    ENVIRONMENT, FRAME, CLASS, INSTANCE, FUNCTION, MEMO, CODE = range(7)
+    KINDS = {
+        Environment: ENVIRONMENT,
+        Activation: ENVIRONMENT,
+        Frame: FRAME,
+        Class: CLASS,
+        Instance: INSTANCE,
+        Function: FUNCTION,
+        Memo: MEMO,
     }
-)
+
+    @classmethod
+    def save(cls, path, tea):
+        data = cls.encode(tea)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, mode="wb") as f:
+            f.write(data)
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path, tea):
+        with open(path, mode="rb") as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                cls.decode(data, tea)
+
+    @classmethod
+    def encode(cls, tea):
+        write_varint = ModuleCache._write_varint
+        global_env = tea.global_env
+        symbols = {}
+        objects = []  # the encoded objects, by index
+        indexes = {}  # id(object) -> index
+        pending = []  # (index, object, kind) of objects not encoded yet
+        builtins = {id(value): name for name, value in BUILTINS.items()}
+        modules = {}  # id(native module) -> its name
+        natives = {}  # id(native) -> (module name, key)
+        for name, module_env in tea.modules.items():
+            if name in NATIVE_MODULES:
+                modules[id(module_env)] = name
+                for key, value in module_env.record.items():
+                    natives[id(value)] = (name, key)
+
+        def symbol(buffer, name):
+            write_varint(buffer, symbols.setdefault(name, len(symbols)))
+
+        def entries(buffer, record):
+            keys = list(record.keys())
+            write_varint(buffer, len(keys))
+            for name in keys:
+                symbol(buffer, name)
+                write(buffer, record[name])
+
+        def reference(buffer, obj, kind):
+            index = indexes.get(id(obj))
+            if index is None:
+                index = indexes[id(obj)] = len(objects)
+                objects.append(None)
+                pending.append((index, obj, kind))
+            buffer.append(cls.OBJECT)
+            write_varint(buffer, index)
+
+        def write(buffer, value):
+            kind = type(value)
+            if value is None or kind is bool:
+                buffer.append(cls.NULL if value is None else 2 - value)  # TRUE, FALSE
+            elif kind is int:
+                buffer.append(cls.INTEGER if value >= 0 else cls.NEGATIVE)
+                write_varint(buffer, abs(value))
+            elif kind is float:
+                buffer.append(cls.FLOAT)
+                buffer += struct.pack("<d", value)
+            elif kind is str:
+                buffer.append(cls.SYMBOL)
+                symbol(buffer, value)
+            elif kind is list or kind is PersistentVector:
+                buffer.append(cls.LIST if kind is list else cls.VECTOR)
+                write_varint(buffer, len(value))
+                for item in value:
+                    write(buffer, item)
+            elif kind is PersistentMap:
+                buffer.append(cls.MAP)
+                write_varint(buffer, len(value))
+                for key, item in value.items():
+                    write(buffer, key)
+                    write(buffer, item)
+            elif value is UNSET:
+                buffer.append(cls.EMPTY)
+            elif value is global_env:
+                buffer.append(cls.GLOBAL)
+            elif kind in cls.KINDS:
+                reference(buffer, value, cls.KINDS[kind])
+            elif BUILTINS.get(builtins.get(id(value)), UNSET) is value:
+                buffer.append(cls.BUILTIN)
+                symbol(buffer, builtins[id(value)])
+            elif id(value) in modules:
+                buffer.append(cls.MODULE)
+                symbol(buffer, modules[id(value)])
+            elif id(value) in natives:
+                buffer.append(cls.NATIVE)
+                for name in natives[id(value)]:
+                    symbol(buffer, name)
+            else:
+                try:
+                    data = pickle.dumps(value)
+                except Exception:
+                    raise Exception(
+                        f"Cannot snapshot {value!r}, a {kind.__name__} that cannot "
+                        "be pickled"
+                    )
+                buffer.append(cls.PICKLED)
+                write_varint(buffer, len(data))
+                buffer += data
+
+        def encode_object(obj, kind):
+            buffer = bytearray([kind])
+            if kind == cls.CODE:
+                write(buffer, obj)
+            elif kind == cls.FUNCTION:
+                symbol(buffer, obj.name)
+                write(buffer, obj.params)
+                reference(buffer, obj.body, cls.CODE)
+                write(buffer, obj.env)
+            elif kind == cls.MEMO:
+                for value in (obj.fn, obj.size, obj.ttl):
+                    write(buffer, value)
+            elif kind == cls.FRAME:
+                write(buffer, obj.parent)
+                write_varint(buffer, len(obj.names))
+                for name, slot in obj.names.items():
+                    symbol(buffer, name)
+                    write_varint(buffer, slot)
+                write(buffer, obj.slots)
+            else:  # an environment, class or instance, by its record
+                write(buffer, obj.parent)
+                entries(buffer, obj.record)
+            return buffer
+
+        root = bytearray()
+        entries(
+            root,
+            {
+                name: value
+                for name, value in global_env.record.items()
+                if BUILTINS.get(name, UNSET) is not value
+            },
+        )
+        entries(root, tea.modules)
+        while pending:
+            index, obj, kind = pending.pop()
+            objects[index] = encode_object(obj, kind)
+
+        table = bytearray()
+        write_varint(table, len(symbols))
+        for name in symbols:
+            encoded = name.encode("utf-8")
+            write_varint(table, len(encoded))
+            table += encoded
+
+        offsets = []
+        position = cls.HEADER.size + len(table) + len(root)
+        for obj in objects:
+            offsets.append(position)
+            position += len(obj)
+        header = cls.HEADER.pack(cls.MAGIC, cls.VERSION, len(objects), position)
+        index = struct.pack(f"<{len(offsets)}Q", *offsets)
+        return b"".join([header, table, root, *objects, index])
+
+    @classmethod
+    def decode(cls, data, tea):
+        """Load the state of a snapshot into the global environment of tea."""
+        read_varint = ModuleCache._read_varint
+        try:
+            magic, version, count, at = cls.HEADER.unpack_from(data)
+        except struct.error:
+            magic = version = None
+        if magic != cls.MAGIC or version != cls.VERSION:
+            raise Exception(f"Not a tea snapshot of version {cls.VERSION}")
+
+        symbols = []
+        size, offset = read_varint(data, cls.HEADER.size)
+        for _ in range(size):
+            length, offset = read_varint(data, offset)
+            symbols.append(data[offset : offset + length].decode("utf-8"))
+            offset += length
+        root = offset
+        offsets = struct.unpack_from(f"<{count}Q", data, at)
+
+        def read(offset):
+            tag = data[offset]
+            if tag <= cls.FALSE:
+                return (None, True, False)[tag], offset + 1
+            if tag == cls.FLOAT:
+                return struct.unpack_from("<d", data, offset + 1)[0], offset + 9
+            if tag == cls.EMPTY:
+                return UNSET, offset + 1
+            if tag == cls.GLOBAL:
+                return tea.global_env, offset + 1
+            value = data[offset + 1]
+            if value < 0x80:  # most varints are a single byte
+                offset += 2
+            else:
+                value, offset = read_varint(data, offset + 1)
+            if tag == cls.SYMBOL:
+                return symbols[value], offset
+            if tag == cls.INTEGER:
+                return value, offset
+            if tag == cls.OBJECT:
+                return objects[value], offset
+            if tag == cls.NEGATIVE:
+                return -value, offset
+            if tag == cls.BUILTIN:
+                return BUILTINS[symbols[value]], offset
+            if tag == cls.MODULE:
+                return tea._imported(symbols[value]), offset
+            if tag == cls.NATIVE:
+                key, offset = read_varint(data, offset)
+                module_env = tea._imported(symbols[value])
+                return module_env.record[symbols[key]], offset
+            if tag == cls.PICKLED:
+                return pickle.loads(data[offset : offset + value]), offset + value
+            items = []
+            for _ in range(value if tag != cls.MAP else 2 * value):
+                item, offset = read(offset)
+                items.append(item)
+            if tag == cls.VECTOR:
+                return PersistentVector.of(items), offset
+            if tag == cls.MAP:
+                return PersistentMap.of(zip(items[::2], items[1::2])), offset
+            return items, offset
+
+        def entries(offset):
+            record = {}
+            size, offset = read_varint(data, offset)
+            for _ in range(size):
+                name, offset = read_varint(data, offset)
+                record[symbols[name]], offset = read(offset)
+            return record, offset
+
+        # Make every object first, so that they can refer to each other
+        shells = {
+            cls.ENVIRONMENT: lambda: Environment({}),
+            cls.FRAME: lambda: Frame([], {}),
+            cls.CLASS: lambda: Class({}),
+            cls.INSTANCE: lambda: Instance.__new__(Instance),
+            cls.FUNCTION: lambda: Function(None, None, None),
+            cls.MEMO: lambda: Memo.__new__(Memo),
+        }
+        objects = []
+        for offset in offsets:
+            kind = data[offset]
+            if kind == cls.CODE:
+                objects.append(read(offset + 1)[0])
+            else:
+                objects.append(shells[kind]())
+
+        # Then fill them in, instances last: their shape comes from the
+        # constructor of their class
+        instances = []
+        for obj, offset in zip(objects, offsets):
+            kind = data[offset]
+            offset += 1
+            if kind == cls.FUNCTION:
+                name, offset = read_varint(data, offset)
+                obj.name = symbols[name]
+                obj.params, offset = read(offset)
+                obj.body, offset = read(offset)
+                obj.env, offset = read(offset)
+            elif kind == cls.MEMO:
+                fn, offset = read(offset)
+                size, offset = read(offset)
+                ttl, offset = read(offset)
+                obj.__init__(fn, tea, size, ttl)
+            elif kind == cls.FRAME:
+                obj.parent, offset = read(offset)
+                size, offset = read_varint(data, offset)
+                for _ in range(size):
+                    name, offset = read_varint(data, offset)
+                    obj.names[symbols[name]], offset = read_varint(data, offset)
+                obj.slots, offset = read(offset)
+            elif kind == cls.INSTANCE:
+                instances.append((obj, offset))
+            elif kind != cls.CODE:
+                obj.parent, offset = read(offset)
+                record, offset = entries(offset)
+                obj.record.update(record)
+        for obj, offset in instances:
+            class_env, offset = read(offset)
+            obj.__init__(class_env)
+            for name, value in entries(offset)[0].items():
+                obj.define(name, value)
+
+        definitions, offset = entries(root)
+        modules = entries(offset)[0]
+        tea.global_env.record.update(definitions)
+        if not OPERATOR_NAMES.isdisjoint(definitions):
+            rebind_operator()
+        tea.modules.update(modules)
 
 
 class Tea:
     # GLOBAL ENVIRONMENT
-    def __init__(self, global_env=global_environment):
+    def __init__(
+        self,
+        global_env=global_environment,
+        engine="closure",
+        parser="builtin",
+        optimize=True,
+        profile=False,
+        workers=None,
+        limits=None,
+        path=None,
+        lazy_modules=False,
+        specialize=False,
+    ):
         self.global_env = global_env
         self.transformer = Transformer()
+        self.sources = SourceMap()  # of the programs read by execute and repl
+        self.optimizer = Optimizer(global_env, self.sources)
+        self.optimizing = optimize
+        if engine not in ENGINES:
+            raise ValueError(f"Unknown engine: {engine}")
+        if parser not in PARSERS:
+            raise ValueError(f"Unknown parser: {parser}")
+        if profile and engine not in ("closure", "tree"):
+            raise ValueError(f"The {engine} engine cannot profile")
+        if specialize and engine != "closure":
+            raise ValueError(f"The {engine} engine cannot specialize")
+
+        # Profiling swaps in timed versions of the calls, so it costs
+        # nothing when it is off
+        self.profiler = Profiler() if profile else None
+        if profile:
+            self._apply = self._profiled_apply
+            self._eval = self._profiled_eval
+            self._user_defined_function = self._profiled_user_defined_function
+        self.engine = engine
+        self.parser_name = parser
+        self.parser = Parser if parser == "builtin" else lark_parser()
+        self.limits = limits  # of every evaluation, unless it has its own
+        self.meter = Meter()
+        self.specialize = specialize
+        self.compiler = Compiler(self)
+        self.machine = StackMachine(self)
+        self.async_machine = AsyncMachine(self)
+        self.vm = VM(self)
+        self.workers = workers or os.cpu_count()
+        self.pool = None  # of worker processes, started by the first pmap
+        self.path = module_path() if path is None else list(path)
+        self.lazy_modules = lazy_modules
 
     def _output(self, expr):
         """Convert expression back to s-expression."""
 
+        if hasattr(expr, "tolist"):  # a NumPy vector or number
+            expr = expr.tolist()
+        elif type(expr) is PersistentVector:
+            expr = list(expr)
+        elif type(expr) is PersistentMap:
+            entries = (map(self._output, entry) for entry in expr.items())
+            return "{" + ", ".join(" ".join(entry) for entry in entries) + "}"
         if not isinstance(expr, list):
             return str(expr)
         else:
             return '[' + ' '.join(map(self._output, expr)) + ']'
 
     # Compute an expression -> cmp
-    def cmp(self, raw_expr: str):
-        return self._output(
-            self._eval_body(Parser.parse(f"[begin {raw_expr}]"), self.global_env)
-        )
+    def cmp(self, raw_expr: str, limits=None):
+        body = self.parser.parse(f"[begin {raw_expr}]")
+        return self._output(self._run(body, limits))
+
+    async def acmp(self, raw_expr: str):
+        """
+        Compute an expression on the running event loop, with the async
+        machine (whatever the engine): natives that are coroutine functions
+        are awaited, and spawn, await and gather run tea code concurrently.
+        """
+        body = self.parser.parse(f"[begin {raw_expr}]")
+        if self.optimizing:
+            body = self.optimizer.optimize(body)
+        machine = self.async_machine
+        return self._output(await machine.run(machine.body(body, self.global_env)))
+
+    def eval(self, expr):
+        """Evaluate a parsed top-level form in the global environment."""
+        return self._run(["begin", expr])
+
+    def optimize(self, expr):
+        """
+        Return expr with its sugar expanded, its constants folded, its dead
+        branches removed and its trivial lambdas inlined.
+        """
+        return Optimizer(self.global_env).optimize(expr)
+
+    def call_stack(self, error):
+        """
+        The tea call stack of an error, from the innermost call out: the
+        function name and "file:line:column" of each frame, where the
+        location is None if the failing code was not read from a source.
+        """
+        frames = []
+        where = None
+        for expr, name in self._notes(error):
+            if where is None and expr is not None:
+                where = self.sources.where(expr)
+            if name is not None:  # the body of the function is expr
+                frames.append((name, where))
+                where = None
+        frames.append(("top level", where))
+        return frames
+
+    @staticmethod
+    def _notes(error):
+        """
+        The (expr, name) notes of the frames an error went up through, from
+        the innermost out (see FRAME_READERS).
+        """
+        frames = []
+        tb = error.__traceback__
+        while tb is not None:
+            reader = FRAME_READERS.get(tb.tb_frame.f_code)
+            if reader is not None:
+                frames.append(reader(tb))
+            tb = tb.tb_next
+        return [note for notes in reversed(frames) for note in notes]
+
+    def format_error(self, error):
+        """The message of an error, followed by its tea call stack."""
+        lines = [f"Error: {error}"]
+        for name, where in self.call_stack(error):
+            lines.append(f"  at {name} ({where})" if where else f"  at {name}")
+        return "\n".join(lines)
+
+    def snapshot(self, path):
+        """
+        Save the global environment to a file: what programs defined in it,
+        and the modules imported. `restore` loads it back.
+        """
+        Snapshot.save(path, self)
+
+    def restore(self, path):
+        """Load a snapshot into the global environment, over what it holds."""
+        Snapshot.load(path, self)
+
+    def current(self):
+        """
+        The interpreter of the evaluation running in this thread, or this
+        one when the code runs outside of any (a worker calling a function).
+        """
+        return running.tea or self
+
+    def memoize(self, fn, size=Memo.SIZE, ttl=None):
+        """The [memo fn size ttl] of fn."""
+        return Memo(fn, self, size, ttl)
+
+    def pmap(self, fn, inputs, chunk=None):
+        """
+        Apply a tea function to every input in worker processes, and return
+        the results in order, as a vector. The function goes with the values
+        it captures; the inputs go in chunks, by default four per worker.
+        """
+        if type(fn) is not Function:
+            raise Exception(f"pmap takes a tea function, not {fn}")
+        data = ship(fn)
+        inputs = list(inputs)
+        if chunk is None:
+            chunk = -(-len(inputs) // (self.workers * 4)) or 1
+        chunks = [inputs[i : i + chunk] for i in range(0, len(inputs), chunk)]
+        if self.pool is None:
+            modules = list(self.modules)
+            self.pool = ProcessPoolExecutor(
+                self.workers,
+                initializer=start_worker,
+                initargs=(self.engine, self.optimizing, modules, self.path),
+            )
+        results = self.pool.map(run_chunk, itertools.repeat(data), chunks)
+        return PersistentVector.of(itertools.chain.from_iterable(results))
+
+    def close(self):
+        """Stop the worker processes of pmap, if any."""
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+
+    def _native_operators(self, body):
+        """
+        The builtin operators that body never rebinds, by name: engines that
+        compile run them directly. Profiling keeps them as calls.
+        """
+        if self.profiler is not None:
+            return {}
+        return {
+            name: value
+            for name, value in self.optimizer.unshadowed(body).items()
+            if name in Optimizer.OPERATORS
+        }
 
+    def _run(self, body, limits=None):
+        """
+        Run a body in the global environment with the selected engine,
+        within limits, or the limits of the interpreter. Going over them
+        raises LimitExceeded, and the interpreter can be used again.
+        """
+        if self.optimizing:
+            body = self.optimizer.optimize(body)
+        # A native can run tea in the evaluation of the same interpreter:
+        # when it returns, the outer evaluation goes on with its own limits
+        saved = self.meter.save()
+        self.meter.start(limits or self.limits)
+        outer = running.meter, running.tea
+        running.meter, running.tea = self.meter, self
+        try:
+            return self._run_in(body, self.global_env)
+        finally:
+            running.meter, running.tea = outer
+            self.meter.restore(saved)
+
+    def _run_in(self, body, env):
+        """Run a body in env with the selected engine; a block shares env."""
+        if self.engine == "closure":
+            return self.compiler.compile_program(body)(env)
+        if self.engine == "stack":
+            return self.machine.run(self.machine.body(body, env))
+        if self.engine == "vm":
+            return self.vm.run(self.vm.compiler.compile_program(body), env)
+        return self._eval_body(body, env)
+
+    @reads_frames(expr_notes)
     def _eval(self, expr, env):
         if env is None:
             env = self.global_env
@@ -214,6 +4845,10 @@ class Tea:
             # VAR DECLARATIONS
             elif expr[0] == "var":
                 [_, name, value] = expr
+                if isinstance(value, list) and value[:1] == ["lambda"]:
+                    fn = self._eval(value, env)
+                    fn.name = name  # for the error stack
+                    return env.define(name, fn)
                 return env.define(name, self._eval(value, env))
 
             # VAR UPDATE
@@ -238,8 +4873,13 @@ class Tea:
             elif expr[0] == "while":
                 [_, condition, block] = expr
                 result = None
+                meter = self.meter
                 while self._eval(condition, env):
                     result = self._eval(block, env)
+                    countdown = meter.countdown - 1
+                    meter.countdown = countdown
+                    if countdown < 0:
+                        meter.check()
                 return result
 
             # Function declaration
@@ -249,6 +4889,10 @@ class Tea:
                 var_expr = self.transformer.transform_def_to_var_lambda(expr)
                 return self._eval(var_expr, env)
 
+            elif expr[0] == "defmemo":
+                var_expr = self.transformer.transform_defmemo_to_var_memo(expr)
+                return self._eval(var_expr, env)
+
             elif expr[0] == "switch":
                 if_expr = self.transformer.transform_switch_to_if(expr)
                 return self._eval(if_expr, env)
@@ -276,11 +4920,7 @@ class Tea:
             # lambda function
             elif expr[0] == "lambda":
                 [_, params, body] = expr
-                return {
-                    "params": params,
-                    "body": body,
-                    "env": env,  # Add this for Closure
-                }
+                return Function(params, body, env)
 
             # OOP CLASS
             elif expr[0] == "class":
@@ -289,7 +4929,7 @@ class Tea:
                 # A class is just an environment!
                 # A class store methods "def" and properties "prop"
                 parent_env = self._eval(parent, env) or env
-                class_env = Environment({}, parent_env)
+                class_env = Class({}, parent_env)
 
                 # Body is evaluated in the class environment
                 self._eval_body(body, class_env)
@@ -305,7 +4945,7 @@ class Tea:
                 class_env = self._eval(expr[1], env)
 
                 # An instance of a class is an environment!
-                instance_env = Environment({}, class_env)
+                instance_env = Instance(class_env)
 
                 args = [self._eval(arg, env) for arg in expr[2:]]
 
@@ -331,16 +4971,18 @@ class Tea:
             # Import module
             elif expr[0] == "import":
                 [_, module_name] = expr
-                # load module code
-                file = f"{module_name}.{FILE_EXTENSION}"
-                path = os.path.dirname(os.path.abspath(__file__))
-                with open(os.path.join(path, "modules", file), mode="r") as f:
-                    module_src = f.read()
+                module_env = self._imported(module_name)
+                if module_env is None:
+                    module_body = self._read_module(module_name)
+                    module_expr = ["module", module_name, module_body]
+                    module_env = self._eval(module_expr, self.global_env)
+                    self.modules[module_name] = module_env
 
-                module_body = Parser.parse(f"[begin {module_src}]")
-                module_expr = ["module", module_name, module_body]
+                return module_env
 
-                return self._eval(module_expr, self.global_env)
+            # Memoized function: [memo fn size ttl]
+            elif expr[0] == "memo":
+                return self.memoize(*[self._eval(arg, env) for arg in expr[1:]])
 
             # Function call
             else:
@@ -348,7 +4990,7 @@ class Tea:
                 args = [self._eval(arg, env) for arg in expr[1:]]
 
                 # Native Function
-                if inspect.isfunction(fn) or inspect.isbuiltin(fn):
+                if type(fn) is not Function:
                     return fn(*args)
 
                 # User-defined function
@@ -357,22 +4999,182 @@ class Tea:
         else:
             raise Exception(f"Unimplemented: {expr}")
 
+    @property
+    def modules(self):
+        """The modules imported into the global environment, by name."""
+        return loaded_modules.setdefault(self.global_env, {})
+
+    def _imported(self, module_name):
+        """
+        Return the module if it was imported before, is native, or is made
+        now as a lazy module, else None: the engine runs it.
+        """
+        module_env = self.modules.get(module_name)
+        if module_env is None and module_name in NATIVE_MODULES:
+            natives = NATIVE_MODULES[module_name](self)
+            module_env = Environment(natives, self.global_env)
+            self.modules[module_name] = module_env
+        elif module_env is None and self.lazy_modules:
+            module_body = self._read_module(module_name, optimize=False)
+            module_env = self._lazy_module(module_body)
+            self.modules[module_name] = module_env
+        if module_env is not None:
+            self.global_env.define(module_name, module_env)
+        return module_env
+
+    def _read_module(self, module_name, optimize=True):
+        """Load the parsed code of a module found on the module path."""
+        module_body = module_registry.load(
+            module_name,
+            self.path,
+            self.parser,
+            flavor=None if self.parser is Parser else self.parser_name,
+        )
+        if optimize and self.optimizing:
+            module_body = self.optimizer.optimize(module_body)
+        return module_body
+
+    def _lazy_module(self, module_body):
+        """
+        A module whose top-level functions are optimized and made when they
+        are first read. Its other forms run now, in order.
+        """
+        optimize = None
+        if self.optimizing:
+            folds = self.optimizer.unshadowed(module_body)
+            optimize = functools.partial(self.optimizer.optimize, folds=folds)
+        module_env = Environment(None, self.global_env)
+        record = module_env.record = LazyRecord(module_env, optimize)
+        forms = []
+        if isinstance(module_body, list) and module_body[:1] == ["begin"]:
+            exprs = module_body[1:]
+        else:
+            exprs = [module_body]
+        for expr in exprs:
+            if isinstance(expr, list) and expr[:1] == ["def"]:
+                expr = self.transformer.transform_def_to_var_lambda(expr)
+            is_var = isinstance(expr, list) and expr[:1] == ["var"]
+            value = expr[2] if is_var else None
+            if isinstance(value, list) and value[:1] == ["lambda"]:
+                [_, params, body] = value
+                dict.__setitem__(record, expr[1], Pending(params, body))
+                record.pending.add(expr[1])
+            else:
+                forms.append(expr)
+        if not record.pending:
+            module_env.record = dict(record)
+        body = ["begin", *forms]
+        self._run_in(body if optimize is None else optimize(body), module_env)
+        return module_env
+
+    @reads_frames(call_notes)
+    def _apply(self, fn, args):
+        """Call a user-defined function with the closure engine."""
+        meter = running.meter
+        while True:
+            countdown = meter.countdown - 1
+            meter.countdown = countdown
+            if countdown < 0:
+                meter.check()
+            params = fn.params
+            if len(args) < len(params):
+                raise Exception(f"Expected {len(params)} arguments, got {len(args)}")
+
+            if fn.scope is None:  # created by another engine
+                fn.code, fn.scope = self.compiler.compile_function(params, fn.body)
+
+            scope = fn.scope
+            slots = [*args[: len(params)], *scope.locals]
+            result = fn.code(Frame(slots, scope.names, fn.env))
+
+            # Tail calls run here, in constant Python stack
+            if type(result) is not TailCall:
+                return result
+            fn, args = result.fn, result.args
+
+    @reads_frames(call_notes)
+    def _profiled_apply(self, fn, args):
+        """`_apply` that times every call of a user-defined function."""
+        meter = running.meter
+        while True:
+            countdown = meter.countdown - 1
+            meter.countdown = countdown
+            if countdown < 0:
+                meter.check()
+            params = fn.params
+            if len(args) < len(params):
+                raise Exception(f"Expected {len(params)} arguments, got {len(args)}")
+
+            if fn.scope is None:  # created by another engine
+                fn.code, fn.scope = self.compiler.compile_function(params, fn.body)
+
+            scope = fn.scope
+            slots = [*args[: len(params)], *scope.locals]
+            self.profiler.enter(f"def:{fn.name}")
+            try:
+                result = fn.code(Frame(slots, scope.names, fn.env))
+            finally:
+                self.profiler.leave()
+
+            if type(result) is not TailCall:
+                return result
+            fn, args = result.fn, result.args
+
+    def _profiled_eval(self, expr, env):
+        """`_eval` that times special forms and natives."""
+        if not isinstance(expr, list):
+            return Tea._eval(self, expr, env)
+
+        head = expr[0]
+        if isinstance(head, str) and head in self.compiler.special_forms:
+            self.profiler.enter(f"form:{head}")
+            try:
+                value = Tea._eval(self, expr, env)
+            finally:
+                self.profiler.leave()
+            # Name the functions of [var name [lambda ...]] for the report
+            value_expr = expr[2] if head == "var" else None
+            if isinstance(value_expr, list) and value_expr[:1] == ["lambda"]:
+                value.name = expr[1]
+            return value
+
+        # Function call
+        fn = self._eval(head, env)
+        args = [self._eval(arg, env) for arg in expr[1:]]
+        if type(fn) is not Function:
+            name = head if isinstance(head, str) else fn.__name__
+            return self.profiler.call(f"native:{name}", fn, args)
+        return self._user_defined_function(fn, args)
+
+    def _profiled_user_defined_function(self, fn, args):
+        self.profiler.enter(f"def:{fn.name}")
+        try:
+            return Tea._user_defined_function(self, fn, args)
+        finally:
+            self.profiler.leave()
+
+    @reads_frames(call_notes)
     def _user_defined_function(self, fn, args):
+        meter = self.meter
+        countdown = meter.countdown - 1
+        meter.countdown = countdown
+        if countdown < 0:
+            meter.check()
         activation_record = {}
 
-        for index, param in enumerate(fn["params"]):
+        for index, param in enumerate(fn.params):
             activation_record[param] = args[index]
 
         activation_env = Environment(
             activation_record,
-            fn["env"],  # static scope
+            fn.env,  # static scope
             # env, # dynamic scope
         )
 
-        return self._eval_body(fn["body"], activation_env)
+        return self._eval_body(fn.body, activation_env)
 
     def _eval_body(self, body, env):
-        if body[0] == "begin":  # body is a block
+        if isinstance(body, list) and body[0] == "begin":  # body is a block
             return self._eval_block(body, env)
         return self._eval(body, env)  # body is an expression
 
@@ -390,70 +5192,246 @@ class Tea:
 
         while True:
             try:
-                result = self.cmp(input(prompt))
+                code = input(prompt)
+                if self.parser is Parser:  # which knows where lists start
+                    result = self._output(self._run(self.sources.parse(code, "<repl>")))
+                else:
+                    result = self.cmp(code)
                 if result is not None:
                     print(result)
-            except KeyboardInterrupt:
+            except (KeyboardInterrupt, EOFError):
                 print("\nNo more tea for now. Goodbye...\n")
                 sys.exit()
-            except Exception:
-                print(
-                    "Tea was spilled. Sorry.\nHere is the Python trace to help you:\n"
-                )
-                traceback.print_exc()
+            except Exception as error:
+                print(f"Tea was spilled. Sorry.\n{self.format_error(error)}")
+            finally:
+                self.sources.release()
+
+
+class InterpreterPool:
+    """
+    A bounded pool of interpreters for embedding tea in a service. Each
+    interpreter has a global environment of its own, so what one caller
+    defines is never seen by the others.
+
+    They all start from a base environment, prepared once: the builtins,
+    the modules imported, and what the setup program defines. An
+    interpreter gets a copy of everything the base environment reaches:
+    its functions close over the copies of their environments, so writes
+    through them stay in the interpreter too. Code, bodies and builtins
+    are shared (compiled code imports, instantiates and memoizes in the
+    interpreter that runs it), and memos start empty. Returning an
+    interpreter resets it to the base.
+    """
+
+    def __init__(self, size=4, modules=(), setup=None, **options):
+        if size < 1:
+            raise ValueError(f"The pool needs at least one interpreter, not {size}")
+        self.size = size
+        self.options = options
+        self.base = Tea(Environment(dict(BUILTINS)), **options)
+        for name in modules:
+            self.base.eval(["import", name])
+        if setup is not None:
+            self.base.cmp(setup)
+        self.idle = []
+        self.started = 0
+        self.available = threading.Condition()
+
+    def checkout(self, timeout=None):
+        """
+        Take an idle interpreter, or start a new one while the pool is not
+        full, or else wait until one is returned.
+        """
+        with self.available:
+            while not self.idle and self.started == self.size:
+                if not self.available.wait(timeout):
+                    raise TimeoutError("No interpreter was returned in time")
+            if self.idle:
+                return self.idle.pop()
+            self.started += 1
+        try:
+            tea = Tea(Environment(None), **self.options)
+            self.reset(tea)
+            return tea
+        except BaseException:
+            with self.available:
+                self.started -= 1
+                self.available.notify()
+            raise
+
+    def checkin(self, tea):
+        """Reset an interpreter to the base environment, and return it."""
+        self.reset(tea)
+        with self.available:
+            self.idle.append(tea)
+            self.available.notify()
+
+    def reset(self, tea):
+        copies = {id(self.base.global_env): tea.global_env}
+        copy = functools.partial(self._copy, copies, tea)
+        tea.global_env.record = {
+            name: value if BUILTINS.get(name) is value else copy(value)
+            for name, value in self.base.global_env.record.items()
+        }
+        loaded_modules[tea.global_env] = {
+            name: copy(module_env) for name, module_env in self.base.modules.items()
+        }
+        if tea.profiler is not None:
+            tea.profiler = Profiler()
+
+    @classmethod
+    def _copy(cls, copies, tea, value):
+        """
+        The copy of a value of the base for tea. copies maps the id of
+        everything copied so far to its copy; an object is in it before
+        what it refers to is copied, so cycles end.
+        """
+        kind = type(value)
+        if kind is PersistentVector or kind is PersistentMap:
+            # Rebuilt only when they hold something that is copied
+            if kind is PersistentVector:
+                items = list(value)
+            else:
+                items = list(itertools.chain.from_iterable(value.items()))
+            copied = [cls._copy(copies, tea, item) for item in items]
+            if all(map(operator.is_, copied, items)):
+                return value
+            if kind is PersistentMap:
+                return kind.of(zip(copied[::2], copied[1::2]))
+            return kind.of(copied)
+        if kind not in Snapshot.KINDS:
+            return value
+        copy = copies.get(id(value))
+        if copy is not None:
+            return copy
+
+        copy = copies[id(value)] = object.__new__(kind)
+        if kind is Function:
+            for name in Function.__slots__:
+                setattr(copy, name, getattr(value, name))
+            copy.env = cls._copy(copies, tea, value.env)
+        elif kind is Memo:
+            fn = cls._copy(copies, tea, value.fn)
+            copy.__init__(fn, tea, value.size, value.ttl, value.clock)
+        elif kind is Instance:
+            copy.shape = value.shape
+            copy.values = [cls._copy(copies, tea, item) for item in value.values]
+            copy.parent = cls._copy(copies, tea, value.parent)
+        elif kind is Frame:
+            copy.names = value.names
+            copy.slots = [cls._copy(copies, tea, item) for item in value.slots]
+            copy.parent = cls._copy(copies, tea, value.parent)
+        else:  # an environment or a class, by its record
+            record = value.record
+            if type(record) is LazyRecord:
+                copy.record = LazyRecord(copy, record.optimize)
+                copy.record.pending = set(record.pending)
+            else:
+                copy.record = type(record)()
+            if kind is Class:
+                copy.shape = value.shape
+            elif kind is Activation:
+                copy.fn = cls._copy(copies, tea, value.fn)
+                copy.call = value.call
+            copy.parent = cls._copy(copies, tea, value.parent)
+            # (without making the functions of a lazy module)
+            for name in list(dict.keys(record)):
+                item = dict.__getitem__(record, name)
+                copy.record[name] = cls._copy(copies, tea, item)
+        return copy
+
+    @contextlib.contextmanager
+    def interpreter(self, timeout=None):
+        """`with pool.interpreter() as tea:` checks out and returns a Tea."""
+        tea = self.checkout(timeout)
+        try:
+            yield tea
+        finally:
+            self.checkin(tea)
+
+    def cmp(self, raw_expr, timeout=None):
+        """Compute an expression in an interpreter of its own."""
+        with self.interpreter(timeout) as tea:
+            return tea.cmp(raw_expr)
 
 
-def load(filename):
+def load(filename, profile=None):
     """
     Load a program in filename, execute it, and start the repl. If an error occurs,
-    execution stops, and we are left in the repl. This function supports
-    multi-line code by merging lines until the parentheses match.
+    execution stops, and we are left in the repl. Each top-level form runs as
+    soon as it is read. With "-" as filename the program is read from stdin,
+    and there is no repl afterwards.
+
+    With profile, the run is profiled and its report printed to stderr;
+    a profile that is a file name also gets the collapsed call stacks.
     """
+    tea = Tea(profile=bool(profile))
+
+    if filename == "-":
+        execute(tea, sys.stdin)
+        print_profile(tea, profile)
+        return
+
     print(f"Loading and executing {filename}")  # load module code
     file = f"{filename}"
     path = os.path.dirname(os.path.abspath(__file__))
+    # Modules next to the program come first
+    tea.path.insert(0, os.path.dirname(os.path.join(path, file)))
     with open(os.path.join(path, file), mode="r") as f:
-        program = f.readlines()
+        execute(tea, f, filename)
+    print_profile(tea, profile)
+    tea.repl()
 
-    rps = running_paren_sums(program)
-    full_line = ""
 
-    tea = Tea()
-    tea.repl()
-    for paren_sum, program_line in zip(rps, program):
-        program_line = program_line.strip()
-        full_line += program_line + " "
-        if paren_sum == 0 and full_line.strip() != "":
-            try:
-                val = tea.cmp(full_line)
-                if val is not None:
-                    print(val)
-            except Exception:
-                print(f"\nThe line in which the error occurred:\n{full_line}")
-                break
-            full_line = ""
-    tea.repl()
+def print_profile(tea, profile):
+    """Print the profile of a run, and save its stacks if profile is a path."""
+    if tea.profiler is None:
+        return
+    print(tea.profiler.report(), file=sys.stderr)
+    if isinstance(profile, str):
+        with open(profile, mode="w") as f:
+            f.write(tea.profiler.collapsed() + "\n")
 
 
-def running_paren_sums(program):
+def execute(tea, stream, name="<stdin>"):
     """
-    Map the lines in the list program to a list whose entries contain
-    a running sum of the per-line difference between '[' and the number of ']'.
+    Evaluate the forms of a stream as they arrive and print their values.
+    An error is printed with its tea call stack, located in the stream name.
     """
-
-    count_open_parens = lambda line: line.count("[") - line.count("]")
-    paren_counts = list(map(count_open_parens, program))
-    rps = []
-    total = 0
-    for paren_count in paren_counts:
-        total += paren_count
-        rps.append(total)
-    return rps
+    offsets = {}
+    reader = Reader(stream, offsets)
+    forms = iter(reader)
+    while True:
+        try:
+            expr = next(forms, None)
+            if expr is None:
+                return True
+            tea.sources.add(expr, offsets, name, reader.locate)
+            offsets.clear()
+            value = tea.eval(expr)
+            if value is not None:
+                print(tea._output(value))
+        except SyntaxError as error:
+            print(f"\nThe program could not be read: {error}")
+            return False
+        except Exception as error:
+            print(f"\n{tea.format_error(error)}")
+            return False
+        finally:
+            tea.sources.release()  # the form has run, and its error is printed
 
 
 if __name__ == "__main__":
-    if len(sys.argv) > 1:
-        load(sys.argv[1])
+    # --profile prints a profile; --profile=<file> also saves its stacks
+    options = [arg for arg in sys.argv[1:] if arg.startswith("--profile")]
+    arguments = [arg for arg in sys.argv[1:] if arg not in options]
+    profile = None
+    for option in options:
+        profile = option.partition("=")[2] or True
+
+    if arguments:
+        load(arguments[0], profile)
     else:
         tea = Tea()
         tea.repl()
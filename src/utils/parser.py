@@ -3,6 +3,7 @@ from lark import Lark, Transformer
 
 path = os.path.dirname(os.path.abspath(__file__))
 file = "grammar.lark"
+cache_file = os.path.join(path, "__teacache__", "grammar.lark.cache")
 
 
 # Define the grammar for expressions
@@ -15,24 +16,33 @@ class CustomTransformer(Transformer):
     def array(self, items):
         return list(items)
 
-    def atom(self, atom):
-        return atom[0].value
-
-    def integer(self, atom):
-        return int(atom[0].value)
-
-    def floating(self, atom):
-        return float(atom[0].value)
-
-    def string(self, atom):
-        return str(atom[0].value)
-
-    def start(self, expr):
-        return expr[0]
-
-
-# Create the parser
-parser = Lark(grammar, parser='lalr', transformer=CustomTransformer())
+    # Token callbacks: atoms need no rule of their own
+    def CNAME(self, token):
+        return token.value
+
+    OPERATOR = CNAME
+    ESCAPED_STRING = CNAME
+
+    def SIGNED_INT(self, token):
+        return int(token.value)
+
+    def SIGNED_FLOAT(self, token):
+        return float(token.value)
+
+
+# Create the parser. With LALR the transformer runs inside the parser, so
+# no Tree is built; the parse tables are cached on disk between runs.
+try:
+    os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+except OSError:
+    pass  # lark runs without its cache when it cannot write it
+parser = Lark(
+    grammar,
+    parser='lalr',
+    lexer='basic',
+    transformer=CustomTransformer(),
+    cache=cache_file,
+)
 
 
 # Parse the expression and return the resulting list
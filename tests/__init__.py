@@ -1,5 +1,7 @@
+import os
+
 from src.tea import Tea
 
-tea = Tea()
+tea = Tea(engine=os.environ.get("TEA_ENGINE", "closure"))
 
 compute = tea.cmp
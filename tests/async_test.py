@@ -0,0 +1,56 @@
+import asyncio
+
+from src.tea import BUILTINS, Environment, Tea
+
+from . import *
+
+events = []
+
+
+async def step(name, value):
+    events.append(f"start {name}")
+    await asyncio.sleep(0)
+    events.append(f"end {name}")
+    return value
+
+
+atea = Tea(Environment(dict(BUILTINS)), engine=tea.engine)
+atea.global_env.define("step", step)
+
+# Coroutine natives are awaited where they are called
+assert asyncio.run(atea.acmp("[+ [step [quote a] 1] [step [quote b] 2]]")) == "3"
+assert events == ["start a", "end a", "start b", "end b"]
+
+# Spawned tasks wait at the same time
+events.clear()
+assert asyncio.run(
+    atea.acmp(
+        """
+[def fetch [name value] [* [step name value] 10]]
+[var first [spawn [fetch [quote a] 1]]]
+[var second [spawn [fetch [quote b] 2]]]
+[+ [await first] [await second]]
+"""
+    )
+) == "30"
+assert events == ["start a", "start b", "end a", "end b"]
+
+events.clear()
+assert asyncio.run(
+    atea.acmp(
+        "[gather [spawn [fetch [quote c] 3]] [spawn [step [quote d] 4]] [spawn 5]]"
+    )
+) == "[30 4 5]"
+assert events == ["start c", "start d", "end c", "end d"]
+
+
+# Scripts share the event loop
+async def scripts():
+    return await asyncio.gather(
+        atea.acmp("[step [quote e] [quote e]]"), atea.acmp("[step [quote f] [quote f]]")
+    )
+
+
+events.clear()
+assert asyncio.run(scripts()) == ["e", "f"]
+assert events == ["start e", "start f", "end e", "end f"]
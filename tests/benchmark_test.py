@@ -0,0 +1,28 @@
+from benchmarks.suite import compare, run_suite
+
+from . import *
+
+quiet = [].append
+
+# Every workload runs, and gives its rate and peak memory
+results = run_suite([tea.engine], repeat=1, scale=0.01, report=quiet)
+for name, result in results[tea.engine].items():
+    assert result["ops"] > 0, name
+    assert result["ops_per_second"] > 0, name
+    assert result["peak_bytes"] > 0, name
+
+
+def result(ops_per_second, peak_bytes):
+    return {"ops_per_second": ops_per_second, "peak_bytes": peak_bytes}
+
+
+baseline = {"vm": {"fib": result(100, 1000), "loops": result(100, 1000)}}
+current = {
+    "vm": {"fib": result(85, 1000), "loops": result(95, 1200), "new": result(1, 1)}
+}
+regressions = compare(current, baseline, 0.1, report=quiet)
+assert [(*regression[:3], round(regression[3], 2)) for regression in regressions] == [
+    ("vm", "fib", "ops_per_second", -0.15),
+    ("vm", "loops", "peak_bytes", 0.2),
+]
+assert compare(current, baseline, 0.25, report=quiet) == []
@@ -0,0 +1,21 @@
+import pytest
+
+pytest.importorskip("lark")
+
+from src.tea import Tea
+
+lark_tea = Tea(parser="lark")
+
+# Strings are single atoms with the lark grammar
+assert lark_tea.cmp('[quote ["  some text  "]]') == '["  some text  "]'
+assert lark_tea.cmp("[+ -2 +3.5] /* a comment */") == "1.5"
+assert lark_tea.cmp("[% 7 4]") == "3"
+assert (
+    lark_tea.cmp(
+        """
+[import math]
+[[prop math square] 12]
+"""
+    )
+    == "144"
+)
@@ -0,0 +1,69 @@
+from src.tea import (
+    BUILTINS,
+    Environment,
+    InterpreterPool,
+    LimitExceeded,
+    Limits,
+    Tea,
+)
+
+from . import *
+
+
+def exceeded(code, limits, interpreter=tea):
+    try:
+        interpreter.cmp(code, limits)
+    except LimitExceeded as error:
+        return error.limit
+    return None
+
+
+# Steps are loop iterations and function calls
+assert exceeded("[var n 0] [while true [++ n]]", Limits(steps=100)) == "steps"
+assert compute("n") == "101"
+assert exceeded("[def down [n] [down [- n 1]]] [down 0]", Limits(steps=50)) == "steps"
+assert exceeded("[var m 0] [while [< m 100] [++ m]]", Limits(steps=100)) is None
+assert exceeded("[set m 0] [while [< m 101] [++ m]]", Limits(steps=100)) == "steps"
+
+# Wall time and allocations are checked every Meter.INTERVAL steps
+assert exceeded("[while true null]", Limits(seconds=0.05)) == "seconds"
+assert (
+    exceeded(
+        "[var xs [list]] [while true [set xs [conj xs [list 1]]]]",
+        Limits(allocations=20000),
+    )
+    == "allocations"
+)
+
+# The interpreter can be used again, without limits
+assert compute("[for [var i 0] [< i 5000] [++ i] i]") == "5000"
+
+# Limits of the interpreter apply to every evaluation without its own
+limited = Tea(Environment(dict(BUILTINS)), engine=tea.engine, limits=Limits(steps=10))
+assert exceeded("[var k 0] [while true [++ k]]", None, limited) == "steps"
+assert exceeded("[set k 0] [while [< k 20] [++ k]]", Limits(steps=30), limited) is None
+assert limited.cmp("k") == "20"
+
+# Functions that another interpreter compiled count against the caller's limits
+spinning = "[def spin [] [while true null]] [def down [n] [down [- n 1]]]"
+pool = InterpreterPool(size=1, setup=spinning, engine=tea.engine)
+with pool.interpreter() as interpreter:
+    assert exceeded("[spin]", Limits(seconds=0.2), interpreter) == "seconds"
+    assert exceeded("[down 0]", Limits(steps=100), interpreter) == "steps"
+defining = Tea(Environment(dict(BUILTINS)), engine=tea.engine)
+defining.cmp(spinning)
+calling = Tea(defining.global_env, engine=tea.engine)
+assert exceeded("[spin]", Limits(steps=100), calling) == "steps"
+
+# A native that runs tea in the same interpreter leaves the limits of the
+# evaluation that called it in force
+nesting = Tea(Environment(dict(BUILTINS)), engine=tea.engine)
+nesting.global_env.define("inner", lambda: int(nesting.cmp("[+ 1 2]")))
+assert exceeded("[while true [inner]]", Limits(steps=100), nesting) == "steps"
+assert nesting.cmp("[for [var i 0] [< i 5000] [++ i] [inner]]") == "5000"
+
+try:
+    Limits(steps=-1)
+    assert False
+except ValueError:
+    pass
@@ -0,0 +1,58 @@
+import importlib.util
+import itertools
+
+from src.tea import BUILTINS, Environment, Memo, Tea
+
+from . import *
+
+# Recursive calls hit the cache: fib(80) without memo would never end
+compute(
+    """
+[defmemo mfib [n] [if [< n 2] n [+ [mfib [- n 1]] [mfib [- n 2]]]]]
+"""
+)
+assert compute("[mfib 80]") == "23416728348467685"
+mfib = tea.global_env.lookup("mfib")
+assert type(mfib) is Memo
+assert mfib.stats() == {"hits": 78, "misses": 81, "size": 81, "max_size": 1024}
+assert compute("[mfib 80]") == "23416728348467685"
+assert mfib.hits == 79
+
+compute("[memo-clear mfib]")
+assert mfib.stats() == {"hits": 0, "misses": 0, "size": 0, "max_size": 1024}
+
+# [memo fn size ttl]: the size calls used last are kept
+compute(
+    """
+[var calls 0]
+[var square [memo [lambda [x] [begin [++ calls] [* x x]]] 2]]
+"""
+)
+assert compute("[square 3] [square 4] [square 3] calls") == "2"
+assert compute("[square 5] calls") == "3"  # forgets 4, used last before 3
+assert compute("[square 3] calls") == "3"
+assert compute("[square 4] calls") == "4"
+
+# Results expire after ttl seconds
+ticks = itertools.count()
+compute("[var slow [memo [lambda [x] [begin [++ calls] x]] null 2]]")
+slow = tea.global_env.lookup("slow")
+slow.clock = ticks.__next__  # every reading of the clock is a second later
+assert compute("[set calls 0] [slow 1] [slow 1] calls") == "1"
+assert compute("[slow 1] calls") == "2"
+
+try:
+    compute("[memo +]")
+    assert False
+except Exception as error:
+    assert str(error).startswith("memo takes a tea function")
+
+# Both parsers read names with hyphens
+if importlib.util.find_spec("lark") is not None:
+    lark_tea = Tea(Environment(dict(BUILTINS)), engine=tea.engine, parser="lark")
+    lark_tea.cmp("[defmemo double [n] [* 2 n]] [double 4]")
+    double = lark_tea.global_env.lookup("double")
+    assert double.stats()["size"] == 1
+    lark_tea.cmp("[memo-clear double]")
+    assert double.stats()["size"] == 0
+    assert lark_tea.cmp("[var a-b 3] [- a-b 1]") == "2"
@@ -0,0 +1,37 @@
+import os
+import tempfile
+
+from . import *
+from src.tea import ModuleCache, Parser
+
+# A module is only loaded once per global environment
+assert compute("[= [import math] [import math]]") == "True"
+
+
+def parse(source):
+    parsed.append(source)
+    return Parser.parse(f"[begin {source}]")
+
+
+with tempfile.TemporaryDirectory() as directory:
+    source_path = os.path.join(directory, "numbers.tea")
+    with open(source_path, mode="w") as f:
+        f.write("[var big 123456789012345678901234567890] [var small -0.5]")
+
+    parsed = []
+    expected = [
+        "begin",
+        ["var", "big", 123456789012345678901234567890],
+        ["var", "small", -0.5],
+    ]
+    assert ModuleCache.load(source_path, parse) == expected
+    assert ModuleCache.load(source_path, parse) == expected
+    assert len(parsed) == 1
+    assert os.path.exists(ModuleCache.path_for(source_path))
+
+    # Editing the source invalidates the cache
+    with open(source_path, mode="w") as f:
+        f.write("[var big 1]")
+    os.utime(source_path, ns=(0, 0))
+    assert ModuleCache.load(source_path, parse) == ["begin", ["var", "big", 1]]
+    assert len(parsed) == 2
@@ -0,0 +1,88 @@
+import os
+import tempfile
+
+from src.tea import (
+    BUILTINS,
+    Environment,
+    Function,
+    Parser,
+    Pending,
+    Tea,
+    module_path,
+    module_registry,
+)
+
+from . import *
+
+
+def write(path, source):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, mode="w") as f:
+        f.write(source)
+
+
+def fresh(**options):
+    return Tea(Environment(dict(BUILTINS)), engine=tea.engine, **options)
+
+
+with tempfile.TemporaryDirectory() as first, tempfile.TemporaryDirectory() as second:
+    write(os.path.join(first, "greet.tea"), "[var greeting 1]")
+    write(os.path.join(second, "greet.tea"), "[var greeting 2]")
+    write(os.path.join(second, "lib.tea"), "[def twice [x] [* 2 x]]")
+    write(os.path.join(second, "risky.tea"), "[def broken [x x] x] [def one [] 1]")
+    write(os.path.join(second, "geo", "__init__.tea"), "[var unit 1]")
+    write(
+        os.path.join(second, "geo", "shapes.tea"),
+        """
+        [def area [w h] [* w h]]
+        [def square [side] [area side side]]
+        [var origin [area 0 0]]
+        """,
+    )
+
+    # TEA_PATH comes before the modules of tea
+    os.environ["TEA_PATH"] = os.pathsep.join([first, second])
+    try:
+        assert module_path()[:2] == [first, second]
+        searching = fresh()
+    finally:
+        del os.environ["TEA_PATH"]
+    assert searching.path[-1] == module_path()[-1]
+
+    # The first directory of the path that has a module wins
+    assert searching.cmp("[import greet] [prop greet greeting]") == "1"
+    assert searching.cmp("[import lib] [[prop lib twice] 21]") == "42"
+    assert searching.cmp("[import math] [[prop math square] 3]") == "9"
+
+    # a.b is a/b.tea, and a package directory has an __init__.tea
+    assert searching.cmp("[import geo] [prop geo unit]") == "1"
+    assert searching.cmp("[import geo.shapes] [[prop geo.shapes area] 2 3]") == "6"
+
+    try:
+        searching.cmp("[import missing]")
+    except Exception as error:
+        assert str(error).startswith("Module not found: missing")
+    else:
+        assert False
+
+    # Every interpreter of the process shares the parsed code
+    other = fresh(path=[second], optimize=False)
+    assert other.cmp("[import lib] [[prop lib twice] 4]") == "8"
+    assert module_registry.load("lib", [second], Parser) is module_registry.load(
+        "lib", other.path, Parser
+    )
+
+    # A lazy module makes its functions when they are first read
+    lazy = fresh(path=[second], lazy_modules=True)
+    assert lazy.cmp("[import geo.shapes] [prop geo.shapes origin]") == "0"
+    record = lazy.modules["geo.shapes"].record
+    assert type(dict.__getitem__(record, "square")) is Pending
+    assert lazy.cmp("[[prop geo.shapes square] 5]") == "25"
+    assert type(dict.__getitem__(record, "square")) is Function
+
+    # Once all are made, the module has a plain record
+    assert type(lazy.modules["geo.shapes"].record) is dict
+
+    # A function that is never called is never compiled
+    assert lazy.cmp("[import risky] [[prop risky one]]") == "1"
+    assert lazy.cmp("[prop risky broken]") == "<function broken>"
@@ -0,0 +1,41 @@
+from . import *
+
+from src.tea import Function, Instance
+
+assert (
+    compute(
+        """
+[class Vec null
+    [begin
+        [def constructor [this x y]
+            [begin
+                [set [prop this x] x]
+                [if [> y 0] [set [prop this y] y] 0]
+            ]
+        ]
+        [def norm1 [this] [+ [prop this x] [prop this y]]]
+    ]
+]
+[var y 100]
+[var u [new Vec 1 2]]
+[var v [new Vec 3 4]]
+[var w [new Vec 5 0]]
+[set [prop v z] 7]
+[+ [[prop u norm1] u] [+ [prop v z] [prop w y]]]
+"""
+    )
+    == "110"  # w has no y of its own: [prop w y] finds the global y
+)
+
+u, v, w = (tea.global_env.lookup(name) for name in ("u", "v", "w"))
+assert type(u) is Instance
+# Every instance starts with the layout the constructor gives it
+assert u.shape is w.shape
+assert list(u.shape.names) == ["x", "y"]
+assert list(v.shape.names) == ["x", "y", "z"]
+assert v.shape is u.shape.add("z")
+assert list(w.record.keys()) == ["x"]
+
+norm1 = tea.global_env.lookup("Vec").lookup("norm1")
+assert type(norm1) is Function
+assert compute("[lambda [x] x]") == "<function lambda>"
@@ -0,0 +1,41 @@
+from . import *
+
+from src.tea import BUILTINS, Environment, Tea
+
+# N-ary operators
+assert compute("[+ 1 2 3 4]") == "10"
+assert compute("[- 20 1 2 3]") == "14"
+assert compute("[* 2 3 4]") == "24"
+assert compute("[// 100 3 4]") == "8"
+assert compute("[var a 1] [var b 2] [var c 3] [+ a b c]") == "6"
+assert compute("[- a]") == "-1"
+assert compute("[< a b c]") == "True"
+assert compute("[< a c b]") == "False"
+assert compute("[= a 1 [- b 1]]") == "True"
+assert compute("[var plus +] [plus a b c]") == "6"
+
+# Shadowed operators are called like any other function
+assert compute("[def apply [* x] [* x x]] [apply - 3]") == "0"
+assert compute("[begin [var + -] [+ 10 1 2]]") == "7"
+
+# The vm runs unshadowed operators as single instructions
+compiler = Tea(engine="vm").vm.compiler
+assert "BINARY_OP" in compiler.compile_program(["*", "x", 2]).disassemble()
+shadowed = ["begin", ["var", "*", "+"], ["*", "x", 2]]
+assert "BINARY_OP" not in compiler.compile_program(shadowed).disassemble()
+
+# Code that runs an operator directly sees it rebound later, from anywhere
+rebinding = Tea(Environment(dict(BUILTINS)), engine=tea.engine)
+rebinding.cmp(
+    """
+    [def inc [x] [+ x 1]]
+    [def g [] [if true [+ 1 2] 0]]
+    [def between [a b c] [< a b c]]
+    [def swap [] [set + -]]
+    """
+)
+assert rebinding.cmp("[inc 5]") == "6"
+assert rebinding.cmp("[swap] [inc 5]") == "4"
+assert rebinding.cmp("[g]") == "-1"
+assert rebinding.cmp("[set true false] [g]") == "0"
+assert rebinding.cmp("[set < >] [between 3 2 1]") == "True"
@@ -0,0 +1,53 @@
+from . import *
+
+from src.tea import Tea
+
+# Sugar is expanded once, and constants are folded
+for_expr = ["for", ["var", "i", 0], ["<", "i", 3], ["++", "i"], ["*", 2, 3]]
+assert tea.optimize(for_expr) == [
+    "begin",
+    ["var", "i", 0],
+    ["while", ["<", "i", 3], ["begin", 6, ["set", "i", ["+", "i", 1]]]],
+]
+assert tea.optimize(["=", ["+", 1, 2], ["//", 7, 2]]) is True
+assert tea.optimize(["/", 1, 0]) == ["/", 1, 0]  # the error is left for run time
+
+# Dead branches and trivial lambdas
+assert tea.optimize(["if", [">", 1, 2], ["f"], ["g"]]) == ["g"]
+assert tea.optimize(["if", "true", ["f"], ["g"]]) == ["f"]
+assert tea.optimize([["lambda", ["x"], ["*", "x", "x"]], 4]) == 16
+swap = [["lambda", ["a", "b"], ["-", "a", "b"]], "b", "a"]
+assert tea.optimize(swap) == ["-", "b", "a"]
+assert tea.optimize([["lambda", ["x"], ["var", "y", "x"]], 1])[0][0] == "lambda"
+
+# Arguments are only inlined when their evaluation is kept
+assert tea.optimize([["lambda", ["x"], 1], ["side-effect"]])[0][0] == "lambda"
+assert tea.optimize([["lambda", ["x"], 1], "y"])[0][0] == "lambda"
+
+# Function bodies run later, when the builtins may have been rebound
+assert tea.optimize(["lambda", [], ["+", 1, 2]]) == ["lambda", [], ["+", 1, 2]]
+assert tea.optimize(["lambda", [], ["if", "true", 1, 2]])[2][0] == "if"
+
+# Operators bound by the program are not folded
+assert tea.optimize(["begin", ["def", "+", ["a", "b"], "a"], ["+", 1, 2]])[2] == [
+    "+",
+    1,
+    2,
+]
+assert tea.optimize(["lambda", ["true"], ["if", "true", 1, 2]])[2][0] == "if"
+
+assert (
+    compute(
+        """
+[def sign [x] [switch [[> x 0] 1] [[< x 0] -1] [else 0]]]
+[var total 0]
+[for [var i 1] [<= i 3] [++ i] [+= total [sign [* i [- 2 3]]]]]
+[begin
+    [def * [a b] 100]
+    [+ total [* 2 3]]]
+"""
+    )
+    == "97"
+)
+
+assert Tea(optimize=False).cmp("[if [< 1 2] [+ 1 1] 0]") == "2"
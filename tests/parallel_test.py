@@ -0,0 +1,66 @@
+from . import *
+
+compute(
+    """
+[import math]
+[import parallel]
+[var offset 10]
+[def fib [n] [if [< n 2] n [+ [fib [- n 1]] [fib [- n 2]]]]]
+[def job [x] [+ [fib x] offset [[prop math square] x]]]
+"""
+)
+
+# Functions go to the workers with what they capture: values, other
+# functions (fib calls itself) and modules
+assert compute("[[prop parallel map] job [list 1 2 3 4 5 6 7 8 9 10]]") == (
+    "[12 15 21 29 40 54 72 95 125 165]"
+)
+assert compute("[[prop parallel map] job [list 1 2 3 4 5] 2]") == "[12 15 21 29 40]"
+assert compute("[[prop parallel map] job [list]]") == "[]"
+assert compute("[[prop parallel for] 0 5 [lambda [i] [* i i]]]") == "[0 1 4 9 16]"
+assert compute(
+    "[[prop parallel map] [lambda [m] [get m 1]] [list [dict 1 2] [dict 1 3]]]"
+) == "[2 3]"
+
+# A name the body declares is still captured where it reads the outer one
+compute(
+    """
+[def shadows [] [begin
+    [var y 10]
+    [lambda [x] [begin [var z y] [var y 2] [+ x z y]]]]]
+"""
+)
+assert compute("[[prop parallel map] [shadows] [list 1 2]]") == "[13 14]"
+
+# A worker cannot assign the variables of this process
+compute("[def counter [] [begin [var total 0] [lambda [x] [set total x]]]]")
+try:
+    compute("[[prop parallel map] [counter] [list 1]]")
+    assert False
+except Exception as error:
+    assert str(error) == (
+        "Cannot send lambda to another process: "
+        "it assigns total, a variable it captures"
+    )
+
+# Environments cannot be sent to another process
+compute(
+    """
+[class Point null [def constructor [this x] [set [prop this x] x]]]
+[var origin [new Point 0]]
+"""
+)
+try:
+    compute("[[prop parallel map] [lambda [p] [+ p [prop origin x]]] [list 1]]")
+    assert False
+except Exception as error:
+    assert str(error) == (
+        "Cannot send lambda to another process: it captures origin, a class instance"
+    )
+try:
+    compute("[[prop parallel map] + [list 1]]")
+    assert False
+except Exception as error:
+    assert str(error).startswith("pmap takes a tea function")
+
+tea.close()
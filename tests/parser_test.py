@@ -0,0 +1,24 @@
+from src.tea import Parser
+
+assert Parser.parse("[+ [* 2 3] 10.]") == ["+", ["*", 2, 3], 10.0]
+
+# Source offsets of every list, by id
+offsets = {}
+expr = Parser.parse("[begin\n  [var x 1]\n  [f [g x]]]", offsets)
+assert offsets[id(expr)] == 0
+assert offsets[id(expr[1])] == 9
+assert offsets[id(expr[2][1])] == 24
+
+# No recursion: nesting depth is not bounded by the Python stack
+deep = Parser.parse("[" * 5000 + "]" * 5000)
+for _ in range(4999):
+    deep = deep[0]
+assert deep == []
+
+for code, message in [("[a [b]", "Unexpected EOF"), ("]", 'Unexpected token "]"')]:
+    try:
+        Parser.parse(code)
+    except SyntaxError as error:
+        assert str(error) == message
+    else:
+        assert False, code
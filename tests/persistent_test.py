@@ -0,0 +1,67 @@
+from . import *
+
+compute(
+    """
+[var xs [list 1 2 3]]
+[var m [dict 1 [quote one] 2 [quote two]]]
+"""
+)
+
+# Vectors
+assert compute("xs") == "[1 2 3]"
+assert compute("[list]") == "[]"
+assert compute("[count xs]") == "3"
+assert compute("[get xs 0]") == "1"
+assert compute("[get xs 3]") == "None"
+assert compute("[get xs 3 0]") == "0"
+assert compute("[conj xs 4 5]") == "[1 2 3 4 5]"
+assert compute("[assoc xs 1 20]") == "[1 20 3]"
+assert compute("[assoc xs 3 4]") == "[1 2 3 4]"
+assert compute("xs") == "[1 2 3]"  # unchanged
+assert compute("[= xs [conj [list 1 2] 3]]") == "True"
+
+# Maps
+assert compute("m") == "{1 one, 2 two}"
+assert compute("[dict]") == "{}"
+assert compute("[get m 2]") == "two"
+assert compute("[get m 3 [quote none]]") == "none"
+assert compute("[assoc m 3 [quote three]]") == "{1 one, 2 two, 3 three}"
+assert compute("[assoc m 1 [quote uno]]") == "{1 uno, 2 two}"
+assert compute("[dissoc m 1 5]") == "{2 two}"
+assert compute("[conj m [list 3 [quote three]]]") == "{1 one, 2 two, 3 three}"
+assert compute("[count m]") == "2"
+assert compute("[keys m]") == "[1 2]"
+assert compute("[values m]") == "[one two]"
+assert compute("[keys xs]") == "[0 1 2]"  # the indexes get takes
+assert compute("[values xs]") == "[1 2 3]"
+assert compute("[keys [list]]") == "[]"
+assert compute("[get [dict xs 1] [list 1 2 3]]") == "1"  # vectors are values
+
+# Large collections share structure between versions, and for loops over
+# them read each leaf once
+compute(
+    """
+[var big [list]]
+[for [var i 0] [< i 2000] [++ i]
+    [set big [conj big [* i i]]]]
+[var old big]
+[set big [assoc big 1500 -1]]
+[var table [dict]]
+[for [var i 0] [< i 2000] [++ i]
+    [set table [assoc table i [get big i]]]]
+[def total [v] [begin
+    [var sum 0]
+    [for [var i 0] [< i [count v]] [++ i]
+        [set sum [+ sum [get v i]]]]
+    sum]]
+"""
+)
+assert compute("[count big]") == "2000"
+assert compute("[get big 1500]") == "-1"
+assert compute("[get old 1500]") == "2250000"
+assert compute("[get big 1999]") == "3996001"
+assert compute("[- [total old] [total big]]") == "2250001"
+assert compute("[count table]") == "2000"
+assert compute("[get table 1500]") == "-1"
+assert compute("[get [dissoc table 1500] 1500 0]") == "0"
+assert compute("[= [total [values table]] [total big]]") == "True"
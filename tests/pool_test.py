@@ -0,0 +1,123 @@
+import threading
+
+from src.tea import InterpreterPool
+
+from . import *
+
+pool = InterpreterPool(
+    size=2,
+    modules=["math"],
+    setup="[var greeting [quote hello]] [def twice [x] [* x 2]]",
+    engine=tea.engine,
+)
+
+# Every interpreter starts from the base environment
+assert pool.cmp("[twice [[prop math square] 3]]") == "18"
+assert pool.cmp("greeting") == "hello"
+
+# What a caller defines stays in its interpreter, until it is returned
+with pool.interpreter() as first, pool.interpreter() as second:
+    assert first.cmp("[var secret 42]") == "42"
+    assert first.cmp("[set greeting [quote bye]]") == "bye"
+    assert second.cmp("greeting") == "hello"
+    try:
+        second.cmp("secret")
+        assert False
+    except Exception as error:
+        assert str(error) == "Variable not defined: secret"
+    # The pool is full
+    try:
+        pool.checkout(timeout=0.01)
+        assert False
+    except TimeoutError:
+        pass
+
+assert pool.started == 2
+assert pool.cmp("greeting") == "hello"
+assert pool.base.cmp("greeting") == "hello"
+try:
+    pool.cmp("secret")
+    assert False
+except Exception as error:
+    assert str(error) == "Variable not defined: secret"
+
+# The default global environment is left alone
+try:
+    compute("twice")
+    assert False
+except Exception as error:
+    assert str(error) == "Variable not defined: twice"
+
+# Concurrent callers each get an interpreter of their own
+results = {}
+
+
+def request(n):
+    with pool.interpreter() as interpreter:
+        interpreter.cmp(f"[var n {n}]")
+        for _ in range(50):
+            interpreter.cmp("[set n [+ n 1]]")
+        results[n] = interpreter.cmp("n")
+
+
+threads = [threading.Thread(target=request, args=(n * 1000,)) for n in range(8)]
+for thread in threads:
+    thread.start()
+for thread in threads:
+    thread.join()
+assert results == {n * 1000: str(n * 1000 + 50) for n in range(8)}
+assert pool.started == 2
+
+# Functions of the setup write to the environments of their interpreter
+counting = InterpreterPool(
+    size=1,
+    setup="""
+    [var count 0]
+    [def bump [] [set count [+ count 1]]]
+    [def current [] count]
+    [def make-counter [] [begin [var n 0] [lambda [] [++ n]]]]
+    [var tick [make-counter]]
+    [var bumps [list bump]]
+    [class Box null [def constructor [this] [set [prop this value] 0]]]
+    [var box [new Box]]
+    """,
+    engine=tea.engine,
+)
+assert counting.cmp("[bump] [[get bumps 0]] count") == "2"
+assert counting.cmp("[current]") == "0"
+assert counting.base.cmp("count") == "0"
+assert counting.cmp("[tick] [tick]") == "2"
+assert counting.cmp("[tick]") == "1"
+assert counting.cmp("[set [prop box value] 5] [prop box value]") == "5"
+assert counting.cmp("[prop box value]") == "0"
+
+# Code of the setup imports, instantiates and memoizes in the interpreter that
+# runs it
+isolated = InterpreterPool(
+    size=2,
+    setup="""
+    [var made 0]
+    [class Box null [def constructor [this] [set made [+ made 1]]]]
+    [def load-math [] [import math]]
+    [def make-box [] [new Box]]
+    [def square [x] [* x x]]
+    [var remembered null]
+    [def remember [] [set remembered [memo square]]]
+    """,
+    engine=tea.engine,
+)
+with isolated.interpreter() as first, isolated.interpreter() as second:
+    assert first.cmp("[load-math] [[prop math square] 3]") == "9"
+    assert first.cmp("[make-box] [make-box] made") == "2"
+    assert first.cmp("[remember] [remembered 4]") == "16"
+    assert first.global_env.lookup("remembered").tea is first
+    assert second.cmp("made") == "0"
+    assert second.cmp("remembered") == "None"
+    for interpreter in (isolated.base, second):
+        assert "math" not in interpreter.modules
+        try:
+            interpreter.cmp("math")
+            assert False
+        except Exception as error:
+            assert str(error) == "Variable not defined: math"
+assert isolated.base.cmp("made") == "0"
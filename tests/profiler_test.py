@@ -0,0 +1,49 @@
+import itertools
+
+from src.tea import Tea
+
+for engine in ("closure", "tree"):
+    profiled = Tea(engine=engine, profile=True)
+    profiled.profiler.clock = itertools.count().__next__  # a second per tick
+    assert (
+        profiled.cmp(
+            """
+[def square [x] [* x x]]
+[def sum_squares [n] [if [= n 0] 0 [+ [square n] [sum_squares [- n 1]]]]]
+[sum_squares 10]
+"""
+        )
+        == "385"
+    )
+
+    stats = profiled.profiler.stats
+    assert stats["def:square"][0] == 10
+    assert stats["def:sum_squares"][0] == 11
+    assert stats["native:*"][0] == 10
+    assert stats["form:if"][0] == 11
+    [calls, cumulative, self_time] = stats["def:sum_squares"]
+    assert cumulative > self_time > 0
+    assert profiled.profiler.report().splitlines()[0].split() == [
+        "calls",
+        "cumulative",
+        "ms",
+        "self",
+        "ms",
+        "name",
+    ]
+    assert "def:sum_squares;form:if;def:square;native:* " in (
+        profiled.profiler.collapsed()
+    )
+
+# Tail calls leave the stack before the next call is timed
+profiled = Tea(profile=True)
+assert profiled.cmp("[def down [n] [if [= n 0] 0 [down [- n 1]]]] [down 5000]") == "0"
+assert profiled.profiler.stats["def:down"][0] == 5001
+stacks = profiled.profiler.collapsed().splitlines()
+assert max(len(stack.split(";")) for stack in stacks) < 4
+
+try:
+    Tea(engine="vm", profile=True)
+    assert False
+except ValueError:
+    pass
@@ -0,0 +1,57 @@
+from . import *
+
+from src.tea import PropertyCache
+
+assert (
+    compute(
+        """
+[class Animal null
+    [begin
+        [def constructor [this] 0]
+        [def sound [this] 1]
+    ]
+]
+[class Dog Animal [begin [def constructor [this] 0]]]
+[class Cat Animal [begin [def constructor [this] 0]]]
+[def speak [pet] [[prop pet sound] pet]]
+[var rex [new Dog]]
+
+[var heard [speak rex]]
+[set [prop Dog sound] [lambda [this] 20]]
+[set heard [+ heard [speak rex]]]
+[set [prop Animal sound] [lambda [this] 300]]
+[set heard [+ heard [speak [new Cat]]]]
+[set [prop rex sound] [lambda [this] 4000]]
+[set heard [+ heard [speak rex]]]
+[class Dog Animal [begin [def constructor [this] 0]]]
+[+ heard [speak [new Dog]]]
+"""
+    )
+    == "4621"  # 1 + 20 + 300 + 4000 + 300
+)
+
+# One site, several classes: polymorphic, then the oldest make way
+cache = PropertyCache("sound")
+for name in ("Animal", "Dog", "Cat", "rex", "Animal"):
+    cache.lookup(tea.global_env.lookup(name))
+assert len(cache.entries) == 3  # rex's own sound is not cached
+for n in range(PropertyCache.SIZE):
+    compute(f"[class Pet{n} Animal [begin [def constructor [this] 0]]]")
+    cache.lookup(tea.global_env.lookup(f"Pet{n}"))
+assert len(cache.entries) == PropertyCache.SIZE
+assert cache.lookup(tea.global_env.lookup("Pet3")) is tea.global_env.lookup(
+    "Animal"
+).lookup("sound")
+pet3 = tea.global_env.lookup("Pet3")
+assert pet3 in cache.entries
+assert tea.global_env.lookup("Animal") not in cache.entries
+
+# A change to another class keeps the entry; one on the way to sound drops it
+entry = cache.entries[pet3]
+compute("[class Bird null [begin [def constructor [this] 0]]]")
+compute("[set [prop Bird sound] [lambda [this] 2]]")
+cache.lookup(pet3)
+assert cache.entries[pet3] is entry
+compute("[set [prop Pet3 name] 5]")
+cache.lookup(pet3)
+assert cache.entries[pet3] is not entry
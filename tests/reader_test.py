@@ -0,0 +1,41 @@
+import io
+
+from src.tea import Reader
+
+
+class Lines:
+    """A stream that counts how many lines were read from it."""
+
+    def __init__(self, text):
+        self.lines = io.StringIO(text)
+        self.read = 0
+
+    def readline(self):
+        self.read += 1
+        return self.lines.readline()
+
+
+stream = Lines(
+    """/* a comment with [ brackets ]
+spanning lines */ [def square [x]
+    [* x x]]
+[quote ["a [string] with brackets"]]
+[square 3]
+"""
+)
+forms = iter(Reader(stream))
+
+# The first form is ready as soon as its brackets balance
+assert next(forms) == ["def", "square", ["x"], ["*", "x", "x"]]
+assert stream.read == 3
+assert next(forms) == ["quote", ['"a', "[string]", "with", 'brackets"']]
+assert next(forms) == ["square", 3]
+assert next(forms, None) is None
+
+for text, message in [("[+ 1 2", "Unexpected EOF"), ("1 /* 2", "Unterminated comment")]:
+    try:
+        list(Reader(io.StringIO(text)))
+    except SyntaxError as error:
+        assert str(error) == message
+    else:
+        assert False, text
@@ -0,0 +1,53 @@
+from . import *
+
+# A variable is visible from the enclosing block until its own `var` runs
+assert (
+    compute(
+        """
+[var y 1]
+[begin
+    [var z y]
+    [var y 2]
+    [+ z y]
+]
+"""
+    )
+    == "3"
+)
+assert (
+    compute(
+        """
+[def counter []
+    [begin
+        [var n 0]
+        [lambda [] [begin [++ n] n]]
+    ]
+]
+[var tick [counter]]
+[tick]
+[tick]
+"""
+    )
+    == "2"
+)
+# Methods reach the locals of the function the class is declared in
+assert (
+    compute(
+        """
+[def make [a]
+    [begin
+        [class Box null
+            [begin
+                [def constructor [self] [set [prop self b] 1]]
+                [def get [self] [+ a [prop self b]]]
+            ]
+        ]
+        [var box [new Box]]
+        [[prop box get] box]
+    ]
+]
+[make 41]
+"""
+    )
+    == "42"
+)
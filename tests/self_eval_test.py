@@ -7,8 +7,7 @@ expressions = [
     ('[quote ["some text"]]', '["some text"]'),
     ('[quote ["  some text   "]]', '[" some text "]'),  # this is weird
     ('[quote [some    text]]', "[some text]"),  # this is weird
-    # TODO comments
-    # ("10 /* some C-style comment */", "10"),
+    ("10 /* some C-style comment */", "10"),
 ]
 
 for expr, result in expressions:
@@ -0,0 +1,77 @@
+import os
+import tempfile
+
+from src.tea import BUILTINS, Environment, Tea
+
+from . import *
+
+prelude = """
+[import math]
+[var plus +]
+[def make-counter [] [begin [var n 0] [lambda [] [++ n]]]]
+[var tick [make-counter]]
+[tick]
+[class Point null [begin
+    [def constructor [this x y] [begin
+        [set [prop this x] x]
+        [set [prop this y] y]]]
+    [def norm [this] [+ [* [prop this x] [prop this x]]
+                        [* [prop this y] [prop this y]]]]]]
+[var p [new Point 3 4]]
+[set [prop p label] [quote origin]]
+[defmemo fib [n] [if [< n 2] n [+ [fib [- n 1]] [fib [- n 2]]]]]
+[var data [list 1 -2.5 [dict [quote a] null]]]
+"""
+
+
+def fresh():
+    return Tea(Environment(dict(BUILTINS)), engine=tea.engine)
+
+
+with tempfile.TemporaryDirectory() as directory:
+    path = os.path.join(directory, "prelude.teas")
+    cold = fresh()
+    cold.cmp(prelude)
+    cold.snapshot(path)
+
+    with open(path, mode="rb") as f:
+        assert f.read(4) == b"TEAS"
+
+    warm = fresh()
+    warm.restore(path)
+
+    # Closures keep the environment they captured
+    assert warm.cmp("[tick]") == "2"
+    assert warm.cmp("[tick]") == "3"
+    assert cold.cmp("[tick]") == "2"
+
+    # Classes, instances and memoized functions
+    assert warm.cmp("[[prop p norm] p]") == "25"
+    assert warm.cmp("[prop p label]") == "origin"
+    assert warm.cmp("[[prop [new Point 1 2] norm] [new Point 1 2]]") == "5"
+    assert warm.cmp("[fib 60]") == "1548008755920"
+
+    # Modules are imported, and builtins are found by name
+    assert "math" in warm.modules
+    assert warm.cmp("[[prop math square] 7]") == "49"
+    assert warm.global_env.lookup("plus") is BUILTINS["+"]
+    assert warm.cmp("data") == "[1 -2.5 {a None}]"
+
+    # Natives that cannot be pickled cannot be saved
+    unsaved = fresh()
+    unsaved.global_env.define("answer", lambda: 42)
+    try:
+        unsaved.snapshot(path)
+    except Exception as error:
+        assert "cannot be pickled" in str(error)
+    else:
+        assert False
+
+    with open(path, mode="wb") as f:
+        f.write(b"not a snapshot")
+    try:
+        fresh().restore(path)
+    except Exception as error:
+        assert str(error) == "Not a tea snapshot of version 1"
+    else:
+        assert False
@@ -0,0 +1,65 @@
+import io
+import sys
+
+from src.tea import BUILTINS, Environment, Reader, SourceMap, Tea, execute
+
+from . import *
+
+# Positions live in a side table, by list
+sources = SourceMap()
+body = sources.parse("[var x 1]\n  [+ x\n    [* 2 3]]", "sample.tea")
+assert body == ["begin", ["var", "x", 1], ["+", "x", ["*", 2, 3]]]
+assert sources.where(body[1]) == "sample.tea:1:1"
+assert sources.where(body[2]) == "sample.tea:2:3"
+assert sources.where(body[2][2]) == "sample.tea:3:5"
+assert sources.where(["+", "x", ["*", 2, 3]]) is None
+
+# The reader knows where the lines of the form it read start, and no more
+offsets = {}
+reader = Reader(io.StringIO("[a]\n[b\n c]\n"), offsets)
+forms = [sources.add(form, offsets, "stream.tea", reader.locate) for form in reader]
+assert (reader.line, reader.lines) == (2, [4, 7, 11])
+assert [sources.where(form) for form in forms] == ["stream.tea:1:1", "stream.tea:2:1"]
+
+# Once its form ran, only the function bodies of a program keep their positions
+program = sources.parse("[def f [x] [g x]]\n[f [h 1]]", "kept.tea")
+[_, [_, _, _, body], call] = program
+sources.release()
+assert sources.where(body) == "kept.tea:1:12"
+assert sources.where(call) is None and sources.where(forms[0]) is None
+
+program = """[def inverse [x] [/ 1 x]]
+[def total [xs] [begin
+    [var sum 0]
+    [for [var i 0] [< i [count xs]] [++ i]
+        [set sum [+ sum [inverse [get xs i]]]]]
+    sum]]
+[total [list 1 2 0]]
+"""
+
+# An error reports the tea call stack, with the def names and locations
+failing = Tea(Environment(dict(BUILTINS)), engine=tea.engine)
+output = io.StringIO()
+real_stdout, sys.stdout = sys.stdout, output
+try:
+    assert execute(failing, io.StringIO(program), "scores.tea") is False
+finally:
+    sys.stdout = real_stdout
+assert output.getvalue().splitlines()[-4:] == [
+    "Error: division by zero",
+    "  at inverse (scores.tea:1:18)",
+    "  at total (scores.tea:5:25)",
+    "  at top level (scores.tea:7:1)",
+]
+
+# Code that was not read from a source has no location
+try:
+    failing.cmp("[total [list 0]]")
+except ZeroDivisionError as error:
+    assert failing.call_stack(error) == [
+        ("inverse", "scores.tea:1:18"),
+        ("total", "scores.tea:5:25"),
+        ("top level", None),
+    ]
+else:
+    assert False
@@ -0,0 +1,85 @@
+from src.tea import BUILTINS, Environment, LimitExceeded, Limits, Tea
+
+from . import *
+
+
+def fresh(**options):
+    return Tea(Environment(dict(BUILTINS)), **options)
+
+
+kernels = """
+[def harmonic [n] [begin
+    [var sum 0]
+    [while [> n 0] [begin [+= sum [/ 1 n]] [-- n]]]
+    sum]]
+[def collatz [n] [begin
+    [var steps 0]
+    [while [> n 1] [begin
+        [set n [if [= [% n 2] 0] [// n 2] [+ [* 3 n] 1]]]
+        [++ steps]]]
+    steps]]
+[var total 0]
+[for [var i 0] [< i 1000] [++ i]
+    [set total [+ total [% [* i 3] 7]]]]
+"""
+
+generic = fresh(engine=tea.engine)
+generic.cmp(kernels)
+fast = fresh(specialize=True)
+fast.cmp(kernels)
+specializer = fast.compiler.specializer
+assert specializer.translated > 0
+
+# Same results as the generic closures, on ints and on floats
+for call in ("total", "[harmonic 100]", "[harmonic 2.5]", "[collatz 27]"):
+    assert fast.cmp(call) == generic.cmp(call), call
+
+# The loop sets the variables of its environment
+assert fast.cmp("[var k 0] [while [< k 10] [++ k]] k") == "10"
+assert fast.cmp("[begin [var x 1.5] [while [< x 100] [set x [* x 2]]] x]") == "192.0"
+
+# Other values fail the type guard and run the generic code
+fallbacks = specializer.fallbacks
+assert fast.cmp(
+    "[var s [quote a]] [var n 0] [while [< n 3] [begin [set s [+ s s]] [++ n]]] s"
+) == "aaaaaaaa"
+assert specializer.fallbacks > fallbacks
+
+# Limits count the iterations of a kernel
+try:
+    fast.cmp("[var spin 0] [while [< spin 1000000] [++ spin]]", Limits(steps=100))
+except LimitExceeded as error:
+    assert error.limit == "steps"
+else:
+    assert False
+assert fast.cmp("spin") == "101"
+
+# Errors are raised as they are by the generic code
+try:
+    fast.cmp("[var d 3] [while [>= d 0] [begin [set total [/ 1 d]] [-- d]]]")
+except ZeroDivisionError:
+    assert fast.cmp("d") == "0"
+else:
+    assert False
+
+# Kernels run the builtin operators only while they are not rebound
+rebinding = fresh(specialize=True)
+rebinding.cmp(
+    """
+    [def triple [x] [begin
+        [var r 0]
+        [var k 0]
+        [while [< k 3] [begin [+= r x] [++ k]]]
+        r]]
+    """
+)
+assert rebinding.cmp("[triple 5]") == "15"
+assert rebinding.cmp("[set < >=] [triple 5]") == "0"
+
+# Only the closure engine specializes
+try:
+    Tea(engine="vm", specialize=True)
+except ValueError as error:
+    assert str(error) == "The vm engine cannot specialize"
+else:
+    assert False
@@ -0,0 +1,39 @@
+from . import *
+
+# The tree-walking engine recurses on the Python stack
+if tea.engine != "tree":
+    assert (
+        compute(
+            """
+[def count_down [n]
+    [if [= n 0]
+        n
+        [begin
+            [var next [- n 1]]
+            [count_down next]
+        ]
+    ]
+]
+
+[count_down 20000]
+"""
+        )
+        == "0"
+    )
+
+# Non-tail recursion as deep as memory allows
+stack_tea = Tea(engine="stack")
+
+assert (
+    stack_tea.cmp(
+        """
+[def sum_to [n]
+    [if [= n 0]
+        0
+        [+ n [sum_to [- n 1]]]]]
+
+[sum_to 20000]
+"""
+    )
+    == "200010000"
+)
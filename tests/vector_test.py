@@ -0,0 +1,52 @@
+import pytest
+
+pytest.importorskip("numpy")
+
+from . import *
+
+compute(
+    """
+[import vector]
+[import math]
+[var v [[prop vector range] 5]]
+[var w [[prop vector linspace] 0 1 5]]
+"""
+)
+
+# Elementwise operators, with broadcasting
+assert compute("[+ v w]") == "[0.0 1.25 2.5 3.75 5.0]"
+assert compute("[* v 2]") == "[0 2 4 6 8]"
+assert compute("[- 10 v v]") == "[10 8 6 4 2]"
+assert compute("[< v 2]") == "[True True False False False]"
+
+# Constructors, indexing and slicing
+assert compute("[[prop vector of] 1 2.5]") == "[1.0 2.5]"
+assert compute("[[prop vector array] [quote [3 2 1]]]") == "[3 2 1]"
+assert compute("[[prop vector zeros] 2]") == "[0.0 0.0]"
+assert compute("[[prop vector length] v]") == "5"
+assert compute("[[prop vector at] v 2]") == "2"
+assert compute("[[prop vector slice] v 1 4]") == "[1 2 3]"
+assert compute("[[prop vector slice] v 0 5 2]") == "[0 2 4]"
+
+# Reductions give plain numbers
+assert compute("[[prop vector sum] v]") == "10"
+assert compute("[[prop vector min] [- v 2]]") == "-2"
+assert compute("[[prop vector max] w]") == "1.0"
+assert compute("[[prop vector dot] v v]") == "30"
+assert compute("[+ [[prop vector sum] v] 1]") == "11"
+
+# Mapping natives and tea functions
+assert compute("[[prop vector square] v]") == "[0 1 4 9 16]"
+assert compute("[[prop vector map] [prop math square] v]") == "[0 1 4 9 16]"
+assert compute("[[prop vector map] [prop math abs] [- v 2]]") == "[2 1 0 1 2]"
+assert compute("[[prop vector map] [lambda [x] [* x 10]] v]") == "[0 10 20 30 40]"
+
+# Only pure arithmetic runs on the whole vector: effects happen once per element
+compute("[var calls 0]")
+effects = "[lambda [x] [begin [++ calls] [* x 2]]]"
+assert compute(f"[[prop vector map] {effects} v]") == "[0 2 4 6 8]"
+assert compute("calls") == "5"
+assert compute("[[prop vector map] [lambda [x] [if [> x 2] x 0]] v]") == "[0 0 0 3 4]"
+compute("[var m [[prop vector array] [quote [[1 2] [3 4]]]]]")
+rows = "[lambda [row] [[prop vector sum] row]]"
+assert compute(f"[[prop vector map] {rows} m]") == "[3 7]"
@@ -0,0 +1,50 @@
+from src.tea import CodeBuilder
+
+from . import *
+
+vm_tea = Tea(engine="vm")
+
+assert (
+    vm_tea.cmp(
+        """
+[class Counter null
+    [begin
+        [def constructor [self start]
+            [set [prop self count] start]]
+        [def step [self]
+            [begin
+                [++ [prop self count]]
+                [prop self count]
+            ]
+        ]
+    ]
+]
+
+[var counter [new Counter 10]]
+[[prop counter step] counter]
+[[prop counter step] counter]
+"""
+    )
+    == "12"
+)
+# Calls do not recurse on the Python stack
+assert (
+    vm_tea.cmp(
+        """
+[def depth [n]
+    [if [= n 0]
+        0
+        [+ 1 [depth [- n 1]]]]]
+
+[depth 20000]
+"""
+    )
+    == "20000"
+)
+
+# Constants are shared by type and value
+builder = CodeBuilder()
+assert [builder.const(value) for value in (1, 1.0, True, 1, "1", 1.0)] == [
+    0, 1, 2, 0, 3, 1
+]
+assert builder.const([1]) != builder.const([1])